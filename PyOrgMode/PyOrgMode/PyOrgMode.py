@@ -26,15 +26,34 @@ The PyOrgMode class is able to read,modify and create orgfiles. The internal
 representation of the file allows the use of orgfiles easily in your projects.
 """
 
+import array
+import datetime
 import io
+import itertools
+import mmap
+import os
 import re
 import time
+import unicodedata
 
+try:
+    from itertools import izip, izip_longest
+except ImportError:  # Python 3
+    izip = zip
+    from itertools import zip_longest as izip_longest
 
-class OrgDate:
+try:
+    basestring
+except NameError:  # Python 3
+    basestring = unicode = str
+    xrange = range
+
+
+class OrgDate(object):
     """Functions for date management"""
+    # The timestamp is only parsed when its value is first used
+    __slots__ = ("_text", "_parsed", "_format", "_value", "_end", "_repeat")
 
-    format = 0
     TIMED = 1
     DATED = 2
     WEEKDAYED = 4
@@ -52,127 +71,199 @@ class OrgDate:
                'clock': '([0-9]{1}):([0-9]{2})',
                'repeat': '[\+\.]{1,2}\d+[dwmy]'}
 
+    # Anchored, so that the weekday doesn't take the hours when there is
+    # no weekday
+    DATETIME_RE = re.compile(
+        '(?P<date>{date})(\s+(?P<time>{time}))?$'.format(**DICT_RE), re.U)
+    # time range on a single day
+    TIME_RANGE_RE = re.compile(
+        ('{start}(?P<date>{date})\s+(?P<time1>{time})'
+         '-(?P<time2>{time}){end}').format(**DICT_RE), re.U)
+    # date range over several days
+    DATE_RANGE_RE = re.compile(
+        ('{start}(?P<date1>{date}(\s+{time})?){end}--'
+         '{start}(?P<date2>{date}(\s+{time})?){end}').format(**DICT_RE),
+        re.U)
+    # single date with no range
+    DATE_RE = re.compile(
+        ('{start}(?P<datetime>{date}(\s+{time})?)'
+         '(\s+(?P<repeat>{repeat}))?{end}').format(**DICT_RE), re.U)
+    # clocked time
+    CLOCK_RE = re.compile('(?P<clocked>{clock})'.format(**DICT_RE))
+    # The usual timestamps, e.g. [2011-04-01 Fri 10:00], which are parsed
+    # without the patterns above
+    SIMPLE_RE = re.compile('[[<]([0-9]{4})-([0-9]{2})-([0-9]{2})'
+                           '(\s+[\w.]+)?(?:\s+([0-9]{2}):([0-9]{2}))?[]>]$',
+                           re.U)
+
+    # The parsed timestamps by their text. Once PARSED holds PARSED_SIZE
+    # of them, it replaces PARSED_BEFORE: the timestamps which haven't been
+    # used since are forgotten, like in a LRU cache.
+    PARSED = {}
+    PARSED_BEFORE = {}
+    PARSED_SIZE = 4096
+
     def __init__(self, value=None):
         """
         Initialisation of an OrgDate element.
         """
         self.set_value(value)
 
-    def parse_datetime(self, s):
+    def _field(name):
+        """A property parsing the timestamp when it is first read. Setting
+        it makes get_value format the date instead of returning its text."""
+        slot = "_" + name
+
+        def get(self):
+            if not self._parsed:
+                self._parse()
+            return getattr(self, slot)
+
+        def set(self, value):
+            if not self._parsed:
+                self._parse()
+            setattr(self, slot, value)
+            self._text = None
+        return property(get, set)
+
+    format = _field("format")
+    value = _field("value")
+    end = _field("end")
+    repeat = _field("repeat")
+    del _field
+
+    @staticmethod
+    def struct_time(year, month, day, hour=0, minute=0):
+        """The time.struct_time time.strptime returns for this date"""
+        return datetime.datetime(year, month, day, hour, minute).timetuple()
+
+    @classmethod
+    def parse_datetime(cls, s):
         """
         Parses an org-mode date time string.
-        Returns (timed, weekdayed, time_struct, repeat).
-        """
-        search_re = '(?P<date>{date})(\s+(?P<time>{time}))?'.format(
-            **self.DICT_RE)
-        s = re.search(search_re, s)
-
-        weekdayed = (len(s.group('date').split()) > 1)
-        weekday_suffix = ""
-        if weekdayed is True:
-            weekday_suffix = s.group('date').split()[1]
-        formats = {
-            'timed_weekday': [True, '{0} {1} {2}', '%Y-%m-%d %a %H:%M'],
-            'timed': [True, '{0} {2}', '%Y-%m-%d %H:%M'],
-            'nottimed_weekday': [False, '{0} {1}', '%Y-%m-%d %a'],
-            'nottimed': [False, '{0}', '%Y-%m-%d'],
-        }
-
+        Returns (timed, weekdayed, time_struct).
+        """
+        s = cls.DATETIME_RE.search(s)
         # We ignore weekdays (e.g. "Mon", "Tue") because a single org file
         # could mix dates in many locales, e.g. if it was edited through
         # many compters, each with a different language
-        PARSE_WEEKDAYS=False
-
-        if s.group('time'):
-            if weekday_suffix == "" or not PARSE_WEEKDAYS:
-                format_date = 'timed'
-            else:
-                format_date = 'timed_weekday'
+        date = s.group('date')
+        weekdayed = (len(date.split()) > 1)
+        timed = s.group('time') is not None
+        # The date and time have a fixed layout: 2011-04-01 10:00
+        if timed:
+            clock = s.group('time')
+            value = cls.struct_time(int(date[0:4]), int(date[5:7]),
+                                    int(date[8:10]),
+                                    int(clock[0:2]), int(clock[3:5]))
         else:
-            if weekday_suffix == "" or not PARSE_WEEKDAYS:
-                format_date = 'nottimed'
-            else:
-                format_date = 'nottimed_weekday'
+            value = cls.struct_time(int(date[0:4]), int(date[5:7]),
+                                    int(date[8:10]))
+        return timed, weekdayed, value
 
-        return (formats[format_date][0], weekdayed,
-                time.strptime(
-                    formats[format_date][1].format(s.group('date').split()[0],
-                                                   weekday_suffix,
-                                                   s.group('time')),
-                    formats[format_date][2]))
-
-    def set_value(self, value):
+    @classmethod
+    def parse(cls, value):
         """
-        Setting the value of this element (automatic recognition of format)
+        The (format, value, end, repeat) of the timestamp value (automatic
+        recognition of format), remembered for the next timestamps with the
+        same text
         """
-        self.value = None  # By default…
+        parsed = cls.PARSED.get(value)
+        if parsed is None:
+            parsed = cls.PARSED_BEFORE.get(value)
+            if parsed is None:
+                parsed = cls._parse_timestamp(value)
+            if len(cls.PARSED) >= cls.PARSED_SIZE:
+                cls.PARSED_BEFORE = cls.PARSED
+                cls.PARSED = {}
+            cls.PARSED[value] = parsed
+        return parsed
+
+    @classmethod
+    def _parse_timestamp(cls, value):
+        format = 0
+        if not value:
+            return format, None, None, None
         # Checking whether it is an active date-time or not
         if value[0] == '<':
-            self.format |= self.ACTIVE
+            format |= cls.ACTIVE
         elif value[0] == '[':
-            self.format |= self.INACTIVE
+            format |= cls.INACTIVE
 
-        # time range on a single day
-        search_re = ('{start}(?P<date>{date})\s+(?P<time1>{time})'
-                     '-(?P<time2>{time}){end}').format(**self.DICT_RE)
-        match = re.search(search_re, value)
+        match = cls.SIMPLE_RE.match(value)
+        if match:
+            year, month, day, weekday, hour, minute = match.groups()
+            format |= cls.DATED
+            if weekday:
+                format |= cls.WEEKDAYED
+            if hour is None:
+                start = cls.struct_time(int(year), int(month), int(day))
+            else:
+                format |= cls.TIMED
+                start = cls.struct_time(int(year), int(month), int(day),
+                                        int(hour), int(minute))
+            return format, start, None, None
 
+        match = cls.TIME_RANGE_RE.search(value)
         if match:
-            timed, weekdayed, self.value = self.parse_datetime(
+            timed, weekdayed, start = cls.parse_datetime(
                 match.group('date') + ' ' + match.group('time1'))
             if weekdayed:
-                self.format |= self.WEEKDAYED
-            timed, weekdayed, self.end = self.parse_datetime(
+                format |= cls.WEEKDAYED
+            timed, weekdayed, end = cls.parse_datetime(
                 match.group('date') + ' ' + match.group('time2'))
+            format |= cls.TIMED | cls.DATED | cls.RANGED
+            return format, start, end, None
 
-            self.format |= self.TIMED | self.DATED | self.RANGED
-            return
-        # date range over several days
-        search_re = ('{start}(?P<date1>{date}(\s+{time})?){end}--'
-                     '{start}(?P<date2>{date}(\s+{time})?){end}').format(
-            **self.DICT_RE)
-        match = re.search(search_re, value)
+        match = cls.DATE_RANGE_RE.search(value)
         if match:
-            timed, weekdayed, self.value = self.parse_datetime(
-                match.group('date1'))
+            timed, weekdayed, start = cls.parse_datetime(match.group('date1'))
             if timed:
-                self.format |= self.TIMED
+                format |= cls.TIMED
             if weekdayed:
-                self.format |= self.WEEKDAYED
-            timed, weekdayed, self.end = self.parse_datetime(
-                match.group('date2'))
-            self.format |= self.DATED | self.RANGED
-            return
-        # single date with no range
-        search_re = ('{start}(?P<datetime>{date}(\s+{time})?)' +
-                     '(\s+(?P<repeat>{repeat}))?{end}').format(
-                        **self.DICT_RE)
-        match = re.search(search_re, value)
+                format |= cls.WEEKDAYED
+            timed, weekdayed, end = cls.parse_datetime(match.group('date2'))
+            format |= cls.DATED | cls.RANGED
+            return format, start, end, None
+
+        match = cls.DATE_RE.search(value)
         if match:
-            timed, weekdayed, self.value = self.parse_datetime(
+            timed, weekdayed, start = cls.parse_datetime(
                 match.group('datetime'))
-            if match.group('repeat'):
-                self.repeat = match.group('repeat')
-                self.format |= self.REPEAT
-            self.format |= self.DATED
+            repeat = match.group('repeat')
+            if repeat:
+                format |= cls.REPEAT
+            format |= cls.DATED
             if timed:
-                self.format |= self.TIMED
+                format |= cls.TIMED
             if weekdayed:
-                self.format |= self.WEEKDAYED
-            self.end = None
-            return
-        # clocked time
-        search_re = '(?P<clocked>{clock})'.format(**self.DICT_RE)
-        match = re.search(search_re, value)
-        if match:
-            self.value = value
-            self.format |= self.CLOCKED
+                format |= cls.WEEKDAYED
+            return format, start, None, repeat
+
+        if cls.CLOCK_RE.search(value):
+            return format | cls.CLOCKED, value, None, None
+        return format, None, None, None
+
+    def _parse(self):
+        (self._format, self._value,
+         self._end, self._repeat) = self.parse(self._text)
+        self._parsed = True
+
+    def set_value(self, value):
+        """
+        Setting the value of this element. It is parsed when it is first
+        used, until it is changed get_value returns it as it is.
+        """
+        self._text = value
+        self._parsed = False
 
     def get_value(self):
         """
         Get the timestamp as a text according to the format
         """
 
+        if self._text is not None:
+            return self._text
         if self.value is None:
             return ""
 
@@ -231,10 +322,21 @@ class OrgDate:
                     self.value)
 
 
+# The characters matched by \s
+WHITESPACE = " \t\n\r\f\v"
+
+
 class OrgPlugin:
     """
     Generic class for all plugins
     """
+    # The lines this plugin can treat, used by OrgDataStructure to give each
+    # line only to the plugins which can treat it: the characters they can
+    # start with and a regular expression (without capturing groups) that
+    # matches their beginning. None means any line.
+    first_chars = None
+    prefilter = None
+
     def __init__(self):
         """ Generic initialization """
         self.treated = True
@@ -260,6 +362,11 @@ class OrgPlugin:
         self.treated = False
         return current
 
+    def active(self, current):
+        """Returns True if the plugin has to see the next line whatever it
+        is, because current is an element it has opened."""
+        return False
+
     def _append(self, current, element):
         """ Internal function that adds to current. """
         if self.keepindent and hasattr(element, "set_indent"):
@@ -278,10 +385,62 @@ class OrgPlugin:
         return current
 
 
-class OrgElement:
+def write_element(stream, element):
+    """Writes element, an OrgElement or a line of text, to stream"""
+    if isinstance(element, OrgElement):
+        element.write_to(stream)
+    else:
+        stream.write(element)
+
+
+NON_ASCII = re.compile(u"[^\x00-\x7f]")
+
+
+def display_width(text):
+    """The number of columns text takes in a terminal (or in Emacs)"""
+    text = unicode(text)
+    width = len(text)
+    for char in NON_ASCII.findall(text):
+        if unicodedata.combining(char):
+            width -= 1
+        elif unicodedata.east_asian_width(char) in "WF":
+            width += 1
+    return width
+
+
+def display_widths(texts):
+    """The display_width of each of texts"""
+    try:
+        u"".join(texts).encode("ascii")
+    except UnicodeError:
+        return map(display_width, texts)
+    return map(len, texts)
+
+
+class _Chunks(list):
+    """A list of the chunks written to it, used as an in-memory stream"""
+    write = list.append
+
+
+class _TextStream:
+    """Wraps a text file to write byte strings to it as well"""
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, chunk):
+        self.stream.write(unicode(chunk))
+
+
+class OrgElement(object):
     """
     Generic class for all Elements excepted text and unrecognized ones
     """
+    # The elements define the attributes they have in __slots__, instead of
+    # each having a __dict__
+    __slots__ = ("content", "parent", "level", "indent")
+    # The content of the elements which can't contain others, shared by them
+    NO_CONTENT = ()
+
     def __init__(self):
         self.content = []
         self.parent = None
@@ -303,12 +462,25 @@ class OrgElement:
 
     def output(self):
         """ Wrapper for the text output. """
-        return self.indent+self._output()
+        chunks = _Chunks()
+        self.write_to(chunks)
+        return "".join(chunks)
+
+    def write_to(self, stream):
+        """ Writes the text output to stream (anything with a write method)
+        in chunks, without building it as one string. """
+        stream.write(self.indent)
+        self._write_to(stream)
 
     def _output(self):
         """ This is the function really used by the plugin. """
         return ""
 
+    def _write_to(self, stream):
+        """ Used by the elements containing other ones, the others only
+        define _output. """
+        stream.write(self._output())
+
     def __str__(self):
         """ Used to return a text when called. """
         return self.output()
@@ -339,11 +511,13 @@ class OrgTodo():
 
 class OrgClock(OrgPlugin):
     """Plugin for Clock elements"""
+    prefilter = ".*?CLOCK:"
+
     def __init__(self):
         OrgPlugin.__init__(self)
         self.regexp = re.compile(
-            "(?:\s*)CLOCK:(?:\s*)((?:<|\[).*(?:>||\]))--\
-            ((?:<|\[).*(?:>||\])).+=>\s*(.*)")
+            "(?:\s*)CLOCK:(?:\s*)((?:<|\[).*(?:>||\]))--"
+            "((?:<|\[).*(?:>||\])).+=>\s*(.*)")
 
     def _treat(self, current, line):
         clocked = self.regexp.findall(line)
@@ -351,7 +525,8 @@ class OrgClock(OrgPlugin):
             self._append(current,
                          self.Element(clocked[0][0],
                                       clocked[0][1],
-                                      clocked[0][2]))
+                                      clocked[0][2],
+                                      line))
         else:
             self.treated = False
         return current
@@ -359,23 +534,35 @@ class OrgClock(OrgPlugin):
     class Element(OrgElement):
         """Clock is an element taking into account CLOCK elements"""
         TYPE = "CLOCK_ELEMENT"
+        __slots__ = ("start", "stop", "duration", "_line")
 
-        def __init__(self, start="", stop="", duration=""):
+        def __init__(self, start="", stop="", duration="", line=None):
             OrgElement.__init__(self)
+            self.content = self.NO_CONTENT
             self.start = OrgDate(start)
             self.stop = OrgDate(stop)
             self.duration = OrgDate(duration)
+            # The line the clock was parsed from and its values, the line is
+            # written as it is as long as they don't change
+            self._line = (line, start, stop, duration)
 
         def _output(self):
             """Outputs the Clock element in text format
             (e.g CLOCK: [2010-11-20 Sun 19:42]--[2010-11-20 Sun 20:14] => 0:32)
             """
+            line, start, stop, duration = self._line
+            if line is not None and (start, stop, duration) == (
+                    self.start.get_value(), self.stop.get_value(),
+                    self.duration.get_value()):
+                return line
             return "CLOCK: " + self.start.get_value() + "--" + \
                 self.stop.get_value() + " =>  "+self.duration.get_value()+"\n"
 
 
 class OrgSchedule(OrgPlugin):
     """Plugin for Schedule elements"""
+    prefilter = ".*?(?:SCHEDULED|DEADLINE|CLOSED): [<\[]"
+
     # TODO: Need to find a better way to do this
     def __init__(self):
         OrgPlugin.__init__(self)
@@ -413,9 +600,11 @@ class OrgSchedule(OrgPlugin):
         SCHEDULED = 2
         CLOSED = 4
         TYPE = "SCHEDULE_ELEMENT"
+        __slots__ = ("type", "scheduled", "deadline", "closed")
 
         def __init__(self, scheduled=[], deadline=[], closed=[]):
             OrgElement.__init__(self)
+            self.content = self.NO_CONTENT
             self.type = 0
 
             if scheduled != []:
@@ -445,10 +634,16 @@ class OrgSchedule(OrgPlugin):
 
 class OrgDrawer(OrgPlugin):
     """A Plugin for drawers"""
+    first_chars = ":" + WHITESPACE
+    prefilter = "\s*:\S.*:"
+
     def __init__(self):
         OrgPlugin.__init__(self)
         self.regexp = re.compile("^(?:\s*?)(?::)(\S.*?)(?::)\s*(.*?)$")
 
+    def active(self, current):
+        return isinstance(current, OrgDrawer.Element)
+
     def _treat(self, current, line):
         drawer = self.regexp.search(line)
         if isinstance(current, OrgDrawer.Element):  # We are in a drawer
@@ -474,23 +669,26 @@ class OrgDrawer(OrgPlugin):
     class Element(OrgElement):
         """A Drawer object, containing properties and text"""
         TYPE = "DRAWER_ELEMENT"
+        __slots__ = ("name",)
 
         def __init__(self, name=""):
             OrgElement.__init__(self)
             self.name = name
 
-        def _output(self):
-            output = ":" + self.name + ":\n"
+        def _write_to(self, stream):
+            stream.write(":" + self.name + ":\n")
             for element in self.content:
-                output = output + str(element) + "\n"
-            output = output + self.indent + ":END:\n"
-            return output
+                write_element(stream, element)
+                stream.write("\n")
+            stream.write(self.indent + ":END:\n")
 
     class Property(OrgElement):
         """A Property object, used in drawers."""
+        __slots__ = ("name", "value")
 
         def __init__(self, name="", value=""):
             OrgElement.__init__(self)
+            self.content = self.NO_CONTENT
             self.name = name
             self.value = value
 
@@ -501,10 +699,27 @@ class OrgDrawer(OrgPlugin):
 
 class OrgTable(OrgPlugin):
     """A plugin for table managment"""
+    first_chars = "|" + WHITESPACE
+    prefilter = "\s*\|"
+
+    # The cells org-mode counts as numbers (org-table-number-regexp)
+    NUMBER = re.compile("^(?:[<>]?[-+^.0-9]*[0-9][-+^.0-9eEdDx()%:]*"
+                        "|[<>]?[-+]?0[xX][0-9a-fA-F.]+"
+                        "|[<>]?[-+]?[0-9]+#[0-9a-zA-Z.]+|nan|[-+u]?inf)$")
+
     def __init__(self):
         OrgPlugin.__init__(self)
         self.regexp = re.compile("^\s*\|")
 
+    @staticmethod
+    def is_hline(row):
+        """Whether row is a separator like |---+---|"""
+        return (len(row) > 0 and isinstance(row[0], basestring) and
+                row[0].startswith("-"))
+
+    def active(self, current):
+        return isinstance(current, self.Element)
+
     def _treat(self, current, line):
         table = self.regexp.match(line)
         if table:
@@ -517,89 +732,371 @@ class OrgTable(OrgPlugin):
             self.treated = False
         return current
 
+    class Row(list):
+        """
+        A row of OrgTable.Columns, a list of its cells. Changing the row
+        changes it in the columns, at the position it had when it was taken.
+        """
+
+        def __init__(self, columns, index):
+            list.__init__(self, columns._cells(index))
+            self._columns = columns
+            self._index = index
+
+        def _write_back(self):
+            self._columns[self._index] = list(self)
+            # as the columns store them, e.g. converted to numbers
+            list.__setitem__(self, slice(None),
+                             self._columns._cells(self._index))
+
+        def _changing(method):
+            def change(self, *args):
+                result = method(self, *args)
+                self._write_back()
+                return result
+            change.__name__ = method.__name__
+            return change
+
+        __setitem__ = _changing(list.__setitem__)
+        __delitem__ = _changing(list.__delitem__)
+        __iadd__ = _changing(list.__iadd__)
+        append = _changing(list.append)
+        extend = _changing(list.extend)
+        insert = _changing(list.insert)
+        pop = _changing(list.pop)
+        remove = _changing(list.remove)
+        reverse = _changing(list.reverse)
+        sort = _changing(list.sort)
+        if hasattr(list, "__setslice__"):  # Python 2
+            __setslice__ = _changing(list.__setslice__)
+            __delslice__ = _changing(list.__delslice__)
+        del _changing
+
+    class Columns:
+        """
+        The rows of a table, stored by column: one list per column, or an
+        array for the typed columns, and the number of cells of each row
+        (separators like |---+---| have fewer cells than the other rows).
+        It is used like the list of rows it replaces, the rows being
+        OrgTable.Row lists of cells.
+        """
+
+        def __init__(self, rows=(), types=None):
+            # Maps column numbers to the typecode of the array storing their
+            # cells, e.g. {1: "l"}: the cells are converted to numbers
+            self.types = dict(types or {})
+            self.replace(rows)
+
+        def layout(self):
+            """
+            A [width, numbers, cells] list per column for aligning the
+            table: the display width of the widest cell and how many of the
+            non-empty cells are numbers. It is computed once, then kept up
+            to date as rows are appended.
+            """
+            if self._layout is None:
+                self._layout = []
+                for index in range(len(self.columns)):
+                    texts = [text for text in self.texts(index) if text]
+                    if texts:
+                        self._layout.append(
+                            [max(display_widths(texts)),
+                             sum(1 for text in texts
+                                 if OrgTable.NUMBER.match(text)),
+                             len(texts)])
+                    else:
+                        self._layout.append([1, 0, 0])
+                # columns only the separators have
+                while self._layout and not self._layout[-1][2]:
+                    self._layout.pop()
+            return self._layout
+
+        def texts(self, index):
+            """The stripped text of the cells of the column index, the
+            missing cells and the separators being empty"""
+            column = self.columns[index]
+            if index in self.types:
+                # the missing cells are stored as 0
+                texts = [unicode(cell) if index < length else u""
+                         for cell, length in izip(column, self.lengths)]
+            else:
+                texts = [u"" if cell is None else cell.strip()
+                         for cell in column]
+            if index == 0:
+                for row, cell in enumerate(column):
+                    if isinstance(cell, basestring) and cell.startswith("-"):
+                        texts[row] = u""
+            return texts
+
+        def _measure(self, row):
+            if OrgTable.is_hline(row):
+                return
+            while len(self._layout) < len(row):
+                self._layout.append([1, 0, 0])
+            for measure, cell in zip(self._layout, row):
+                text = unicode(cell).strip()
+                if text:
+                    measure[0] = max(measure[0], display_width(text))
+                    if OrgTable.NUMBER.match(text):
+                        measure[1] += 1
+                    measure[2] += 1
+
+        def _cell(self, index, cell):
+            """cell as stored in the column index, None being a missing
+            cell"""
+            typecode = self.types.get(index)
+            if typecode is None:
+                return cell
+            if cell is None:
+                return 0
+            if isinstance(cell, basestring):
+                return (float if typecode in "fd" else int)(cell)
+            return cell
+
+        def _column(self, index, cells):
+            typecode = self.types.get(index)
+            if typecode is None:
+                return list(cells)
+            return array.array(typecode,
+                               [self._cell(index, cell) for cell in cells])
+
+        def replace(self, rows):
+            """Replaces all the rows of the table with rows"""
+            if not isinstance(rows, list):
+                rows = list(rows)
+            self._layout = None
+            self.lengths = array.array("H", map(len, rows))
+            self.columns = [self._column(index, cells) for index, cells
+                            in enumerate(izip_longest(*rows))]
+
+        def column(self, index):
+            """The cells of a column, None for the rows without that cell (0
+            in a typed column, see lengths). This is the column itself, not
+            a copy."""
+            return self.columns[index]
+
+        def append(self, row):
+            length = len(row)
+            while len(self.columns) < length:
+                self.columns.append(self._column(len(self.columns),
+                                                 [None] * len(self.lengths)))
+            for index, column in enumerate(self.columns):
+                column.append(self._cell(index, row[index]
+                                         if index < length else None))
+            self.lengths.append(length)
+            if self._layout is not None:
+                self._measure(row)
+
+        def extend(self, rows):
+            for row in rows:
+                self.append(row)
+
+        def sort(self, columns, key=None, reverse=False):
+            """
+            Sorts the rows by the cells of columns, a list of column numbers,
+            the first one first. key is applied to the cells, e.g.
+            unicode.strip.
+            """
+            order = list(range(len(self.lengths)))
+            for index in reversed(columns):
+                column = self.columns[index]
+                if key is not None:
+                    column = [cell if cell is None else key(cell)
+                              for cell in column]
+                order.sort(key=column.__getitem__, reverse=reverse)
+            self.lengths = array.array("H", [self.lengths[i] for i in order])
+            self.columns = [self._column(index, [column[i] for i in order])
+                            for index, column in enumerate(self.columns)]
+
+        def _cells(self, index):
+            return [column[index]
+                    for column in self.columns[:self.lengths[index]]]
+
+        def __len__(self):
+            return len(self.lengths)
+
+        def __iter__(self):
+            for index in xrange(len(self.lengths)):
+                yield OrgTable.Row(self, index)
+
+        def __getitem__(self, index):
+            if isinstance(index, slice):
+                return [OrgTable.Row(self, i)
+                        for i in xrange(*index.indices(len(self.lengths)))]
+            return OrgTable.Row(self, xrange(len(self.lengths))[index])
+
+        def __setitem__(self, index, value):
+            if not isinstance(index, slice) and len(value) <= len(self.columns):
+                index = xrange(len(self.lengths))[index]
+                for i, column in enumerate(self.columns):
+                    column[index] = self._cell(i, value[i]
+                                               if i < len(value) else None)
+                self.lengths[index] = len(value)
+                self._layout = None
+                return
+            rows = [self._cells(i) for i in xrange(len(self.lengths))]
+            rows[index] = value
+            self.replace(rows)
+
+        def __delitem__(self, index):
+            del self.lengths[index]
+            for column in self.columns:
+                del column[index]
+            self._layout = None
+
+        def __eq__(self, other):
+            return list(self) == list(other)
+
+        def __ne__(self, other):
+            return not self == other
+
+        def __repr__(self):
+            return repr([self._cells(i) for i in xrange(len(self.lengths))])
+
     class Element(OrgElement):
         """
         A Table object
         """
         TYPE = "TABLE_ELEMENT"
+        __slots__ = ("align",)
 
-        def __init__(self):
+        def __init__(self, types=None):
+            self.content = OrgTable.Columns(types=types)
             OrgElement.__init__(self)
+            # Writes the table aligned like org-mode does, set to False to
+            # write the cells as they are
+            self.align = True
+
+        def __setattr__(self, name, value):
+            # A list of rows given as content replaces the rows of the
+            # columns, keeping their types
+            if name == "content" and not isinstance(value, OrgTable.Columns):
+                self.content.replace(value)
+            else:
+                OrgElement.__setattr__(self, name, value)
+
+        def _write_to(self, stream):
+            layout = self.content.layout() if self.align else None
+            if not layout:
+                for element in self.content:
+                    stream.write(u"|" + u"|".join(map(unicode, element)) +
+                                 u"|\n")
+                return
+            # The cells are padded a column at a time
+            columns = []
+            for index, (width, numbers, cells) in enumerate(layout):
+                columns.append(self._pad(self.content.texts(index), width,
+                                         # like org-table-number-fraction
+                                         numbers * 2 > cells))
+            hline = u"|" + u"+".join(u"-" * (width + 2)
+                                     for width, numbers, cells in layout)
+            for first, row in izip(self.content.column(0), izip(*columns)):
+                if isinstance(first, basestring) and first.startswith("-"):
+                    stream.write(hline + u"|\n")
+                else:
+                    stream.write(u"| " + u" | ".join(row) + u" |\n")
 
-        def _output(self):
-            output = ""
-            for element in self.content:
-                output = output + "|"
-                for cell in element:
-                    output = output + unicode(cell) + "|"
-                output = output + "\n"
-            return output
+        @staticmethod
+        def _pad(texts, width, right):
+            """texts padded to the display width width"""
+            widths = display_widths(texts)
+            if right:
+                return [u" " * (width - text_width) + text
+                        for text, text_width in izip(texts, widths)]
+            return [text + u" " * (width - text_width)
+                    for text, text_width in izip(texts, widths)]
 
 
 class OrgNode(OrgPlugin):
+    first_chars = "*"
+    prefilter = "\*"
+
+    # Used on the title of a heading, see _treat
+    TAGS_RE = re.compile(":([:\w]+)*:")
+    LINKS_RE = re.compile(" \[(.+)\]")
+    BEFORE_TAGS_RE = re.compile(r"^(?:.+)\s+(?=:)")
+    TAG_RE = re.compile(r'(?=:([\w]+):)')
+
     def __init__(self):
         OrgPlugin.__init__(self)
         self.todo_list = ['TODO']
         self.done_list = ['DONE']
         # If the line starts by an indent, it is not a node
         self.keepindent = False
-
-    def _treat(self, current, line):
-        # Build regexp
-        regexp_string = "^(\*+)\s*"
-        if self.todo_list:
-            separator = ""
-            re_todos = "("
-            for todo_keyword in self.todo_list + self.done_list:
-                re_todos += separator
-                separator = "|"
-                re_todos += todo_keyword
-            re_todos += ")?\s*"
-            regexp_string += re_todos
-        regexp_string += "(\[.*?\])?\s+(.*)$"
-        self.regexp = re.compile(regexp_string)
-        heading = self.regexp.findall(line)
-        if heading:  # We have a heading
-
-            if current.parent:
-                current.parent.append(current)
-
-                # Is that a new level ?
-            if (len(heading[0][0]) > current.level):  # Yes
-                # Parent is now the current node
-                parent = current
-            else:
-                # If not, the parent of the current node is the parent
-                parent = current.parent
-                # If we are going back one or more levels, walk through parents
-                while len(heading[0][0]) < current.level:
-                    current = current.parent
-                    parent = current.parent
-            # Creating a new node and assigning parameters
-            current = OrgNode.Element()
-            current.level = len(heading[0][0])
-
-            current.heading = re.sub(":([:\w]+)*:",
-                                     "",
-                                     heading[0][3])  # Remove tags
-
-            current.priority = heading[0][2].strip('[#]')
-            current.parent = parent
-            if heading[0][1]:
-                current.todo = heading[0][1]
+        self.regexp = None
+
+    def invalidate(self):
+        """Has to be called after todo_list or done_list has been changed"""
+        self.regexp = None
+
+    def heading_regexp(self):
+        """The regular expression splitting a heading into its stars, todo
+        state, priority and title. Compiled once for the todo states."""
+        if self.regexp is None:
+            regexp_string = "^(?P<stars>\*+)\s*"
+            if self.todo_list:
+                regexp_string += "(?P<todo>%s)?\s*" % "|".join(
+                    re.escape(todo_keyword)
+                    for todo_keyword in self.todo_list + self.done_list)
+            regexp_string += "(?P<priority>\[.*?\])?\s+(?P<title>.*)$"
+            self.regexp = re.compile(regexp_string)
+        return self.regexp
+
+    def make_node(self, line, element_class=None):
+        """Returns a new node (an instance of element_class, by default
+        OrgNode.Element) for the heading in line, without a parent. Returns
+        None if line is not a heading."""
+        heading = self.heading_regexp().match(line)
+        if not heading:
+            return None
+        parts = heading.groupdict()
+        node = (element_class or OrgNode.Element)()
+        node.level = len(parts['stars'])
+
+        title = parts['title']
+        node.priority = (parts['priority'] or '').strip('[#]')
+        if parts.get('todo'):
+            node.todo = parts['todo']
+
+        if ':' not in title:  # No tags
+            node.heading = title
+        else:
+            node.heading = self.TAGS_RE.sub("", title)  # Remove tags
 
             # Looking for tags
-            heading_without_links = re.sub(" \[(.+)\]", "", heading[0][3])
-            heading_without_title = re.sub(r"^(?:.+)\s+(?=:)", "",
-                                           heading_without_links)
-            matches = re.finditer(r'(?=:([\w]+):)', heading_without_links)
+            heading_without_links = self.LINKS_RE.sub("", title)
+            heading_without_title = self.BEFORE_TAGS_RE.sub(
+                "", heading_without_links)
             # if no change, there is no residual string that
-
             # follows the tag grammar
             if heading_without_links != heading_without_title:
-                matches = re.finditer(r'(?=:([\w]+):)',
-                                      heading_without_title)
-                [current.tags.append(match.group(1)) for match in matches]
+                node.tags = [match.group(1) for match in
+                             self.TAG_RE.finditer(heading_without_title)]
+        return node
+
+    @staticmethod
+    def find_parent(current, level):
+        """Returns the parent of a new node of the given level which follows
+        the node current"""
+        # Is that a new level ?
+        if (level > current.level):  # Yes
+            # Parent is now the current node
+            return current
+        # If not, the parent of the current node is the parent
+        parent = current.parent
+        # If we are going back one or more levels, walk through parents
+        while level < current.level:
+            current = current.parent
+            parent = current.parent
+        return parent
+
+    def _treat(self, current, line):
+        node = self.make_node(line)
+        if node is not None:  # We have a heading
+            if current.parent:
+                current.parent.append(current)
+            node.parent = self.find_parent(current, node.level)
+            current = node
         else:
             self.treated = False
         return current
@@ -614,50 +1111,80 @@ class OrgNode(OrgPlugin):
         # The ID is auto-generated using uuid.
         # The level 0 is the document itself
         TYPE = "NODE_ELEMENT"
+        # todo is only set for the nodes having a todo state, _index only
+        # for the root of an indexed tree
+        __slots__ = ("heading", "priority", "tags", "todo", "_index")
+        # The tags of the nodes without tags, shared by them
+        NO_TAGS = ()
 
         def __init__(self):
             OrgElement.__init__(self)
-            self.content = []
-            self.level = 0
             self.heading = ""
             self.priority = ""
-            self.tags = []
+            self.tags = self.NO_TAGS
             # TODO  Scheduling structure
 
-        def _output(self):
-            output = ""
+        def _write_to(self, stream):
+            heading = []
 
             if hasattr(self, "level"):
-                output = output + "*"*self.level
+                heading.append("*"*self.level)
 
             if hasattr(self, "todo"):
-                output = output + " " + self.todo
+                heading.append(" " + self.todo)
 
             if self.parent is not None:
-                output = output + " "
+                heading.append(" ")
                 if self.priority:
-                    output = output + "[#" + self.priority + "] "
-                output = output + self.heading
+                    heading.append("[#" + self.priority + "] ")
+                heading.append(self.heading)
 
                 if self.tags:
-                    output += ':' + ':'.join(self.tags) + ':'
+                    heading.append(':' + ':'.join(self.tags) + ':')
 
-                output = output + "\n"
+                heading.append("\n")
 
+            stream.write("".join(heading))
             for element in self.content:
-                try:
-                    output = output + element.__unicode__()
-                except AttributeError:
-                    output = output + element
-                    
-            return output
+                write_element(stream, element)
+
+        def append(self, element):
+            OrgElement.append(self, element)
+            self._index_elements([element])
+            return element
 
         def append_clean(self, element):
             if isinstance(element, list):
                 self.content.extend(element)
             else:
                 self.content.append(element)
+                element = [element]
             self.reparent_cleanlevels(self)
+            self._index_elements(element)
+
+        def find_index(self):
+            """The OrgIndex of the tree of this node, None if it has none"""
+            node = self
+            while node.parent is not None:
+                node = node.parent
+            return getattr(node, "_index", None)
+
+        def _index_elements(self, elements):
+            """Indexes the nodes among the elements appended to this node,
+            and this node again if drawers were appended to it"""
+            index = None
+            for element in elements:
+                if not isinstance(element, (OrgNode.Element,
+                                            OrgDrawer.Element)):
+                    continue
+                if index is None:
+                    index = self.find_index()
+                    if index is None:
+                        return
+                if isinstance(element, OrgNode.Element):
+                    index.add(element)
+                elif self in index:
+                    index.add(self, subtree=False)
 
         def reparent_cleanlevels(self, element=None, level=None):
             """
@@ -679,6 +1206,192 @@ class OrgNode(OrgPlugin):
                         self.reparent_cleanlevels(child,
                                                   level+1)
 
+    class LazyElement(Element):
+        """
+        A node read with OrgDataStructure.load_from_file(lazy=True). Its
+        child nodes are known, but the rest of its content is only parsed
+        from the file when content is first used.
+        """
+        __slots__ = ("_structure", "_name", "_start", "_end", "_children")
+
+        def __setattr__(self, name, value):
+            # the content replaces the child nodes known before it is parsed
+            if name == "content" and hasattr(self, "_children"):
+                del self._children
+            OrgNode.Element.__setattr__(self, name, value)
+
+        def __init__(self, structure=None, name=None, start=0, end=0):
+            OrgNode.Element.__init__(self)
+            del self.content
+            self._structure = structure
+            self._name = name
+            # The bytes of the file between the heading and the next one
+            self._start = start
+            self._end = end
+            self._children = []
+
+        def __getattr__(self, name):
+            if name != "content":
+                raise AttributeError(name)
+            body = self._structure._parse_body(self)
+            self.content = body + self._children
+            # the properties are now known
+            index = self.find_index()
+            if index is not None and self in index:
+                index.add(self, subtree=False)
+            return self.content
+
+
+class OrgIndex(object):
+    """
+    The nodes of a tree by heading, tag, priority, todo state and property
+    name, see OrgDataStructure.build_index. Nodes are indexed as they are
+    appended to the tree. A node changed in place has to be indexed again
+    with add(node). The nodes removed from the tree are left out of what is
+    found, and dropped from the index when they are.
+    """
+    KINDS = ("heading", "tag", "priority", "todo", "property")
+
+    def __init__(self, root=None):
+        self.root = root
+        # The nodes by key, for each kind of key, each node mapped to its
+        # number
+        self.nodes = dict((kind, {}) for kind in self.KINDS)
+        # The (number, keys) of each node, the numbers giving the order in
+        # which the nodes were added
+        self._entries = {}
+        # The position of each node in the content of its parent, where it
+        # was last found, see find_any
+        self._positions = {}
+        self._count = 0
+
+    def __contains__(self, node):
+        return node in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _content(node):
+        """The content of node, or only its child nodes if it is an
+        OrgNode.LazyElement which hasn't been parsed yet"""
+        if isinstance(node, OrgNode.LazyElement) and hasattr(node,
+                                                             "_children"):
+            return node._children
+        return node.content
+
+    @staticmethod
+    def keys(node, kinds=KINDS):
+        """The (kind, key) tuples node is indexed under, for the given
+        kinds"""
+        keys = set()
+        if "heading" in kinds:
+            heading = OrgDataStructure.parse_heading(node.heading)["heading"]
+            keys.add(("heading", heading))
+        if "priority" in kinds:
+            keys.add(("priority", node.priority))
+        if "tag" in kinds:
+            keys.update(("tag", tag) for tag in node.tags)
+        if "todo" in kinds and hasattr(node, "todo"):
+            keys.add(("todo", node.todo))
+        if "property" in kinds:
+            for element in OrgIndex._content(node):
+                if isinstance(element, OrgDrawer.Element):
+                    keys.update(("property", child.name)
+                                for child in element.content
+                                if isinstance(child, OrgDrawer.Property))
+        return keys
+
+    def add(self, element, subtree=True):
+        """Indexes element if it is a node (other than the root), and the
+        nodes below it unless subtree is False"""
+        if not isinstance(element, OrgNode.Element):
+            return
+        if element.parent is None:
+            if self.root is None:
+                self.root = element
+        else:
+            number = self.discard(element)
+            if number is None:
+                number = self._count
+                self._count += 1
+            keys = self.keys(element)
+            self._entries[element] = (number, keys)
+            for kind, key in keys:
+                self.nodes[kind].setdefault(key, {})[element] = number
+        if subtree:
+            for child in self._content(element):
+                self.add(child)
+
+    def discard(self, node):
+        """Removes node, but not the nodes below it, from the index.
+        Returns its number, None if it wasn't indexed."""
+        entry = self._entries.pop(node, None)
+        if entry is None:
+            return None
+        self._positions.pop(node, None)
+        number, keys = entry
+        for kind, key in keys:
+            nodes = self.nodes[kind][key]
+            del nodes[node]
+            if not nodes:
+                del self.nodes[kind][key]
+        return number
+
+    def find(self, kind, key, node=None):
+        """The nodes indexed under key, in the order they were added (the
+        order of the file for a parsed file). If node is given, only node
+        and the nodes below it."""
+        return self.find_any(kind, [key], node)
+
+    def find_any(self, kind, keys, node=None):
+        """The nodes indexed under any of keys, like find"""
+        found = []
+        for key in keys:
+            found.extend(self.nodes[kind].get(key, {}).items())
+        found.sort(key=lambda item: item[1])
+        ancestor = self.root if node is None else node
+        # The parent of a node removed from the tree still refers to where it
+        # was, so each node up to ancestor has to be in the content of its
+        # parent, at the position it was last found at. The positions in the
+        # content of a parent are looked for again at most once.
+        contents = {}  # of the parents by id
+        located = set()  # the ids of the parents looked at again
+        positions = self._positions
+        result = []
+        for other, number in found:
+            child = other
+            while child is not ancestor:
+                parent = child.parent
+                if parent is None:
+                    break
+                content = contents.get(id(parent))
+                if content is None:
+                    content = contents[id(parent)] = self._content(parent)
+                position = positions.get(child, -1)
+                if not (0 <= position < len(content) and
+                        content[position] is child):
+                    if id(parent) in located:
+                        break
+                    located.add(id(parent))
+                    self._locate(content)
+                    position = positions.get(child, -1)
+                    if not (0 <= position < len(content) and
+                            content[position] is child):
+                        break
+                child = parent
+            if child is ancestor:
+                result.append(other)
+            elif ancestor is self.root:
+                self.discard(other)  # removed from the tree
+        return result
+
+    def _locate(self, content):
+        """Records the positions of the nodes in content"""
+        self._positions.update((element, position) for position, element
+                               in enumerate(content)
+                               if isinstance(element, OrgNode.Element))
+
 
 class OrgDataStructure(OrgElement):
     """
@@ -687,10 +1400,15 @@ class OrgDataStructure(OrgElement):
     """
     root = None
     TYPE = "DATASTRUCTURE_ELEMENT"
+    # The amount of a mapped file decoded at once, see load_from_file
+    MMAP_CHUNK_SIZE = 1024 * 1024
 
-    def __init__(self):
+    def __init__(self, index=False):
+        """With index, the nodes are indexed as they are parsed or
+        appended, see build_index."""
         OrgElement.__init__(self)
         self.plugins = []
+        self._classifiers = {}
         self.load_plugins(OrgTable(),
                           OrgDrawer(),
                           OrgNode(),
@@ -705,6 +1423,24 @@ class OrgDataStructure(OrgElement):
         self.root = OrgNode.Element()
         self.root.parent = None
         self.level = 0
+        if index:
+            self.build_index()
+
+    @property
+    def index(self):
+        """The OrgIndex of the nodes of the tree, None if it has none"""
+        return getattr(self.root, "_index", None)
+
+    def build_index(self):
+        """
+        Indexes the nodes of the tree by heading, tag, priority, todo state
+        and property name, see OrgIndex. The index is kept up to date as
+        nodes are appended with append or append_clean, and get_node_by_*,
+        get_nodes_by_* and extract_todo_list use it.
+        """
+        self.root._index = OrgIndex(self.root)
+        self.root._index.add(self.root)
+        return self.root._index
 
     def load_plugins(self, *arguments, **kw):
         """
@@ -712,6 +1448,44 @@ class OrgDataStructure(OrgElement):
         """
         for plugin in arguments:
             self.plugins.append(plugin)
+        self._classifiers = {}
+
+    def _classifier(self, first_char):
+        """
+        Returns the regular expression which finds the first plugin that
+        can treat a line starting with first_char, or None if no plugin
+        can. It combines the prefilters of the plugins into one alternation
+        with a named group for each.
+        """
+        try:
+            return self._classifiers[first_char]
+        except KeyError:
+            pass
+        alternatives = []
+        for index, plugin in enumerate(self.plugins):
+            if plugin.first_chars is None or (first_char and
+                                              first_char in plugin.first_chars):
+                alternatives.append("(?P<p%d>%s)" % (index,
+                                                     plugin.prefilter or ""))
+        if alternatives:
+            classifier = re.compile("|".join(alternatives))
+        else:
+            classifier = None
+        self._classifiers[first_char] = classifier
+        return classifier
+
+    def classify(self, line):
+        """
+        Returns the index of the first plugin which can treat line, or the
+        number of plugins if none can. The plugins before it are not tried,
+        unless they are active.
+        """
+        classifier = self._classifier(line[:1])
+        if classifier is not None:
+            match = classifier.match(line)
+            if match is not None:
+                return int(match.lastgroup[1:])
+        return len(self.plugins)
 
     def set_todo_states(self, new_states):
         """
@@ -752,6 +1526,7 @@ class OrgDataStructure(OrgElement):
             if plugin.__class__ == OrgNode:
                 plugin.todo_list = new_todo_states
                 plugin.done_list = new_done_states
+                plugin.invalidate()
         if new_states:
             return new_states  # Return any leftovers
 
@@ -780,6 +1555,7 @@ class OrgDataStructure(OrgElement):
         for plugin in self.plugins:
             if plugin.__class__ == OrgNode:
                 plugin.todo_list.append(new_state)
+                plugin.invalidate()
 
     def add_done_state(self, new_state):
         """Appends a todo state to the list of todo states of any OrgNode plugins in
@@ -789,6 +1565,7 @@ class OrgDataStructure(OrgElement):
         for plugin in self.plugins:
             if plugin.__class__ == OrgNode:
                 plugin.done_list.append(new_state)
+                plugin.invalidate()
 
     def remove_todo_state(self, old_state):
         """
@@ -804,6 +1581,7 @@ class OrgDataStructure(OrgElement):
                 while old_state in plugin.done_list:
                     found = True
                     plugin.done_list.remove(old_state)
+                plugin.invalidate()
         return found
 
     def extract_todo_list(self, todo_list=None):
@@ -824,6 +1602,14 @@ class OrgDataStructure(OrgElement):
                         + " not registered. See \
                         PyOrgMode.OrgDataStructure.add_todo_state.")
         results_list = []
+        if self.index is not None:
+            for node in self.index.find_any("todo", set(todo_list)):
+                results_list.append(OrgTodo(node.heading,
+                                            node.todo,
+                                            tags=node.tags,
+                                            priority=node.priority,
+                                            node=node))
+            return results_list
         # Recursive function that steps through each node in current level,
         # looking for TODO items and then calls itself to look for
         # TODO items one level down.
@@ -853,36 +1639,248 @@ class OrgDataStructure(OrgElement):
         extract_from_level(self.root.content)
         return results_list
 
-    def load_from_file(self, name, form="file"):
-        """
-        Used to load an org-file inside this DataStructure
-        """
-        current = self.root
+    def _lines(self, name, form):
+        """Returns an iterator over the lines of the org-file, see
+        load_from_file"""
         # Determine content type and put in appropriate form
         if form == "file":
-            content = io.open(name, 'r', encoding="utf-8")
+            return self._file_lines(name)
         elif form == "string":
-            content = [tmp+"\n" for tmp in name.split("\n")]
+            return (tmp+"\n" for tmp in name.split("\n"))
+        elif form == "mmap":
+            return itertools.chain.from_iterable(self._mapped_lines(name))
         else:
             raise ValueError("Form \""+form+"\" not recognized")
 
-        for line in content:
-            for plugin in self.plugins:
-                current = plugin.treat(current, line)
-                if plugin.treated:  # Plugin found something
-                    treated = True
-                    break
-                else:
-                    treated = False
-            if not treated and line is not None:
-                # Nothing special, just content
-                current.append(line)
+    @staticmethod
+    def _file_lines(name):
+        with io.open(name, 'r', encoding="utf-8") as content:
+            for line in content:
+                yield line
+
+    def _mapped_lines(self, name):
+        """
+        Generates lists of the lines of the file like io.open would give
+        them, but from a memory map of it. The file is decoded in chunks
+        which end at a line boundary and split into lines in one go.
+        unicode.splitlines() also splits at other characters than newlines,
+        such as form feeds, so it is only used for chunks without them.
+        """
+        with io.open(name, 'rb') as content:
+            size = os.fstat(content.fileno()).st_size
+            if size == 0:
+                return  # can't map an empty file
+            data = mmap.mmap(content.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < size:
+                end = data.rfind(b"\n", start, start + self.MMAP_CHUNK_SIZE) + 1
+                if end <= start:  # a line longer than a chunk, or the end
+                    end = data.find(b"\n", start + self.MMAP_CHUNK_SIZE) + 1
+                    if end <= start:
+                        end = size
+                text = data[start:end].decode("utf-8")
+                start = end
+                if "\r" in text:  # universal newlines
+                    text = text.replace("\r\n", "\n").replace("\r", "\n")
+                lines = text.splitlines(True)
+                if len(lines) == text.count("\n") + (text[-1] != "\n"):
+                    yield lines
+                else:  # it did split at other characters
+                    lines = [line + "\n" for line in text.split("\n")]
+                    last = lines.pop()[:-1]
+                    if last:  # the file doesn't end with a newline
+                        lines.append(last)
+                    yield lines
+        finally:
+            data.close()
+
+    def _treat_line(self, current, line):
+        """Gives line to the plugins. Returns the new current element and
+        the plugin which treated the line, None if it is just content."""
+        first = self.classify(line)
+        for index, plugin in enumerate(self.plugins):
+            if index < first and not plugin.active(current):
+                continue  # can't treat this line
+            current = plugin.treat(current, line)
+            if plugin.treated:  # Plugin found something
+                return current, plugin
+        if line is not None:
+            # Nothing special, just content
+            current.append(line)
+        return current, None
+
+    def load_from_file(self, name, form="file", lazy=False):
+        """
+        Used to load an org-file inside this DataStructure
+
+        form is "file" for the name of a file, "string" for the text of an
+        org-file or "mmap" to read the file through a memory map, which is
+        faster for large files.
+
+        With lazy=True, the file is only scanned for its headings, and the
+        rest of the content of a node is parsed when it is first used, see
+        OrgNode.LazyElement. This replaces the root node. The file must not
+        change as long as the tree is in use.
+        """
+        if lazy:
+            if form != "file":
+                raise ValueError("Only files can be loaded lazily")
+            self._load_lazy(name)
+            return
+
+        current = self.root
+        for line in self._lines(name, form):
+            current, plugin = self._treat_line(current, line)
 
         for plugin in self.plugins:
             current = plugin.close(current)
 
-        if form == "file":
-            content.close()
+    def _load_lazy(self, name):
+        """Builds the tree of the nodes of the file from its headings"""
+        node_plugin = drawer_plugin = None
+        for plugin in self.plugins:
+            if isinstance(plugin, OrgNode) and node_plugin is None:
+                node_plugin = plugin
+            elif isinstance(plugin, OrgDrawer) and drawer_plugin is None:
+                drawer_plugin = plugin
+        if node_plugin is None:
+            raise ValueError("Lazy loading needs the OrgNode plugin")
+
+        root = current = OrgNode.LazyElement(self, name)
+        index = None
+        if self.index is not None:
+            index = root._index = OrgIndex(root)
+        in_drawer = False  # a heading in a drawer is just text
+        offset = 0
+        with io.open(name, 'rb') as content:
+            for raw in self._raw_lines(content):
+                start = offset
+                offset += len(raw)
+                line = raw.decode("utf-8")
+                if line.endswith("\r\n"):
+                    line = line[:-2] + "\n"
+                elif line.endswith("\r"):
+                    line = line[:-1] + "\n"
+
+                if drawer_plugin is not None and ":" in line:
+                    drawer = drawer_plugin.regexp.search(line.lstrip(" \t"))
+                    if drawer:
+                        in_drawer = (not in_drawer or
+                                     drawer.group(1).upper() != "END")
+                        continue
+                if in_drawer or line[:1] != "*":
+                    continue
+
+                node = node_plugin.make_node(line, OrgNode.LazyElement)
+                if node is not None:
+                    current._end = start
+                    node._structure = self
+                    node._name = name
+                    node._start = offset
+                    node.parent = OrgNode.find_parent(current, node.level)
+                    if node.parent:  # as in OrgNode._treat
+                        node.parent._children.append(node)
+                        if index is not None:
+                            index.add(node)
+                    current = node
+        current._end = offset
+        self.root = root
+
+    @staticmethod
+    def _raw_lines(content):
+        """Generates the lines of the binary file content, split at "\\n",
+        "\\r\\n" and "\\r" like the universal newlines of _file_lines"""
+        for raw in content:
+            if b"\r" not in raw:
+                yield raw
+                continue
+            lines = [line + b"\r" for line in raw.split(b"\r")]
+            last = lines.pop()[:-1]
+            if last == b"\n":
+                lines[-1] += last
+            elif last:
+                lines.append(last)
+            for line in lines:
+                yield line
+
+    def _parse_body(self, node):
+        """Parses the content of the OrgNode.LazyElement node, other than its
+        child nodes"""
+        with io.open(node._name, 'rb') as content:
+            content.seek(node._start)
+            data = content.read(node._end - node._start)
+        container = current = OrgNode.Element()
+        container.level = node.level
+        for line in io.StringIO(data.decode("utf-8"), newline=None):
+            current, plugin = self._treat_line(current, line)
+        for element in container.content:
+            if hasattr(element, "parent"):
+                element.parent = node
+        return container.content
+
+    def iter_events(self, name, form="file"):
+        """
+        Parses an org-file like load_from_file, but instead of building the
+        tree in this DataStructure, generates (event, element) tuples:
+
+        ("start_node", node) when a heading starts, before its content
+        ("end_node", node) after the content of the node
+        ("property", property) for a property in a drawer
+        ("table_row", cells) for each row of a table
+        ("schedule", schedule) and ("clock", clock) for these elements
+        ("text", line) for lines no plugin recognized
+        ("element", element) for the elements of other plugins
+
+        The nodes are given without their content and everything is
+        forgotten once it has been generated, so that large files can be
+        read in constant memory.
+        """
+        root = OrgNode.Element()
+        root.parent = None
+        open_nodes = [root]
+        current = root
+        for line in self._lines(name, form):
+            previous = current
+            current, plugin = self._treat_line(current, line)
+
+            if isinstance(plugin, OrgNode):
+                # the previous node has been added to its parent
+                for node in open_nodes:
+                    del node.content[:]
+                while open_nodes[-1] is not current.parent:
+                    yield "end_node", open_nodes.pop()
+                open_nodes.append(current)
+                yield "start_node", current
+                continue
+
+            for element in (previous, current):
+                for event in self._element_events(element.content):
+                    yield event
+                del element.content[:]
+
+        for plugin in self.plugins:
+            plugin.close(current)
+        while len(open_nodes) > 1:
+            yield "end_node", open_nodes.pop()
+
+    @staticmethod
+    def _element_events(content):
+        for element in content:
+            if isinstance(element, list):
+                yield "table_row", element
+            elif isinstance(element, basestring):
+                yield "text", element
+            elif isinstance(element, OrgDrawer.Property):
+                yield "property", element
+            elif isinstance(element, OrgSchedule.Element):
+                yield "schedule", element
+            elif isinstance(element, OrgClock.Element):
+                yield "clock", element
+            elif not isinstance(element, (OrgNode.Element,
+                                          OrgTable.Element,
+                                          OrgDrawer.Element)):
+                yield "element", element
 
     def load_from_string(self, string):
         """A wrapper calling load_from_file but with a string instead of reading from
@@ -898,7 +1896,7 @@ class OrgDataStructure(OrgElement):
         with io.open(name, 'w', encoding='utf-8') as output:
             if node is None:
                 node = self.root
-            output.write(unicode(node))
+            node.write_to(_TextStream(output))
 
     @staticmethod
     def parse_heading(heading):
@@ -913,44 +1911,57 @@ class OrgDataStructure(OrgElement):
             return {'heading': heading}
 
     @staticmethod
-    def get_nodes_by_priority(node, priority, found_nodes=[]):
-
-        # print "start of get_nodes_by_priority"
-        # print " node instance type: %s" % node.__class__.__name__
-
-        if isinstance(node, OrgElement):
-            # print " node.heading: %s" % node.heading
-            try:
-                if node.todo and node.priority == priority:
-                    found_nodes.append(node)
-            except AttributeError:
-                # TODO: This could be a Property.  Handle it!
-                pass
-
-            for node in node.content:
-                OrgDataStructure.get_nodes_by_priority(node,
-                                                       priority,
-                                                       found_nodes)
-            return found_nodes
-        else:
-            return found_nodes
+    def _nodes(node):
+        """node and the nodes below it, in the order of the file"""
+        yield node
+        for element in node.content:
+            if isinstance(element, OrgNode.Element):
+                for child in OrgDataStructure._nodes(element):
+                    yield child
 
     @staticmethod
-    def get_node_by_heading(node, heading, found_nodes=[]):
-
-        if isinstance(node, OrgElement):
-            try:
-                heading_dict = OrgDataStructure.parse_heading(node.heading)
-                if heading_dict['heading'] == heading.strip():
-                    found_nodes.append(node)
-            except AttributeError:
-                # TODO: This could be a Property.  Handle it!
-                pass
-
-            for node in node.content:
-                OrgDataStructure.get_node_by_heading(node,
-                                                     heading,
-                                                     found_nodes)
+    def _find_nodes(node, kind, key, found_nodes):
+        """The nodes below node (or node itself) having key, through the
+        index of the tree when it has one, appended to found_nodes"""
+        if found_nodes is None:
+            found_nodes = []
+        if not isinstance(node, OrgNode.Element):
             return found_nodes
+        index = node.find_index()
+        if index is not None:
+            found_nodes.extend(index.find(kind, key, node))
         else:
-            return found_nodes
+            found_nodes.extend(other for other in OrgDataStructure._nodes(node)
+                               if other.parent is not None and
+                               (kind, key) in OrgIndex.keys(other, (kind,)))
+        return found_nodes
+
+    @staticmethod
+    def get_nodes_by_priority(node, priority, found_nodes=None):
+        """The nodes having a todo state and the given priority"""
+        nodes = OrgDataStructure._find_nodes(node, "priority", priority, None)
+        if found_nodes is None:
+            found_nodes = []
+        found_nodes.extend(other for other in nodes
+                           if getattr(other, "todo", None))
+        return found_nodes
+
+    @staticmethod
+    def get_node_by_heading(node, heading, found_nodes=None):
+        """The nodes with the given heading, without its [n/m] cookie"""
+        return OrgDataStructure._find_nodes(node, "heading", heading.strip(),
+                                            found_nodes)
+
+    @staticmethod
+    def get_nodes_by_tag(node, tag, found_nodes=None):
+        return OrgDataStructure._find_nodes(node, "tag", tag, found_nodes)
+
+    @staticmethod
+    def get_nodes_by_todo(node, todo, found_nodes=None):
+        return OrgDataStructure._find_nodes(node, "todo", todo, found_nodes)
+
+    @staticmethod
+    def get_nodes_by_property(node, name, found_nodes=None):
+        """The nodes having a property drawer with the property name"""
+        return OrgDataStructure._find_nodes(node, "property", name,
+                                            found_nodes)
@@ -0,0 +1,240 @@
+"""Micro-benchmarks for PyOrgMode
+
+ Run with: python benchmark.py
+ """
+
+import inspect
+import io
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+import PyOrgMode
+
+
+def generate_headings(count):
+    """An org file with count headings, with and without tags"""
+    lines = []
+    for i in range(count):
+        lines.append("* TODO [#B] heading number %d :tag%d:work:" % (i, i % 7))
+        lines.append("** sub heading %d" % i)
+        lines.append("some text below it")
+    return "\n".join(lines) + "\n"
+
+
+class UncachedOrgNode(PyOrgMode.OrgNode):
+    """OrgNode compiling its heading regexp for every line, like it used to"""
+    def _treat(self, current, line):
+        self.invalidate()
+        return PyOrgMode.OrgNode._treat(self, current, line)
+
+
+def parse(text, node_plugin=None):
+    tree = PyOrgMode.OrgDataStructure()
+    if node_plugin is not None:
+        tree.plugins = [node_plugin if isinstance(plugin, PyOrgMode.OrgNode)
+                        else plugin for plugin in tree.plugins]
+    tree.load_from_string(text)
+    return tree
+
+
+def generate_table(rows):
+    """An org file with a table of rows rows"""
+    lines = ["* files", "| category | action | file |", "|-+-+-|"]
+    for i in range(rows):
+        lines.append(u"| 10-19 group/11 sub/11.%02d f\u00e9 | k | dir%d/file%d.txt |"
+                     % (i % 100, i % 50, i))
+    return "\n".join(lines) + "\n"
+
+
+def generate_nodes(count):
+    """An org file with count headings with properties, clocks and tags"""
+    lines = []
+    for i in range(count):
+        lines.append("* TODO heading number %d :tag%d:work:" % (i, i % 7))
+        lines.append("  SCHEDULED: <2011-04-%02d Fri>" % (i % 28 + 1))
+        lines.append("  :PROPERTIES:")
+        lines.append("  :ID: %d" % i)
+        lines.append("  :END:")
+        lines.append("  CLOCK: [2010-11-20 Sat 19:42]--[2010-11-20 Sat 20:14]"
+                     " =>  0:32")
+        lines.append("** sub heading %d" % i)
+        lines.append("some text below it")
+    return "\n".join(lines) + "\n"
+
+
+def generate_clocks(count):
+    """An org file with a heading with count CLOCK lines"""
+    lines = ["* clocked"]
+    for i in range(count):
+        lines.append("  CLOCK: [2010-%02d-%02d Sat %02d:%02d]--"
+                     "[2010-%02d-%02d Sat %02d:%02d] =>  1:00"
+                     % (i % 12 + 1, i % 28 + 1, i % 23, i % 60,
+                        i % 12 + 1, i % 28 + 1, i % 23 + 1, i % 60))
+    return "\n".join(lines) + "\n"
+
+
+def deep_size(root):
+    """The bytes taken by root and the PyOrgMode objects, containers and
+    strings it references, each counted once"""
+    seen = set()
+    size = 0
+    pending = [root]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            pending.extend(obj)
+        elif getattr(obj, "__module__", None) == PyOrgMode.__name__:
+            if hasattr(obj, "__dict__"):
+                pending.append(obj.__dict__)
+            for cls in inspect.getmro(obj.__class__):
+                for name in cls.__dict__.get("__slots__", ()):
+                    if hasattr(obj, name):
+                        pending.append(getattr(obj, name))
+    return size
+
+
+def concatenated_output(node):
+    """The output of node, built by concatenation like it used to be"""
+    output = ""
+    if node.parent is not None:
+        output = output + "*"*node.level + " " + node.heading + "\n"
+    for element in node.content:
+        if isinstance(element, PyOrgMode.OrgNode.Element):
+            output = output + concatenated_output(element)
+        elif isinstance(element, PyOrgMode.OrgTable.Element):
+            for row in element.content:
+                output = output + "|"
+                for cell in row:
+                    output = output + unicode(cell) + "|"
+                output = output + "\n"
+        elif isinstance(element, PyOrgMode.OrgElement):
+            output = output + element.__unicode__()
+        else:
+            output = output + element
+    return output
+
+
+def best(func, repeat=3):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def benchmark_headings(count=20000):
+    text = generate_headings(count)
+    cached = best(lambda: parse(text))
+    uncached = best(lambda: parse(text, UncachedOrgNode()))
+    print("headings: %d headings, %.3f s with the cached regexp, "
+          "%.3f s compiling it for every line" % (2 * count, cached, uncached))
+
+
+def benchmark_mmap(rows=100000):
+    handle, name = tempfile.mkstemp(suffix=".org")
+    os.close(handle)
+    try:
+        with io.open(name, "w", encoding="utf-8") as f:
+            f.write(generate_table(rows))
+
+        def load(form):
+            PyOrgMode.OrgDataStructure().load_from_file(name, form)
+        read = best(lambda: load("file"))
+        mapped = best(lambda: load("mmap"))
+    finally:
+        os.remove(name)
+    print("mmap: %d table rows, %.3f s reading the file, %.3f s mapping it"
+          % (rows, read, mapped))
+
+
+def benchmark_output(rows=10000):
+    tree = PyOrgMode.OrgDataStructure()
+    tree.load_from_string(generate_table(rows))
+    tables = [element for element in tree.root.content[0].content
+              if isinstance(element, PyOrgMode.OrgTable.Element)]
+    # concatenated_output writes the cells the way they were read
+    for table in tables:
+        table.align = False
+    assert concatenated_output(tree.root) == tree.root.output()
+    concatenated = best(lambda: concatenated_output(tree.root), repeat=1)
+    streamed = best(lambda: tree.root.output())
+    for table in tables:
+        table.align = True
+    aligned = best(lambda: tree.root.output())
+    handle, name = tempfile.mkstemp(suffix=".org")
+    os.close(handle)
+    try:
+        saved = best(lambda: tree.save_to_file(name))
+    finally:
+        os.remove(name)
+    print("output: %d table rows, %.3f s concatenating, %.3f s writing "
+          "chunks, %.3f s aligned, %.3f s saving to a file"
+          % (rows, concatenated, streamed, aligned, saved))
+
+
+def benchmark_clocks(count=20000):
+    text = generate_clocks(count)
+    loaded = best(lambda: parse(text))
+    clocks = parse(text).root.content[0].content
+    timestamps = [date.get_value() for clock in clocks
+                  if isinstance(clock, PyOrgMode.OrgClock.Element)
+                  for date in (clock.start, clock.stop)]
+
+    def values():
+        PyOrgMode.OrgDate.PARSED = {}
+        PyOrgMode.OrgDate.PARSED_BEFORE = {}
+        for timestamp in timestamps:
+            PyOrgMode.OrgDate(timestamp).value
+    parsed = best(values)
+    strptime = best(lambda: [time.strptime(timestamp[1:11] + timestamp[-6:-1],
+                                           "%Y-%m-%d%H:%M")
+                             for timestamp in timestamps])
+    print("clocks: %d CLOCK lines, %.3f s loading them, %.3f s parsing their "
+          "%d timestamps (time.strptime alone takes %.3f s)"
+          % (count, loaded, parsed, len(timestamps), strptime))
+
+
+def benchmark_memory(count=20000):
+    tree = PyOrgMode.OrgDataStructure()
+    tree.load_from_string(generate_nodes(count))
+    size = deep_size(tree.root)
+    print("memory: %d nodes, %d bytes, %d bytes per node"
+          % (2 * count, size, size / (2 * count)))
+
+
+def benchmark_index(count=20000, lookups=100):
+    text = generate_nodes(count)
+    walked = parse(text)
+    indexed = PyOrgMode.OrgDataStructure(index=True)
+    indexed.load_from_string(text)
+    unindexed_load = best(lambda: parse(text))
+    indexed_load = best(lambda: PyOrgMode.OrgDataStructure(
+        index=True).load_from_string(text))
+
+    def find(tree):
+        for i in range(lookups):
+            PyOrgMode.OrgDataStructure.get_nodes_by_tag(tree.root,
+                                                        "tag%d" % (i % 7))
+            PyOrgMode.OrgDataStructure.get_node_by_heading(
+                tree.root, "heading number %d" % i)
+    walking = best(lambda: find(walked), repeat=1)
+    looking_up = best(lambda: find(indexed))
+    print("index: %d nodes, %.3f s loading them, %.3f s with the index, "
+          "%d lookups %.3f s walking the tree, %.3f s with the index"
+          % (2 * count, unindexed_load, indexed_load, 2 * lookups, walking,
+             looking_up))
+
+
+if __name__ == '__main__':
+    benchmark_memory()
+    benchmark_headings()
+    benchmark_clocks()
+    benchmark_mmap()
+    benchmark_output()
+    benchmark_index()
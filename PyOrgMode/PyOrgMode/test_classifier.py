@@ -0,0 +1,74 @@
+"""Tests for the line classifier of OrgDataStructure.load_from_file"""
+
+import PyOrgMode
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+TRICKY = '\n'.join((
+    'text before the first heading',
+    '*bold* is not a heading',
+    '* TODO [#A] heading :tag1:tag2:',
+    '  SCHEDULED: <2011-04-01> DEADLINE: <2011-04-04>',
+    '  text mentioning SCHEDULED: without a date',
+    '  :PROPERTIES:',
+    '  :name: value',
+    '  text in the drawer',
+    '  | a | table | in the drawer |',
+    '  :END:',
+    '| a | table |',
+    '|---+-------|',
+    ':DRAWER:',
+    'after the table',
+    ':END:',
+    '** DONE sub heading',
+    '   CLOSED: [2011-04-05 19:20]',
+    '\t| indented | table |',
+    ' * indented star',
+    '* last',
+    ''))
+
+
+def dump(element):
+    """The structure of element as nested tuples"""
+    if isinstance(element, PyOrgMode.OrgElement):
+        return (getattr(element, "TYPE", type(element).__name__),
+                element.output(),
+                tuple(dump(child) for child in element.content))
+    return element
+
+
+class TestClassifier(unittest.TestCase):
+    def load(self, name, form, classify=True):
+        tree = PyOrgMode.OrgDataStructure()
+        if not classify:
+            # every line goes through all the plugins
+            for plugin in tree.plugins:
+                plugin.first_chars = plugin.prefilter = None
+        tree.load_from_file(name, form)
+        return tree
+
+    def assertSameTree(self, name, form):
+        self.assertEqual(dump(self.load(name, form).root),
+                         dump(self.load(name, form, classify=False).root))
+
+    def test_test_org(self):
+        self.assertSameTree("test.org", "file")
+
+    def test_tricky_lines(self):
+        self.assertSameTree(TRICKY, "string")
+
+    def test_plain_text_skips_all_plugins(self):
+        tree = PyOrgMode.OrgDataStructure()
+        self.assertEqual(tree.classify(u"just text\n"), len(tree.plugins))
+
+    def test_heading_goes_to_the_node_plugin(self):
+        tree = PyOrgMode.OrgDataStructure()
+        plugin = tree.plugins[tree.classify(u"* heading\n")]
+        self.assertIsInstance(plugin, PyOrgMode.OrgNode)
+
+
+if __name__ == '__main__':
+    unittest.main()
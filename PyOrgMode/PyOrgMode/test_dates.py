@@ -1,3 +1,6 @@
+# -*- coding: utf-8 -*-
+
+import time
 
 import PyOrgMode
 import unittest
@@ -37,10 +40,10 @@ class TestDates(unittest.TestCase):
         """
         Tests parsing dates with localized weekday name that uses non-ASCII.
         """
-        datestr = '<2011-12-12 Пнд 09:00>' # Понедельник = Monday (Russian)
+        datestr = u'<2011-12-12 Пнд 09:00>' # Понедельник = Monday (Russian)
         date = PyOrgMode.OrgDate(datestr)
         self.assertEqual(tuple(date.value), (2011, 12, 12, 9, 0, 0, 0, 346, -1))
-        self.assertEqual(date.get_value(), '<2011-12-12 Mon 09:00>')
+        self.assertEqual(date.get_value(), datestr)
 
     def test_localizeddatetime_dot(self):
         """
@@ -49,7 +52,7 @@ class TestDates(unittest.TestCase):
         datestr = '<2011-12-12 al. 09:00>' # astelehena = Monday (Basque)
         date = PyOrgMode.OrgDate(datestr)
         self.assertEqual(tuple(date.value), (2011, 12, 12, 9, 0, 0, 0, 346, -1))
-        self.assertEqual(date.get_value(), '<2011-12-12 Mon 09:00>')
+        self.assertEqual(date.get_value(), datestr)
 
     def test_timerange(self):
         """
@@ -81,5 +84,57 @@ class TestDates(unittest.TestCase):
         self.assertEqual(tuple(date.end), (2012, 7, 31, 14, 0, 0, 1, 213, -1))
         self.assertEqual(date.get_value(), datestr)
 
+    def test_changed_date(self):
+        """
+        Tests that changed dates are formatted again.
+        """
+        date = PyOrgMode.OrgDate('<2011-12-12 al. 09:00>')
+        date.value = PyOrgMode.OrgDate.struct_time(2011, 12, 13, 10, 30)
+        self.assertEqual(date.get_value(), '<2011-12-13 Tue 10:30>')
+
+    def test_lazy(self):
+        """
+        Tests that dates are only parsed when their value is used.
+        """
+        date = PyOrgMode.OrgDate('<2011-13-12 Mon>')
+        self.assertEqual(date.get_value(), '<2011-13-12 Mon>')
+        self.assertRaises(ValueError, getattr, date, 'value')
+
+    def test_parsed_once(self):
+        """
+        Tests that a timestamp is parsed once for all the dates having it.
+        """
+        datestr = '<2012-07-20 Fri 09:00>--<2012-07-31 Tue 14:00>'
+        first = PyOrgMode.OrgDate(datestr)
+        second = PyOrgMode.OrgDate(datestr)
+        self.assertIs(first.end, second.end)
+        self.assertIs(PyOrgMode.OrgDate.parse(datestr)[1], first.value)
+
+    def test_struct_time(self):
+        """
+        Tests that the dates are the ones time.strptime gives.
+        """
+        for datestr in '2012-02-29 23:59', '2013-12-31 00:00', '1999-01-01 12:00':
+            self.assertEqual(PyOrgMode.OrgDate.parse_datetime(datestr)[2],
+                             time.strptime(datestr, '%Y-%m-%d %H:%M'))
+
+    def test_clock_round_trip(self):
+        """
+        Tests that CLOCK lines are written as they were read.
+        """
+        text = ('* clocked\n'
+                '  :LOGBOOK:\n'
+                'CLOCK: [2011-02-27 dim. 19:50]--[2011-02-27 dim. 19:51] => 0:01\n'
+                '  :END:\n'
+                '  CLOCK: [2011-02-27 Sun 19:50]--[2011-02-27 Sun 20:00] =>  0:10\n')
+        tree = PyOrgMode.OrgDataStructure()
+        tree.load_from_string(text)
+        self.assertEqual(tree.root.output(), text + '\n')
+        clock = tree.root.content[0].content[-2]
+        self.assertIsInstance(clock, PyOrgMode.OrgClock.Element)
+        clock.duration = PyOrgMode.OrgDate('0:11')
+        self.assertEqual(clock.output(), '  CLOCK: [2011-02-27 Sun 19:50]'
+                         '--[2011-02-27 Sun 20:00] =>  0:11\n')
+
 if __name__ == '__main__':
     unittest.main()
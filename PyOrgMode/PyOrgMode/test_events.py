@@ -0,0 +1,65 @@
+"""Tests for the event based parser OrgDataStructure.iter_events"""
+
+import PyOrgMode
+from test_classifier import TRICKY
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+def key(event, element):
+    if event in ("start_node", "end_node"):
+        return event, element.level, element.heading
+    if event in ("table_row", "text"):
+        return event, element
+    return event, element.output()
+
+
+def tree_events(element):
+    """The events iter_events generates, from the parsed tree"""
+    for child in element.content:
+        if isinstance(child, PyOrgMode.OrgNode.Element):
+            yield key("start_node", child)
+            for event in tree_events(child):
+                yield event
+            yield key("end_node", child)
+        elif isinstance(child, (PyOrgMode.OrgTable.Element,
+                                PyOrgMode.OrgDrawer.Element)):
+            for event in tree_events(child):
+                yield event
+        else:
+            yield key(*list(PyOrgMode.OrgDataStructure._element_events(
+                [child]))[0])
+
+
+class TestEvents(unittest.TestCase):
+    def assertSameAsTree(self, name, form):
+        tree = PyOrgMode.OrgDataStructure()
+        tree.load_from_file(name, form)
+        events = PyOrgMode.OrgDataStructure().iter_events(name, form)
+        self.assertEqual([key(*event) for event in events],
+                         list(tree_events(tree.root)))
+
+    def test_test_org(self):
+        self.assertSameAsTree("test.org", "file")
+
+    def test_tricky_lines(self):
+        self.assertSameAsTree(TRICKY, "string")
+
+    def test_nodes_have_no_content(self):
+        events = PyOrgMode.OrgDataStructure().iter_events(TRICKY, "string")
+        for event, element in events:
+            if event == "start_node":
+                self.assertEqual(element.content, [])
+
+    def test_properties(self):
+        events = PyOrgMode.OrgDataStructure().iter_events(
+            "* a\n:PROPERTIES:\n:sourcedir: /src\n:END:\n", "string")
+        properties = [(e.name, e.value) for event, e in events
+                      if event == "property"]
+        self.assertEqual(properties, [("sourcedir", "/src")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+"""Tests for the indexes of the nodes of an OrgDataStructure"""
+
+import os
+import tempfile
+
+import PyOrgMode
+from test_classifier import TRICKY
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+def headings(nodes):
+    return [node.heading.strip() for node in nodes]
+
+
+class TestIndex(unittest.TestCase):
+    LOOKUPS = [("get_node_by_heading", "TAGS"),
+               ("get_node_by_heading", "heading"),
+               ("get_nodes_by_priority", "A"),
+               ("get_nodes_by_tag", "TAG1"),
+               ("get_nodes_by_tag", "tag2"),
+               ("get_nodes_by_todo", "DONE"),
+               ("get_nodes_by_property", "ORDERED"),
+               ("get_nodes_by_property", "name")]
+
+    def load(self, text, index, lazy=False):
+        tree = PyOrgMode.OrgDataStructure(index=index)
+        if lazy:
+            handle, name = tempfile.mkstemp(suffix=".org")
+            os.write(handle, text.encode("utf-8"))
+            os.close(handle)
+            self.addCleanup(os.remove, name)
+            tree.load_from_file(name, lazy=True)
+        else:
+            tree.load_from_string(text)
+        return tree
+
+    def assertSameLookups(self, text, lazy=False):
+        indexed = self.load(text, True, lazy)
+        walked = self.load(text, False)
+        self.assertIsNotNone(indexed.index)
+        self.assertIsNone(walked.index)
+        for method, key in self.LOOKUPS:
+            if lazy and method == "get_nodes_by_property":
+                continue  # see test_lazy_properties
+            lookup = getattr(PyOrgMode.OrgDataStructure, method)
+            self.assertEqual(headings(lookup(indexed.root, key)),
+                             headings(lookup(walked.root, key)))
+        self.assertEqual([todo.heading for todo in indexed.extract_todo_list()],
+                         [todo.heading for todo in walked.extract_todo_list()])
+
+    def test_test_org(self):
+        with open("test.org") as f:
+            text = f.read().decode("utf-8")
+        self.assertSameLookups(text)
+        self.assertSameLookups(text, lazy=True)
+
+    def test_tricky_lines(self):
+        self.assertSameLookups(TRICKY)
+        self.assertSameLookups(TRICKY, lazy=True)
+
+    def test_lookups(self):
+        tree = self.load(TRICKY, True)
+        find = tree.index.find
+        self.assertEqual(headings(find("tag", "tag1")), ["heading"])
+        self.assertEqual(headings(find("priority", "A")), ["heading"])
+        self.assertEqual(headings(find("todo", "DONE")), ["sub heading"])
+        self.assertEqual(headings(find("property", "name")), ["heading"])
+        self.assertEqual(find("heading", "missing"), [])
+
+    def test_below_a_node(self):
+        tree = self.load("* a :t:\n** b :t:\n* c :t:\n", True)
+        first = tree.root.content[0]
+        self.assertEqual(headings(tree.index.find("tag", "t", first)),
+                         ["a", "b"])
+        self.assertEqual(headings(tree.index.find("tag", "t", tree.root)),
+                         ["a", "b", "c"])
+
+    def test_no_shared_default(self):
+        for tree in self.load(TRICKY, True), self.load(TRICKY, False):
+            for i in range(2):
+                self.assertEqual(headings(
+                    PyOrgMode.OrgDataStructure.get_node_by_heading(
+                        tree.root, "last")), ["last"])
+
+    def test_append_updates_the_index(self):
+        tree = PyOrgMode.OrgDataStructure(index=True)
+        node = PyOrgMode.OrgNode.Element()
+        node.heading = "new"
+        node.tags = ["things"]
+        node.level = 1
+        node.todo = "TODO"
+        child = PyOrgMode.OrgNode.Element()
+        child.heading = "child"
+        child.level = 2
+        node.append_clean(child)
+        tree.root.append_clean(node)
+        self.assertEqual(tree.index.find("tag", "things"), [node])
+        self.assertEqual(tree.index.find("heading", "child"), [child])
+        self.assertEqual(headings(tree.extract_todo_list()), ["new"])
+
+        drawer = PyOrgMode.OrgDrawer.Element("PROPERTIES")
+        drawer.append(PyOrgMode.OrgDrawer.Property("FRUITS", "pineapples"))
+        child.append_clean(drawer)
+        self.assertEqual(tree.index.find("property", "FRUITS"), [child])
+
+    def test_changed_node_is_indexed_again(self):
+        tree = self.load(TRICKY, True)
+        node = tree.index.find("heading", "last")[0]
+        node.heading = "first"
+        tree.index.add(node)
+        self.assertEqual(tree.index.find("heading", "last"), [])
+        self.assertEqual(tree.index.find("heading", "first"), [node])
+        # it keeps its place
+        self.assertEqual(headings(tree.index.find_any("heading",
+                                                      ["first", "heading"])),
+                         ["heading", "first"])
+
+    def test_removed_nodes(self):
+        for lazy in False, True:
+            tree = self.load("* a :t:\n** old :t:\n*** below\n* b :t:\n"
+                             "* c :t:\n", True, lazy)
+            get = PyOrgMode.OrgDataStructure.get_nodes_by_tag
+            first = tree.root.content[0]
+            # replaced like johnny's update_document does
+            first.content = []
+            self.assertEqual(PyOrgMode.OrgDataStructure.get_node_by_heading(
+                tree.root, "old"), [])
+            self.assertEqual(headings(get(tree.root, "t")), ["a", "b", "c"])
+            self.assertEqual(tree.index.find("heading", "below", first), [])
+            del tree.root.content[1]
+            self.assertEqual(headings(get(tree.root, "t")), ["a", "c"])
+            self.assertEqual(tree.index.find("heading", "below"), [])
+            # they are dropped from the index once found
+            self.assertEqual(len(tree.index), 2)
+            # moved, but still in the tree
+            tree.root.content.insert(0, "text\n")
+            tree.root.content.reverse()
+            self.assertEqual(headings(get(tree.root, "t")), ["a", "c"])
+
+    def test_build_index(self):
+        tree = self.load(TRICKY, False)
+        tree.build_index()
+        self.assertEqual(len(tree.index), 3)
+        self.assertEqual(headings(tree.index.find("todo", "TODO")),
+                         ["heading"])
+
+    def test_lazy_properties(self):
+        tree = self.load("* a\n:PROPERTIES:\n:ID: 1\n:END:\n* b\n", True,
+                         lazy=True)
+        first = tree.root.content[0]
+        self.assertTrue(hasattr(first, "_children"))
+        # the properties are only known once the node is parsed
+        self.assertEqual(tree.index.find("property", "ID"), [])
+        first.content
+        self.assertEqual(tree.index.find("property", "ID"), [first])
+
+
+if __name__ == '__main__':
+    unittest.main()
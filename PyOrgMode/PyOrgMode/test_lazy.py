@@ -0,0 +1,62 @@
+"""Tests for loading org files lazily"""
+
+import os
+import tempfile
+
+import PyOrgMode
+from test_classifier import TRICKY, dump
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class TestLazyLoading(unittest.TestCase):
+    def write(self, text, newline="\n"):
+        handle, name = tempfile.mkstemp(suffix=".org")
+        os.write(handle, text.replace("\n", newline).encode("utf-8"))
+        os.close(handle)
+        self.addCleanup(os.remove, name)
+        return name
+
+    def load(self, name, lazy):
+        tree = PyOrgMode.OrgDataStructure()
+        tree.load_from_file(name, lazy=lazy)
+        return tree
+
+    def assertSameTree(self, name):
+        self.assertEqual(dump(self.load(name, True).root),
+                         dump(self.load(name, False).root))
+
+    def test_test_org(self):
+        self.assertSameTree("test.org")
+
+    def test_tricky_lines(self):
+        self.assertSameTree(self.write(TRICKY))
+
+    def test_crlf(self):
+        self.assertSameTree(self.write(TRICKY, "\r\n"))
+
+    def test_cr(self):
+        self.assertSameTree(self.write(TRICKY, "\r"))
+
+    def test_heading_in_drawer(self):
+        self.assertSameTree(self.write(
+            "* a\n:PROPERTIES:\n* not a heading\n:END:\n** b\n"))
+
+    def test_skipped_levels(self):
+        self.assertSameTree(self.write("* a\n*** c\ntext\n** b\n* d\n"))
+
+    def test_only_used_nodes_are_parsed(self):
+        tree = self.load(self.write(
+            "* first\n| a | b |\n* second\n** third\ntext\n"), True)
+        first, second = tree.root.content
+        self.assertEqual(second.content[0].heading, "third")
+        # the children are put into the content once it is parsed
+        self.assertTrue(hasattr(first, "_children"))
+        self.assertEqual(first.content[0].content, [[" a ", " b "]])
+        self.assertIs(second.content[0].parent, second)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Tests for reading org files through a memory map"""
+
+import os
+import tempfile
+
+import PyOrgMode
+from test_classifier import TRICKY, dump
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class TestMappedFile(unittest.TestCase):
+    def write(self, data):
+        handle, name = tempfile.mkstemp(suffix=".org")
+        os.write(handle, data)
+        os.close(handle)
+        self.addCleanup(os.remove, name)
+        return name
+
+    def lines(self, name, form, chunk_size=None):
+        tree = PyOrgMode.OrgDataStructure()
+        if chunk_size is not None:
+            tree.MMAP_CHUNK_SIZE = chunk_size
+        return list(tree._lines(name, form))
+
+    def assertSameLines(self, data):
+        name = self.write(data)
+        expected = self.lines(name, "file")
+        for chunk_size in None, 1, 7, 64:
+            self.assertEqual(self.lines(name, "mmap", chunk_size), expected)
+
+    def test_test_org(self):
+        with open("test.org", "rb") as f:
+            self.assertSameLines(f.read())
+
+    def test_newlines(self):
+        self.assertSameLines(b"a\r\nb\rc\n\r\nd")
+
+    def test_other_line_breaks(self):
+        self.assertSameLines(u"a\x0cb\nc\u2028d\r\ne".encode("utf-8"))
+
+    def test_no_newline_at_the_end(self):
+        self.assertSameLines(TRICKY.rstrip("\n").encode("utf-8"))
+
+    def test_empty_file(self):
+        self.assertSameLines(b"")
+
+    def test_same_tree(self):
+        name = self.write(TRICKY.encode("utf-8"))
+        trees = []
+        for form in "file", "mmap":
+            tree = PyOrgMode.OrgDataStructure()
+            tree.load_from_file(name, form)
+            trees.append(dump(tree.root))
+        self.assertEqual(trees[0], trees[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
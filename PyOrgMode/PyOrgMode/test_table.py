@@ -0,0 +1,141 @@
+"""Tests for the rows of tables, stored by column"""
+
+import PyOrgMode
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+TABLE = """| name | size |
+|------+------|
+| b | 10 |
+| a | 9 |
+| b | 2 |
+"""
+
+ALIGNED = """| name | size |
+|------+------|
+| b    |   10 |
+| a    |    9 |
+| b    |    2 |
+"""
+
+
+class TestColumns(unittest.TestCase):
+    def setUp(self):
+        tree = PyOrgMode.OrgDataStructure()
+        tree.load_from_string(TABLE)
+        self.table = tree.root.content[0]
+
+    def test_rows(self):
+        rows = [[" name ", " size "], ["------+------"], [" b ", " 10 "],
+                [" a ", " 9 "], [" b ", " 2 "]]
+        self.assertEqual(list(self.table.content), rows)
+        self.assertEqual(self.table.content, rows)
+        self.assertEqual(len(self.table.content), 5)
+        self.assertEqual(self.table.content[1], ["------+------"])
+        self.assertEqual(self.table.content[-1], [" b ", " 2 "])
+        self.assertEqual(self.table.content[2:4], rows[2:4])
+        self.table.align = False
+        self.assertEqual(self.table.output(), TABLE)
+
+    def test_column(self):
+        column = self.table.content.column(1)
+        self.assertEqual(column, [" size ", None, " 10 ", " 9 ", " 2 "])
+        self.assertIs(column, self.table.content.column(1))
+
+    def test_replace(self):
+        self.table.content = [["x", "1"], ["y"]]
+        self.assertIsInstance(self.table.content, PyOrgMode.OrgTable.Columns)
+        self.assertEqual(self.table.output(), "| x | 1 |\n| y |   |\n")
+
+    def test_change_rows(self):
+        content = self.table.content
+        content[0] = ["c", "d", "e"]
+        del content[1]
+        content.append(["f"])
+        self.assertEqual(content, [["c", "d", "e"], [" b ", " 10 "],
+                                   [" a ", " 9 "], [" b ", " 2 "], ["f"]])
+        del content[:]
+        self.assertEqual(content, [])
+
+    def test_change_cells(self):
+        content = self.table.content
+        content[2][1] = " 11 "
+        for row in content[2:]:
+            row[0] = row[0].upper()
+        content[-1].append(" x ")
+        self.assertEqual(content, [[" name ", " size "], ["------+------"],
+                                   [" B ", " 11 "], [" A ", " 9 "],
+                                   [" B ", " 2 ", " x "]])
+        self.assertEqual(content.column(0)[2], " B ")
+
+    def test_sort(self):
+        del self.table.content[:2]
+        self.table.content.sort([0, 1], key=lambda cell: int(cell)
+                                if cell.strip().isdigit() else cell)
+        self.assertEqual(self.table.content, [[" a ", " 9 "], [" b ", " 2 "],
+                                              [" b ", " 10 "]])
+
+    def test_typed_columns(self):
+        table = PyOrgMode.OrgTable.Element(types={1: "l"})
+        table.content = [["b", "10"], ["a", " 9 "], ["b", "2"]]
+        self.assertEqual(list(table.content.column(1)), [10, 9, 2])
+        table.content.sort([0, 1], reverse=True)
+        self.assertEqual(table.content, [["b", 10], ["b", 2], ["a", 9]])
+        self.assertEqual(table.output(), "| b | 10 |\n| b |  2 |\n| a |  9 |\n")
+        table.content[1][1] = "3"
+        self.assertEqual(table.content[1], ["b", 3])
+
+    def test_typed_short_rows(self):
+        rows = [["a", "1"], ["---"], ["b"]]
+        typed = PyOrgMode.OrgTable.Element(types={1: "l"})
+        typed.content = rows
+        untyped = PyOrgMode.OrgTable.Element()
+        untyped.content = rows
+        self.assertEqual(typed.content, [["a", 1], ["---"], ["b"]])
+        self.assertEqual(typed.output(), untyped.output())
+        self.assertEqual(typed.output(), "| a | 1 |\n|---+---|\n| b |   |\n")
+
+
+class TestAlignment(unittest.TestCase):
+    def output(self, text):
+        tree = PyOrgMode.OrgDataStructure()
+        tree.load_from_string(text)
+        return tree.root.content[0].output()
+
+    def test_aligned(self):
+        self.assertEqual(self.output(TABLE), ALIGNED)
+        self.assertEqual(self.output(ALIGNED), ALIGNED)
+
+    def test_appended_rows(self):
+        table = PyOrgMode.OrgTable.Element()
+        table.content = [["a", "b"]]
+        self.assertEqual(table.content.layout(), [[1, 0, 1], [1, 0, 1]])
+        table.append(["long", "12"])
+        table.append(["-"])
+        self.assertEqual(table.content.layout(), [[4, 0, 2], [2, 1, 2]])
+        self.assertEqual(table.output(),
+                         "| a    | b  |\n| long | 12 |\n|------+----|\n")
+
+    def test_display_width(self):
+        self.assertEqual(PyOrgMode.display_width(u"abc"), 3)
+        self.assertEqual(PyOrgMode.display_width(u"l\xe9s"), 3)
+        self.assertEqual(PyOrgMode.display_width(u"e\u0301"), 1)
+        self.assertEqual(PyOrgMode.display_width(u"\u65e5\u672c"), 4)
+
+    def test_wide_cells(self):
+        self.assertEqual(self.output(u"|\u65e5\u672c|x|\n|abc|y|\n"),
+                         u"| \u65e5\u672c | x |\n| abc  | y |\n")
+
+    def test_test_org(self):
+        tree = PyOrgMode.OrgDataStructure()
+        tree.load_from_file("test.org")
+        table = tree.root.content[0].content[0]
+        with open("test.org") as f:
+            lines = f.read().decode("utf-8").splitlines(True)
+        self.assertEqual(table.output(), "".join(lines[1:5]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""Tests for changing the todo states between parsing"""
+
+import PyOrgMode
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class TestTodoStates(unittest.TestCase):
+    def setUp(self):
+        self.tree = PyOrgMode.OrgDataStructure()
+
+    def first_node(self, text):
+        self.tree.root = PyOrgMode.OrgNode.Element()
+        self.tree.load_from_string(text)
+        return self.tree.root.content[0]
+
+    def test_added_state_is_recognized(self):
+        self.assertFalse(hasattr(self.first_node("* WAIT for it"), "todo"))
+        self.tree.add_todo_state("WAIT")
+        self.assertEqual(self.first_node("* WAIT for it").todo, "WAIT")
+
+    def test_added_done_state_is_recognized(self):
+        self.tree.add_done_state("CANCELLED")
+        node = self.first_node("* CANCELLED never mind")
+        self.assertEqual(node.todo, "CANCELLED")
+        self.assertEqual(node.heading, "never mind")
+
+    def test_removed_state_is_not_recognized(self):
+        self.assertEqual(self.first_node("* TODO a").todo, "TODO")
+        self.tree.remove_todo_state("TODO")
+        self.assertEqual(self.first_node("* TODO a").heading, "TODO a")
+
+    def test_set_states(self):
+        self.tree.set_todo_states(["NEXT", "|", "FINISHED"])
+        self.assertEqual(self.first_node("* FINISHED a").todo, "FINISHED")
+        self.assertFalse(hasattr(self.first_node("* TODO a"), "todo"))
+
+    def test_disabled_states(self):
+        self.tree.set_todo_states([])
+        node = self.first_node("* TODO [#A] a :tag:")
+        self.assertEqual(node.heading, "TODO [#A] a ")
+        self.assertEqual(node.tags, ["tag"])
+
+    def test_heading_parts(self):
+        node = self.first_node("** TODO [#A] a heading :tag1:tag2:")
+        self.assertEqual(node.level, 2)
+        self.assertEqual(node.todo, "TODO")
+        self.assertEqual(node.priority, "A")
+        self.assertEqual(node.heading, "a heading ")
+        self.assertEqual(node.tags, ["tag1", "tag2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""Tests for writing org files in chunks with write_to"""
+
+import io
+import os
+import tempfile
+
+import PyOrgMode
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class TestWriteTo(unittest.TestCase):
+    def setUp(self):
+        self.tree = PyOrgMode.OrgDataStructure()
+        self.tree.load_from_file("test.org")
+
+    def test_same_as_output(self):
+        stream = io.StringIO()
+        self.tree.root.write_to(PyOrgMode._TextStream(stream))
+        self.assertEqual(stream.getvalue(), self.tree.root.output())
+
+    def test_save_to_file(self):
+        handle, name = tempfile.mkstemp(suffix=".org")
+        os.close(handle)
+        self.addCleanup(os.remove, name)
+        self.tree.save_to_file(name)
+        with io.open(name, encoding="utf-8") as f:
+            self.assertEqual(f.read(), unicode(self.tree.root))
+
+    def test_chunks(self):
+        table = PyOrgMode.OrgTable.Element()
+        table.align = False
+        table.append(["a", "b"])
+        table.append(["c", "d"])
+        drawer = PyOrgMode.OrgDrawer.Element("PROPERTIES")
+        drawer.append(PyOrgMode.OrgDrawer.Property("name", u"v\xe9"))
+        chunks = PyOrgMode._Chunks()
+        table.write_to(chunks)
+        drawer.write_to(chunks)
+        self.assertEqual(chunks, ["", u"|a|b|\n", u"|c|d|\n",
+                                  "", ":PROPERTIES:\n",
+                                  "", u":name: v\xe9", "\n", ":END:\n"])
+
+
+if __name__ == '__main__':
+    unittest.main()
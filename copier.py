@@ -0,0 +1,1110 @@
+"""
+Copying of the files selected in the org file.
+
+The k and K elements are first turned into a flat list of file copy
+operations. These are then run on worker threads, with a separate queue
+and set of workers for every pair of source and target device so that a
+slow disk doesn't hold up the others. Each queue is worked off largest file
+first, which keeps the workers busy until the end instead of leaving one of
+them with a big file while the others are idle. On hard disks, where the
+seeks cost more than that, the queues can be ordered by the position of the
+files on the disk instead, see ORDERS. Operations with the same target are
+run one after another by the same worker, in the order of the plan.
+
+The data of a file is copied by the fastest method that works for it: a
+reflink clone where source and target share a copy-on-write filesystem,
+copy_file_range or sendfile to copy inside the kernel, and only if none of
+those is possible a loop through a large userspace buffer.
+
+Instead of copying, files can also be hard linked or moved into the target
+directory, and whole directories can be moved with a single rename. This is
+decided for each operation while planning: only where the source and the
+target are on the same device, everything else is still copied.
+
+The target directories are all created before the first file is copied.
+A copy gets the timestamps and permissions of its source before it is
+renamed into place, so a file under its final name is complete. Only the
+directories of copied trees get theirs in a batch after the last file, as
+copying into a directory changes its mtime.
+
+A Journal records the plan before anything is done and marks the
+operations as they complete, so an interrupted run can be resumed.
+
+Copies can be verified: the data then goes through a userspace buffer
+where it is hashed on the way, and the copy is hashed again after it has
+been written to disk. The source is read only once this way. Copies which
+don't match are made again, the checksums are kept in a Manifest.
+"""
+
+import array
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import io
+import json
+import os
+import shutil
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+MODES = ('copy', 'link', 'move')
+
+# what can be preserved of the sources, see apply_metadata()
+METADATA = ('times', 'mode')
+
+# the orders the operations of a queue can be run in:
+# size: largest file first
+# inode: by inode number, which most filesystems allocate close to where
+#   the data is
+# extent: by the position of the first block of the file on the disk, as
+#   reported by FIEMAP on Linux, otherwise by inode
+ORDERS = ('size', 'inode', 'extent')
+
+
+class Operation(object):
+    """Copying, linking or moving of a single file, or moving of a directory"""
+
+    __slots__ = ('kind', 'src', 'dst', 'size', 'files', 'device',
+                 'target_device', 'inode', 'is_directory', 'overwrite',
+                 'method', 'digest')
+
+    def __init__(self, kind, src, dst, size, device, target_device,
+                 is_directory=False, overwrite=False, files=1, inode=0):
+        self.kind = kind  # one of MODES
+        self.src = src
+        self.dst = dst
+        self.size = size  # in bytes, of all files of a directory
+        self.files = files  # in a directory
+        self.device = device  # of the source
+        self.target_device = target_device
+        self.inode = inode  # of the source
+        self.is_directory = is_directory
+        self.overwrite = overwrite
+        self.method = None  # how it was done, e.g. the copy_file() method
+        self.digest = None  # sha256 of a verified copy
+
+    def __repr__(self):
+        return "Operation(%s %r -> %r, %r bytes)" % (self.kind, self.src,
+                                                    self.dst, self.size)
+
+
+FICLONE = 0x40049409  # from <linux/fs.h>
+BUFFER_SIZE = 1024 * 1024
+
+# files are copied to a hidden file with this suffix next to the target,
+# and renamed when complete
+PARTIAL_SUFFIX = '.jbpartial'
+
+# the mtime of a copy may be rounded by the target filesystem (FAT: 2 s)
+MTIME_TOLERANCE = 2.0
+
+# the permissions of a newly created file and directory
+_umask = os.umask(0o022)
+os.umask(_umask)
+DEFAULT_MODE = 0o666 & ~_umask
+DEFAULT_DIRECTORY_MODE = 0o777 & ~_umask
+
+# the time it takes to create a file, as the number of bytes that could have
+# been copied meanwhile
+FILE_COST = 64 * 1024
+
+# errors which mean that a copy method isn't possible for a pair of files,
+# as opposed to the copy failing
+_UNSUPPORTED = set(getattr(errno, name) for name in
+                   ('EXDEV', 'ENOSYS', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP',
+                    'EBADF', 'ENOTTY', 'EPERM') if hasattr(errno, name))
+
+
+def _libc_function(name, *argtypes):
+    """Returns the libc function name, or None where it is unavailable"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = getattr(libc, name)
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = argtypes
+    func.restype = ctypes.c_ssize_t
+    return func
+
+
+def _checked(func):
+    def call(*args):
+        n = func(*args)
+        if n < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return n
+    return call
+
+
+if hasattr(os, 'copy_file_range'):
+    def _copy_file_range(fdin, fdout, count):
+        return os.copy_file_range(fdin, fdout, count)
+else:
+    # python < 3.8
+    _libc_copy_file_range = _libc_function(
+        'copy_file_range', ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+        ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint)
+    if _libc_copy_file_range is not None:
+        _libc_copy_file_range = _checked(_libc_copy_file_range)
+
+        def _copy_file_range(fdin, fdout, count):
+            return _libc_copy_file_range(fdin, None, fdout, None, count, 0)
+    else:
+        _copy_file_range = None
+
+if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+    def _sendfile(fdin, fdout, count):
+        return os.sendfile(fdout, fdin, None, count)
+else:
+    _libc_sendfile = _libc_function(
+        'sendfile', ctypes.c_int, ctypes.c_int, ctypes.c_void_p,
+        ctypes.c_size_t)
+    if _libc_sendfile is not None:
+        _libc_sendfile = _checked(_libc_sendfile)
+
+        def _sendfile(fdin, fdout, count):
+            return _libc_sendfile(fdout, fdin, None, count)
+    else:
+        _sendfile = None
+
+
+def _reflink(fsrc, fdst):
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def _kernel_copy(func):
+    """Turns a single call copy function into one that copies everything.
+    Some filesystems report the end of the file right away instead of
+    failing, so a copy shorter than the source is taken for an unsupported
+    method."""
+    def copy(fsrc, fdst):
+        copied = 0
+        while True:
+            n = func(fsrc.fileno(), fdst.fileno(), BUFFER_SIZE * 64)
+            if n == 0:
+                break
+            copied += n
+        size = os.fstat(fsrc.fileno()).st_size
+        if copied < size:
+            raise OSError(errno.EINVAL, "copied %d of %d bytes" % (copied, size))
+    return copy
+
+
+def _userspace_copy(fsrc, fdst):
+    shutil.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+
+
+COPY_METHODS = [(name, func) for name, func in
+                [('reflink', fcntl and _reflink),
+                 ('copy_file_range', _copy_file_range and _kernel_copy(_copy_file_range)),
+                 ('sendfile', _sendfile and _kernel_copy(_sendfile)),
+                 ('userspace', _userspace_copy)]
+                if func]
+
+
+POSIX_FADV_DONTNEED = 4  # from <fcntl.h> on Linux
+
+if hasattr(os, 'posix_fadvise'):
+    def _drop_cache(fd):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+else:
+    # python < 3.3
+    _libc_posix_fadvise = _libc_function(
+        'posix_fadvise', ctypes.c_int, ctypes.c_int64, ctypes.c_int64,
+        ctypes.c_int)
+
+    def _drop_cache(fd):
+        if _libc_posix_fadvise is not None:
+            _libc_posix_fadvise(fd, 0, 0, POSIX_FADV_DONTNEED)
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            buf = f.read(BUFFER_SIZE)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+def copy_file_verified(fsrc, dst):
+    """
+    Copies the data of the source file object fsrc to dst through a
+    userspace buffer, hashing it on the way. dst is then dropped from the
+    page cache where possible and hashed again, so that what is compared is
+    what is on the disk. Returns the sha256 hex digests of the data read
+    from fsrc and of dst.
+    """
+    h = hashlib.sha256()
+    fsrc.seek(0)
+    with open(dst, 'wb') as fdst:
+        while True:
+            buf = fsrc.read(BUFFER_SIZE)
+            if not buf:
+                break
+            h.update(buf)
+            fdst.write(buf)
+        fdst.flush()
+        os.fsync(fdst.fileno())
+        _drop_cache(fdst.fileno())
+    return h.hexdigest(), _hash_file(dst)
+
+
+FS_IOC_FIEMAP = 0xC020660B  # from <linux/fs.h>
+FIEMAP_MAX_OFFSET = 2 ** 64 - 1
+
+# from <linux/fiemap.h>, with room for a single extent
+_fiemap = struct.Struct('=QQIIII')  # start, length, flags, mapped, count, reserved
+_fiemap_extent = struct.Struct('=QQQQQIIII')  # logical, physical, length, ...
+_FIEMAP_EXTENT_FLAGS = 5  # the index of the flags of an extent
+FIEMAP_EXTENT_UNKNOWN = 0x2  # e.g. not written to the disk yet
+
+
+def physical_offset(path):
+    """The position of the first block of path on its disk, or None where
+    the file has no blocks of its own or their position isn't known yet.
+    Raises IOError or OSError where FIEMAP is unavailable."""
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOTTY, os.strerror(errno.ENOTTY))
+    # an array, python 2 doesn't let ioctl() write into a bytearray
+    buf = array.array('B', _fiemap.pack(0, FIEMAP_MAX_OFFSET, 0, 0, 1, 0) +
+                      b'\0' * _fiemap_extent.size)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, buf, True)
+    finally:
+        os.close(fd)
+    if _fiemap.unpack_from(buf)[3] == 0:
+        return None  # empty, or the data is inline in the inode
+    extent = _fiemap_extent.unpack_from(buf, _fiemap.size)
+    if extent[_FIEMAP_EXTENT_FLAGS] & FIEMAP_EXTENT_UNKNOWN:
+        return None
+    return extent[1]
+
+
+# the source devices without FIEMAP, their files are ordered by inode
+# without asking for every single one
+_no_fiemap = set()
+
+
+def _extent_key(op):
+    offset = None
+    if op.device not in _no_fiemap:
+        try:
+            offset = physical_offset(op.src)
+        except (IOError, OSError) as e:
+            if e.errno in _UNSUPPORTED:
+                _no_fiemap.add(op.device)
+    if offset is None:
+        return (1, op.inode)
+    return (0, offset)
+
+
+_ORDER_KEYS = {'size': lambda op: -op.size,
+               'inode': lambda op: op.inode,
+               'extent': _extent_key}
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def partial_file(dst):
+    """Creates an empty file to copy dst into, in the same directory and
+    under a name no other copy uses. Returns its path."""
+    head, tail = os.path.split(dst)
+    fd, path = tempfile.mkstemp(prefix='.%s.' % tail, suffix=PARTIAL_SUFFIX,
+                                dir=head)
+    try:
+        if hasattr(os, 'fchmod'):
+            os.fchmod(fd, DEFAULT_MODE)  # instead of mkstemp's 0600
+    finally:
+        os.close(fd)
+    return path
+
+
+def remove_partial_files(directory):
+    """Removes the partial files an interrupted run left in directory"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith('.') and name.endswith(PARTIAL_SUFFIX):
+            _remove(os.path.join(directory, name))
+
+
+def copy_file(fsrc, dst):
+    """
+    Copies the data of the source file object fsrc to dst, trying the
+    methods in COPY_METHODS in turn. Returns the name of the method that was
+    used.
+    """
+    with open(dst, 'wb') as fdst:
+        for name, func in COPY_METHODS[:-1]:
+            try:
+                func(fsrc, fdst)
+                return name
+            except (IOError, OSError) as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+            # start over with the next method
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+        name, func = COPY_METHODS[-1]
+        func(fsrc, fdst)
+        return name
+
+
+def _ancestors(path):
+    """path and the directories above it"""
+    while True:
+        yield path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return
+        path = parent
+
+
+def _add_ancestors(paths, path):
+    """Adds path and the directories above it to the set paths"""
+    for d in _ancestors(path):
+        if d in paths:
+            return
+        paths.add(d)
+
+
+class Plan(object):
+    """
+    The operations that put the k and K elements into the target directory.
+
+    Directories are treated like copytree() does it: existing target
+    directories are merged into and existing files are refused. A directory
+    is only moved with a single rename if the target doesn't exist yet and
+    no other operation reads from inside it or writes below its target;
+    a directory move which turns out to overlap with an operation added
+    later is replaced with one operation per file again. A file which is
+    the source of several operations is copied by all of them.
+    """
+
+    def __init__(self, source, mode='copy'):
+        self.source = source  # scanner.Scanner of the source directory
+        self.mode = mode
+        self.directories = []  # to create before the files are copied
+        # target directory -> the source directory it is a copy of
+        self.directory_sources = {}
+        self.completed = []  # of an earlier run, see Journal.resume()
+        self.operations = []
+        self.files = 0
+        self.bytes = 0
+        self.folders = {}  # target folder -> [files, bytes]
+        self._devices = {}  # target directory -> device
+        # target -> (operation, relpath, entry, folder) of directory moves
+        self._moved = {}
+        self._moved_sources = {}  # source -> target of directory moves
+        self._sources = set()  # of all operations
+        self._file_sources = {}  # source -> the first file operation
+        self._source_parents = set()  # the directories above them
+        # the planned target directories, the targets of the directory moves
+        # and the directories above them
+        self._target_parents = set()
+        self._directories = set()
+        self._targets = {}  # target -> number of operations writing it
+
+    def add_directory(self, path, source=None):
+        """Adds the target directory path, which is a copy of the source
+        directory source if that is given"""
+        if path not in self._directories:
+            self._directories.add(path)
+            self.directories.append(path)
+            _add_ancestors(self._target_parents, path)
+        if source is not None:
+            self.directory_sources[path] = source
+
+    def append(self, op, folder=None):
+        """Adds op to the plan and its size to the totals of folder"""
+        self.operations.append(op)
+        self._targets[op.dst] = self._targets.get(op.dst, 0) + 1
+        self._count(op, folder, 1)
+        if op.src not in self._sources:
+            self._sources.add(op.src)
+            _add_ancestors(self._source_parents, os.path.dirname(op.src))
+        if not op.is_directory:
+            first = self._file_sources.setdefault(op.src, op)
+            if first is not op and 'move' in (first.kind, op.kind):
+                # a file can only be moved to one place, it is copied to
+                # each of them instead
+                first.kind = op.kind = 'copy'
+
+    def _count(self, op, folder, sign):
+        self.files += sign * op.files
+        self.bytes += sign * op.size
+        if folder is not None:
+            totals = self.folders.setdefault(folder, [0, 0])
+            totals[0] += sign * op.files
+            totals[1] += sign * op.size
+
+    def conflicts(self):
+        """Returns (target, operations) for the targets written by more than
+        one operation, sorted by target. The CopyExecutor runs these
+        operations one after another, so where the target may be overwritten
+        the last one wins."""
+        return sorted((dst, n) for dst, n in self._targets.items() if n > 1)
+
+    def target_device(self, path):
+        """The device path is (or will be) on"""
+        head = os.path.dirname(path)
+        device = self._devices.get(head)
+        if device is None:
+            existing = os.path.abspath(head)
+            while not os.path.exists(existing):
+                parent = os.path.dirname(existing)
+                if parent == existing:
+                    break
+                existing = parent
+            device = self._devices[head] = os.stat(existing).st_dev
+        return device
+
+    def _kind(self, entry, target_device):
+        if entry.is_symlink or entry.device != target_device:
+            # linking or renaming would act on the link, not its target
+            return 'copy'
+        return self.mode
+
+    def add_file(self, relpath, dst, entry, overwrite=False, folder=None):
+        """Adds the file relpath of the source, described by the
+        scanner.Entry entry"""
+        target_device = self.target_device(dst)
+        src = os.path.join(self.source.root, relpath)
+        self._split_moves(src)
+        self.add_directory(os.path.dirname(dst))
+        self.append(Operation(self._kind(entry, target_device),
+                              src, dst, entry.size, entry.device,
+                              target_device, overwrite=overwrite,
+                              inode=entry.inode),
+                    folder)
+
+    def add_tree(self, relpath, dst, entry, folder=None):
+        """Adds the directory relpath of the source and everything in it"""
+        top = relpath.rstrip(os.sep)
+        src = os.path.join(self.source.root, top)
+        target_device = self.target_device(dst)
+
+        # the listings come from the scan, or its index
+        self.source.reset()
+        entries = list(self.source.walk(top))
+        # symlink loops are left out
+        skipped = set(self.source.skipped)
+
+        if (self.mode == 'move' and
+                self._kind(entry, target_device) == 'move' and
+                not os.path.exists(dst) and self._can_move(src, dst)):
+            files = [e for e in entries if not e.is_directory]
+            op = Operation('move', src, dst, sum(e.size for e in files),
+                           entry.device, target_device, is_directory=True,
+                           files=len(files))
+            self.append(op, folder)
+            self._moved[dst] = (op, relpath, entry, folder)
+            self._moved_sources[src] = dst
+            _add_ancestors(self._target_parents, dst)
+            return
+
+        self._split_moves(src)
+        self.add_directory(dst, src)
+        for e in entries:
+            d = os.path.join(dst, e.relpath[len(top):].lstrip(os.sep))
+            if not e.is_directory:
+                self.add_file(e.relpath, d, e, folder=folder)
+            elif e.relpath not in skipped:
+                self.add_directory(d, os.path.join(self.source.root, e.relpath))
+
+    def _can_move(self, src, dst):
+        """Whether the directory src can be renamed to dst without taking
+        away the source of another operation or the target directory of
+        one, or moving into the target of another move"""
+        return (src not in self._source_parents and
+                not any(d in self._sources for d in _ancestors(src)) and
+                dst not in self._target_parents and
+                not any(d in self._moved for d in _ancestors(dst)))
+
+    def _split_moves(self, src):
+        """Replaces the directory moves whose source src is in or contains
+        with operations for each file"""
+        for d in list(_ancestors(src)):
+            if d in self._moved_sources:
+                self._split(self._moved_sources[d])
+        if src in self._source_parents:
+            for moved_src, dst in list(self._moved_sources.items()):
+                if moved_src.startswith(src + os.sep):
+                    self._split(dst)
+
+    def _split(self, dst):
+        op, relpath, entry, folder = self._moved.pop(dst)
+        del self._moved_sources[op.src]
+        self.operations.remove(op)
+        self._targets[dst] -= 1
+        self._count(op, folder, -1)
+        self.add_tree(relpath, dst, entry, folder)
+
+    def cost(self):
+        return sum(cost(op) for op in self.operations)
+
+    def export(self, filename, estimate=None):
+        """Writes the plan, its totals and the estimated duration in seconds
+        to filename as JSON. The method of an operation is null until it has
+        been run."""
+        with open(filename, 'w') as f:
+            json.dump({'mode': self.mode,
+                       'files': self.files,
+                       'bytes': self.bytes,
+                       'estimated_seconds': estimate,
+                       'folders': [{'folder': folder,
+                                    'files': files,
+                                    'bytes': size}
+                                   for folder, (files, size) in sorted(self.folders.items())],
+                       'directories': self.directories,
+                       'operations': [{'kind': op.kind,
+                                       'src': op.src,
+                                       'dst': op.dst,
+                                       'files': op.files,
+                                       'bytes': op.size,
+                                       'method': op.method}
+                                      for op in self.operations]},
+                      f, indent=1, sort_keys=True)
+
+
+def apply_metadata(path, st, preserve=METADATA):
+    """Gives the newly created file or directory path the timestamps and/or
+    permissions of the stat result st of its source, like
+    shutil.copystat(). preserve is a subset of METADATA."""
+    mode = stat.S_IMODE(st.st_mode)
+    if stat.S_ISDIR(st.st_mode):
+        default = DEFAULT_DIRECTORY_MODE
+    else:
+        default = DEFAULT_MODE
+    if 'mode' in preserve and mode != default:
+        os.chmod(path, mode)
+    if 'times' in preserve:
+        os.utime(path, (st.st_atime, st.st_mtime))
+
+
+def cost(op):
+    """The effort of op in bytes, for estimating how long it takes"""
+    if op.method is None:
+        copies = op.kind == 'copy'
+    else:  # a link or move may have been copied after all
+        copies = op.method not in ('link', 'rename')
+    return op.files * FILE_COST + (op.size if copies else 0)
+
+
+class Throughput(object):
+    """
+    The speed of the last run, stored in a file next to the org file to
+    estimate how long the next one will take.
+
+    The speed is measured in cost() per second of the whole run, so it
+    includes the concurrency of the executor and the time to create files.
+    """
+
+    MIN_SECONDS = 1.0  # shorter runs are not measured
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rate = None
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                self.rate = float(json.load(f)['rate'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            self.rate = None
+
+    def record(self, cost, seconds):
+        if seconds < self.MIN_SECONDS or cost <= 0:
+            return
+        self.rate = cost / seconds
+        with open(self.filename, 'w') as f:
+            json.dump({'rate': self.rate}, f)
+
+    def estimate(self, plan):
+        """The estimated duration of plan in seconds, or None if no run has
+        been measured yet"""
+        if not self.rate:
+            return None
+        return plan.cost() / self.rate
+
+
+def is_complete(op, started=None):
+    """True if op has evidently been carried out already, by an earlier run
+    that was interrupted before it could record that. A copy is complete if
+    it has the size of the source and either its mtime or, as where the
+    times aren't preserved, was written after started."""
+    if op.kind == 'move' or op.is_directory:
+        return os.path.lexists(op.dst) and not os.path.lexists(op.src)
+    try:
+        src = os.stat(op.src)
+        dst = os.stat(op.dst)
+    except OSError:
+        return False
+    if op.kind == 'link':
+        return (src.st_dev, src.st_ino) == (dst.st_dev, dst.st_ino)
+    return _is_copy(src, dst, started)
+
+
+def _is_copy(src, dst, started):
+    """True if the stat result dst is that of a complete copy of src, see
+    is_complete(). Copies are only renamed into place once they are
+    complete."""
+    return (src.st_size == dst.st_size and
+            (abs(src.st_mtime - dst.st_mtime) <= MTIME_TOLERANCE or
+             (started is not None and
+              dst.st_mtime >= started - MTIME_TOLERANCE)))
+
+
+def finish_move(op, started=None):
+    """Finishes the file move op which fell back to copying, by an earlier
+    run that was interrupted before it could record that. If the target is
+    a complete copy, the source is removed. Returns True if op is complete
+    then."""
+    try:
+        dst = os.stat(op.dst)
+    except OSError:
+        return False
+    try:
+        src = os.stat(op.src)
+    except OSError:
+        return True  # removed already
+    if not _is_copy(src, dst, started):
+        return False
+    os.remove(op.src)
+    return True
+
+
+class Journal(object):
+    """
+    A write-ahead log of a plan, stored in a file next to the org file.
+
+    The file holds one JSON object per line: a header, the directories and
+    operations of the plan, and then the indices of the operations as they
+    start and lists of those that have completed. Completions are written in
+    batches, an operation which started and completed after the last batch
+    is recognised by is_complete() when the run is resumed; a target which
+    is there although its operation didn't start is not taken for one. A
+    move which falls back to copying is recorded right away before its copy
+    is renamed into place, so that a resumed run can remove its source, see
+    finish_move().
+
+    Only an interrupted run is resumed. The journal of a run which failed is
+    discarded, the next run is planned from the org file again.
+    """
+
+    VERSION = 5
+    BATCH_SIZE = 1000
+    BATCH_SECONDS = 5.0
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = None
+        self._index = {}  # operation -> its index in the journal
+        self._pending = []
+        self._flushed = time.time()
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def _write(self, records, sync=True):
+        for record in records:
+            self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def create(self, plan):
+        """Writes plan to a new journal"""
+        self._file = open(self.filename, 'w')
+        self._index = dict((op, i) for i, op in enumerate(plan.operations))
+        records = [{'journal': self.VERSION, 'mode': plan.mode,
+                    'started': time.time()}]
+        records.extend({'dir': d, 'src': plan.directory_sources.get(d)}
+                       for d in plan.directories)
+        records.extend({'op': i,
+                        'kind': op.kind,
+                        'src': op.src,
+                        'dst': op.dst,
+                        'size': op.size,
+                        'device': op.device,
+                        'target_device': op.target_device,
+                        'is_directory': op.is_directory,
+                        'overwrite': op.overwrite,
+                        'files': op.files,
+                        'inode': op.inode}
+                       for i, op in enumerate(plan.operations))
+        self._write(records)
+
+    def resume(self):
+        """Reads the journal and returns a Plan of the operations that have
+        not been completed yet"""
+        plan = None
+        started = None
+        operations = {}
+        done = set()
+        started_ops = set()
+        copied = set()  # moves which fell back to copying
+        with open(self.filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # the line being written when the run stopped
+                if 'journal' in record:
+                    if record['journal'] != self.VERSION:
+                        raise Exception("%s was written by an incompatible version, delete it to start over" % self.filename)
+                    plan = Plan(None, mode=record['mode'])
+                    started = record['started']
+                elif 'dir' in record:
+                    plan.add_directory(record['dir'], record['src'])
+                elif 'op' in record:
+                    operations[record['op']] = Operation(
+                        record['kind'], record['src'], record['dst'],
+                        record['size'], record['device'],
+                        record['target_device'], record['is_directory'],
+                        record['overwrite'], record['files'],
+                        record['inode'])
+                elif 'start' in record:
+                    started_ops.add(record['start'])
+                elif 'done' in record:
+                    done.update(record['done'])
+                elif 'copied' in record:
+                    copied.add(record['copied'])
+        if plan is None:
+            raise Exception("%s is not a journal, delete it to start over" % self.filename)
+
+        for d in plan.directories:
+            remove_partial_files(d)
+
+        self._file = open(self.filename, 'a')
+        for i in sorted(operations):
+            op = operations[i]
+            self._index[op] = i
+            if i in done:
+                plan.completed.append(op)
+            elif ((i in copied and finish_move(op, started)) or
+                  (i in started_ops and is_complete(op, started))):
+                self.mark(op)
+                plan.completed.append(op)
+            else:
+                plan.append(op)
+        self.flush()
+        return plan
+
+    def start(self, op):
+        """Records that op is about to change its target. Not synced to
+        disk, one fsync per file would cost more than the copy of a small
+        one: after a crash of the system rather than the process, the target
+        is refused when the run is resumed, which is safe."""
+        self._write([{'start': self._index[op]}], sync=False)
+
+    def copied(self, op):
+        """Records that the move op fell back to copying, before its copy is
+        renamed into place"""
+        self._write([{'copied': self._index[op]}])
+
+    def mark(self, op):
+        """Records that op has completed"""
+        self._pending.append(self._index[op])
+        if (len(self._pending) >= self.BATCH_SIZE or
+                time.time() - self._flushed >= self.BATCH_SECONDS):
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._write([{'done': self._pending}])
+            self._pending = []
+        self._flushed = time.time()
+
+    def finish(self):
+        """Removes the journal after all operations have completed"""
+        self.discard()
+
+    def discard(self):
+        """Closes and removes the journal"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        _remove(self.filename)
+
+
+class Manifest(object):
+    """
+    The checksums of verified copies, stored in a file next to the org file.
+
+    The lines have the format of sha256sum, so the copies can be checked
+    again later with sha256sum -c. A resumed run adds to the file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = None
+
+    def add(self, digest, path):
+        if self._file is None:
+            self._file = io.open(self.filename, 'a', encoding='utf-8')
+        self._file.write(u'%s  %s\n' % (digest, path))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def makedirs(path):
+    """os.makedirs() which doesn't mind if another thread was faster"""
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+class CopyExecutor(object):
+    """Runs copy operations concurrently, see the module documentation"""
+
+    VERIFY_ATTEMPTS = 3
+
+    def __init__(self, workers=4, journal=None, manifest=None,
+                 preserve=METADATA, order='size'):
+        self.workers = workers  # per pair of devices
+        self.order = order  # one of ORDERS
+        self.journal = journal
+        self.manifest = manifest  # copies are verified if there is one
+        self.preserve = preserve  # see apply_metadata()
+        self.copied = 0
+        self.copied_bytes = 0
+        self.cost = 0  # see cost()
+        self.verified = 0
+        self.mismatches = 0  # copies that had to be made again
+        self.elapsed = 0.0
+        self.methods = {}  # copy method -> number of files
+        self._lock = threading.Lock()
+        self._errors = []
+        self._stop = threading.Event()  # set when the run is interrupted
+        self._created = set()  # target directories known to exist
+
+    def run(self, plan):
+        """Moves the directories of plan, creates its directories, runs the
+        file operations and then sets the metadata of the copied
+        directories. Raises the first error that occurred after all workers
+        have stopped, the journal is discarded then unless the run was
+        interrupted."""
+        started = time.time()
+        try:
+            try:
+                self._run(plan)
+            finally:
+                self.elapsed = time.time() - started
+                # after an interruption, workers may still be finishing a
+                # copy
+                with self._lock:
+                    if self.journal is not None:
+                        self.journal.flush()
+                    if self.manifest is not None:
+                        self.manifest.close()
+            if self._errors:
+                raise self._errors[0]
+        except Exception:
+            # KeyboardInterrupt is no Exception
+            if self.journal is not None:
+                self.journal.discard()
+            raise
+
+    def _run(self, plan):
+        # before anything else, a directory can only be moved to where
+        # nothing exists yet
+        for op in plan.operations:
+            if op.is_directory:
+                self.execute(op)
+                self._done(op)
+
+        for d in plan.directories:
+            makedirs(d)
+            self._created.add(d)
+
+        # the operations with the same target form a chain, which is run
+        # by a single worker
+        queues = {}
+        chains = {}
+        for op in plan.operations:
+            if not op.is_directory:
+                chain = chains.get(op.dst)
+                if chain is None:
+                    chain = chains[op.dst] = []
+                    pair = (op.device, op.target_device)
+                    queues.setdefault(pair, []).append(chain)
+                chain.append(op)
+
+        order_key = _ORDER_KEYS[self.order]
+        threads = []
+        for pending in queues.values():
+            q = queue.Queue()
+            for chain in sorted(pending, key=lambda chain: order_key(chain[0])):
+                q.put(chain)
+            for i in range(min(self.workers, len(pending))):
+                t = threading.Thread(target=self._work, args=(q,))
+                t.daemon = True
+                t.start()
+                threads.append(t)
+        try:
+            for t in threads:
+                # with a timeout, python 2 doesn't deliver Ctrl-C during
+                # join() otherwise
+                while t.is_alive():
+                    t.join(1.0)
+        except KeyboardInterrupt:
+            # the workers stop after the files they are copying, unless the
+            # process exits first. Partial files left behind are removed
+            # when the run is resumed.
+            self._stop.set()
+            raise
+
+        if self.preserve and not self._errors:
+            # the innermost first, the mode of a directory may not allow
+            # changes below it
+            for d in sorted(plan.directory_sources, reverse=True):
+                try:
+                    st = os.stat(plan.directory_sources[d])
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                    continue  # removed from the source meanwhile
+                apply_metadata(d, st, self.preserve)
+
+    def _work(self, q):
+        while not self._errors and not self._stop.is_set():
+            try:
+                chain = q.get_nowait()
+            except queue.Empty:
+                return
+            for op in chain:
+                try:
+                    self.execute(op)
+                except Exception as e:
+                    with self._lock:
+                        self._errors.append(e)
+                    return
+                self._done(op)
+
+    def _done(self, op):
+        with self._lock:
+            self.copied += 1
+            self.copied_bytes += op.size
+            self.cost += cost(op)
+            self.methods[op.method] = self.methods.get(op.method, 0) + 1
+            if op.digest is not None:
+                self.verified += 1
+                self.manifest.add(op.digest, op.dst)
+            if self.journal is not None:
+                self.journal.mark(op)
+
+    def _makedirs(self, path):
+        if path not in self._created:
+            makedirs(path)
+            self._created.add(path)
+
+    def execute(self, op):
+        """Carries out op. A copy is made under a partial name, given the
+        metadata of the source taken while copying it and then renamed into
+        place."""
+        if op.is_directory:
+            if os.path.exists(op.dst):
+                raise Exception("Directory already exists, can't move %s -> %s" % (op.src, op.dst))
+            self._start(op)
+            self._makedirs(os.path.dirname(op.dst))
+            os.rename(op.src, op.dst)
+            op.method = 'rename'
+            return
+
+        self._makedirs(os.path.dirname(op.dst))
+        exists = os.path.exists(op.dst)
+        if exists and not op.overwrite:
+            raise Exception("File already exists, can't %s %s -> %s" % (op.kind, op.src, op.dst))
+        self._start(op)
+        if exists and op.kind != 'copy':
+            os.remove(op.dst)
+            exists = False
+
+        if op.kind != 'copy':
+            try:
+                if op.kind == 'link':
+                    os.link(op.src, op.dst)
+                    op.method = 'link'
+                else:
+                    os.rename(op.src, op.dst)
+                    op.method = 'rename'
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # a different mount of the same device, copy after all
+
+        partial = partial_file(op.dst)
+        try:
+            with open(op.src, 'rb') as fsrc:
+                # the scan may be older than the last change of the file
+                st = os.fstat(fsrc.fileno())
+                if self.manifest is not None:
+                    self._copy_verified(op, fsrc, partial)
+                else:
+                    op.method = copy_file(fsrc, partial)
+            apply_metadata(partial, st, self.preserve)
+            if op.kind == 'move' and self.journal is not None:
+                with self._lock:
+                    self.journal.copied(op)
+            if exists:
+                os.remove(op.dst)  # os.rename won't replace on Windows
+            os.rename(partial, op.dst)
+        except BaseException:
+            _remove(partial)
+            raise
+        if op.kind == 'move':
+            os.remove(op.src)
+
+    def _start(self, op):
+        if self.journal is not None:
+            with self._lock:
+                self.journal.start(op)
+
+    def _copy_verified(self, op, fsrc, partial):
+        for attempt in range(self.VERIFY_ATTEMPTS):
+            digest, copied = copy_file_verified(fsrc, partial)
+            if digest == copied:
+                op.method = 'userspace'
+                op.digest = digest
+                return
+            with self._lock:
+                self.mismatches += 1
+        raise Exception("Copy doesn't match after %d attempts: %s -> %s" % (self.VERIFY_ATTEMPTS, op.src, op.dst))
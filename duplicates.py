@@ -0,0 +1,121 @@
+"""
+Detection of files with identical content.
+
+Reading every byte of every file is avoided by narrowing down the
+candidates in stages:
+
+1. files are grouped by size, a file with a unique size has no duplicate
+2. hard links to the same inode are duplicates without reading anything
+3. the first and the last block of the remaining files are hashed
+4. only files which still match are hashed completely
+
+The hashing runs on a thread pool, hashlib releases the GIL while hashing
+so this uses several cores.
+"""
+
+import hashlib
+import multiprocessing
+import os
+from multiprocessing.pool import ThreadPool
+
+BLOCK_SIZE = 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+def _hash_sample(abspath, size):
+    """Hashes the first and the last block of the file, which is the whole
+    file if it is small"""
+    h = hashlib.sha256()
+    with open(abspath, 'rb') as f:
+        h.update(f.read(BLOCK_SIZE))
+        if size > 2 * BLOCK_SIZE:
+            f.seek(size - BLOCK_SIZE)
+        h.update(f.read())
+    return h.digest()
+
+
+def _hash_full(abspath):
+    h = hashlib.sha256()
+    with open(abspath, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.digest()
+
+
+def _refine(groups, func, pool):
+    """Splits each group of candidates by the result of func(candidate).
+    Candidates for which func raises IOError or OSError are dropped."""
+    candidates = [c for group in groups for c in group]
+
+    def safe(candidate):
+        try:
+            return func(candidate)
+        except (IOError, OSError):
+            return None
+
+    results = pool.map(safe, candidates)
+    digests = dict(zip(candidates, results))
+
+    refined = []
+    for group in groups:
+        by_digest = {}
+        for candidate in group:
+            digest = digests[candidate]
+            if digest is not None:
+                by_digest.setdefault(digest, []).append(candidate)
+        refined.extend(g for g in by_digest.values() if len(g) > 1)
+    return refined
+
+
+def find_duplicates(files, root, workers=None):
+    """
+    Finds the files with identical content.
+
+    files is an iterable of (relpath, size, key) tuples, where key is the
+    (device, inode) pair of the file. Empty files are ignored. Returns a list
+    of groups, each a sorted list of the relpaths of files with the same
+    content.
+    """
+    # stage 1: group by size, and the paths of each inode within that
+    by_size = {}
+    for relpath, size, key in files:
+        if size > 0:
+            by_size.setdefault(size, {}).setdefault(key, []).append(relpath)
+
+    # stage 2: hard links are duplicates of each other already, only one
+    # path per inode needs to be read
+    groups = [[(size, key) for key in inodes]
+              for size, inodes in by_size.items() if len(inodes) > 1]
+
+    def path(candidate):
+        size, key = candidate
+        return os.path.join(root, by_size[size][key][0])
+
+    pool = ThreadPool(workers or multiprocessing.cpu_count())
+    try:
+        # stage 3: first and last block
+        groups = _refine(groups,
+                         lambda c: _hash_sample(path(c), c[0]),
+                         pool)
+
+        # stage 4: everything, where the sample wasn't the whole file
+        small = [g for g in groups if g[0][0] <= 2 * BLOCK_SIZE]
+        large = [g for g in groups if g[0][0] > 2 * BLOCK_SIZE]
+        groups = small + _refine(large, lambda c: _hash_full(path(c)), pool)
+    finally:
+        pool.close()
+        pool.join()
+
+    # expand the inodes back into paths, adding the hard links which have no
+    # other duplicates
+    grouped = set(c for group in groups for c in group)
+    result = [sorted(p for size, key in group for p in by_size[size][key])
+              for group in groups]
+    result.extend(sorted(paths)
+                  for size, inodes in by_size.items()
+                  for key, paths in inodes.items()
+                  if len(paths) > 1 and (size, key) not in grouped)
+    return sorted(result)
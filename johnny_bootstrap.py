@@ -11,6 +11,10 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), "PyOrgMode"))
 
 from PyOrgMode import PyOrgMode
+import copier
+import duplicates
+import scanner
+import watcher
 
 # work around issues with output encoding in the Windows terminal
 if sys.stdout.encoding != 'UTF-8':
@@ -18,14 +22,33 @@ if sys.stdout.encoding != 'UTF-8':
 if sys.stderr.encoding != 'UTF-8':
   sys.stderr = codecs.getwriter('UTF-8')(sys.stderr, 'strict')
 
+def metadata_kinds(value):
+    kinds = tuple(k for k in value.split(',') if k)
+    for k in kinds:
+        if k not in copier.METADATA:
+            raise argparse.ArgumentTypeError("unknown metadata %r, choose from %s" % (k, ', '.join(copier.METADATA)))
+    return kinds
+
 parser = argparse.ArgumentParser(description='Process an org mode for Johnny Decimal organization of files.')
 parser.add_argument('file', help='the source file to process')
 parser.add_argument('--minimum-groupspace', action='store', default=10, type=int, help='The minimum number of unallocated subgroups must be at least this many to allow for future additions. Default: %(default)s')
 parser.add_argument('--copy', action='store_true', default=False, help='do the copying')
 parser.add_argument('--no-dry-run', action='store_true', default=False, help='actually do the copying')
+parser.add_argument('--mode', action='store', default='copy', choices=copier.MODES, help='copy the files into the target directory, hard link them or move them. Linking and moving are only done where source and target are on the same filesystem, otherwise files are copied. Default: %(default)s')
+parser.add_argument('--plan-file', action='store', default=None, help='write the copy plan with its totals per target folder and the estimated duration to this JSON file')
+parser.add_argument('--verify', action='store_true', default=False, help='checksum the data while copying it, check the copies on disk against that and copy again if they differ. The checksums are written to a manifest next to the org file.')
+parser.add_argument('--preserve', action='store', default=','.join(copier.METADATA), type=metadata_kinds, help='the comma separated metadata of the source files to give the copies, out of %s. A file gets them before it is renamed to its final name, the copied directories after all files have been copied. An empty value preserves nothing. Default: %%(default)s' % ', '.join(copier.METADATA))
+parser.add_argument('--order', action='store', default='size', choices=copier.ORDERS, help='the order to copy the files in: largest first, by inode number or by the position of the data on the disk. The last two reduce the seeking of hard disks, best together with --copy-workers 1. Default: %(default)s')
+parser.add_argument('--copy-workers', action='store', default=4, type=int, help='The number of files to copy at the same time, for each pair of source and target disks. Default: %(default)s')
+parser.add_argument('--scan-workers', action='store', default=1, type=int, help='The number of directories to list concurrently while scanning the source directory. Values above 1 help on network shares. Default: %(default)s')
+parser.add_argument('--rescan', action='store_true', default=False, help='ignore the scan index next to the org file and scan the whole source directory again. Needed to pick up files that were modified in place.')
+parser.add_argument('--watch', action='store_true', default=False, help='keep running and update the org file whenever the source directory or the org file changes')
+parser.add_argument('--find-duplicates', action='store_true', default=False, help='look for files with identical content and set the action of all but one of them to d, if they are uncategorized')
 parser.add_argument('--force', action='store_true', default=False, help='copy files in spite of warnings')
 
 args = parser.parse_args()
+if args.watch and args.copy:
+    parser.error("--watch can't be combined with --copy")
 
 
 warnings=0
@@ -51,21 +74,6 @@ def parse_category(category):
 
     return mo.group("group", "subgroup", "folder")
 
-# from https://stackoverflow.com/questions/1868714/how-do-i-copy-an-entire-directory-of-files-into-an-existing-directory-using-pyth
-def copytree(src, dst, symlinks=False, ignore=None):
-    if not os.path.exists(dst):
-        os.makedirs(dst)
-    for item in os.listdir(src):
-        s = os.path.join(src, item)
-        d = os.path.join(dst, item)
-        if os.path.isdir(s):
-            copytree(s, d, symlinks, ignore)
-        else:
-            if os.path.exists(d):
-                raise Exception("File already exists, can't copy %s -> %s" % (s, d))
-            else:
-                shutil.copy2(s, d)
-
 # 
 # for input, expected in testcases:
 #     actual = parse_category(input)
@@ -122,8 +130,9 @@ def get_timestamp(category, filename, default):
       
       
 class Path(object):
-    def __init__(self, filename, timestamp, is_directory, action, category):
+    def __init__(self, filename, timestamp, is_directory, action, category, entry=None):
         self.filename=filename
+        self.entry=entry # the scanner.Entry holding the stat data, if known
 
         self.timestamp, category, self.timestamp_specifier = get_timestamp( category, filename, timestamp)
 
@@ -172,83 +181,130 @@ for p in properties:
 
 subgroups_per_group=int(props['subgroups-per-group'])
     
+scan_index=scanner.ScanIndex(args.file+'.scanindex', props['sourcedir'])
+if not args.rescan:
+    scan_index.load()
+
+source=scanner.Scanner(props['sourcedir'], workers=args.scan_workers, index=scan_index)
+
+def path_from_entry(entry, action, category, filename=None):
+    if filename is None:
+        filename = entry.relpath
+    return Path(filename=filename,
+                timestamp=datetime.datetime.fromtimestamp(entry.mtime),
+                is_directory=entry.is_directory,
+                action=action,
+                category=category,
+                entry=entry)
+
 def get_files(relpath, category):
     abspath = os.path.join(props['sourcedir'], relpath)
     print "recursing into %s" % abspath
 
+    return [path_from_entry(entry, action='u', category=category)
+            for entry in source.list_dir(relpath)]
+    
+filetable=find_elements(doc.root, PyOrgMode.OrgTable.Element)[0]
+
+# look at the disk and see if there are any files not mentioned in the table
+# add those to the list
+def find_new_files(relpath, existing_files):
+    def descend(entry):
+        # a directory in the table stands for everything below it
+        return entry.relpath not in existing_files
+
+    skipped = len(source.skipped)
     result=[]
-    for f in os.listdir(abspath):
-        frel = os.path.join(relpath, f)
-        fabs = os.path.join(abspath, f)
+    for entry in source.walk(relpath, descend=descend):
+        if not entry.is_directory and entry.relpath not in existing_files:
+            result.append(path_from_entry(entry, action='u', category=''))
 
-        path = Path(filename=frel,
-                    timestamp=datetime.datetime.fromtimestamp(os.path.getmtime(fabs)),
-                    is_directory=os.path.isdir(fabs),
-                    action='u',
-                    category=category)
-        result.append(path)
+    for skipped in source.skipped[skipped:]:
+        warn("Not descending into %s again, it is a symlink loop or has already been scanned" % os.path.join(props['sourcedir'], skipped))
 
     return result
-    
-filetable=find_elements(doc.root, PyOrgMode.OrgTable.Element)[0]
 
-if len(filetable.content) < 2:
-    print "no files, doing the initial scan of %s" % props['sourcedir']
+def index_elements(elements):
+    """Returns the actions of elements by filename as a scanner.PathIndex"""
+    return scanner.PathIndex((e.filename, e.action) for e in elements)
 
-    elements=get_files(relpath='', category=u'')
-else:
-    # process existing entries
+def read_elements(filetable):
+    """Returns the Paths of the rows in filetable and of the files on disk
+    which are not in the table yet"""
+    if len(filetable.content) < 2:
+        print "no files, doing the initial scan of %s" % props['sourcedir']
 
-    elements=[]
-    
-    for row in filetable.content:
-        #print row
-        category, action, frel = [c.strip() for c in row]
+        elements=get_files(relpath='', category=u'')
+    else:
+        # process existing entries
 
+        elements=[]
 
-        if action == 'r':
-            elements.extend(get_files(frel, category=category))
-        else:
-            fabs = os.path.join(props['sourcedir'], frel)
-
-            if os.path.exists(fabs):            
-               elements.append(Path(filename=frel,
-                                    timestamp=datetime.datetime.fromtimestamp(os.path.getmtime(fabs)),
-                                    is_directory=os.path.isdir(fabs),
-                                    action=action,
-                                    category=category))
-            else:
-               warn("Entry disappeared: %s" % fabs)
-            
+        categories, actions, filenames = [[c.strip() for c in filetable.content.column(i)] for i in range(3)]
+        entries = source.stat_paths([frel for action, frel in zip(actions, filenames) if action != 'r'])
+        entries.reverse()
 
-# look at the disk and see if there are any files not mentioned in the table
-# add those to the list
-existing_files = set([e.filename for e in elements])
+        for category, action, frel in zip(categories, actions, filenames):
+            if action == 'r':
+                elements.extend(get_files(frel, category=category))
+            else:
+                entry = entries.pop()
 
-def find_new_files(relpath, existing_files):
-    abspath = os.path.join(props['sourcedir'], relpath)
+                if entry is not None:
+                   elements.append(path_from_entry(entry, action=action, category=category, filename=frel))
+                else:
+                   warn("Entry disappeared: %s" % os.path.join(props['sourcedir'], frel))
 
-    result=[]
-    for f in os.listdir(abspath):
-        frel = os.path.join(relpath, f)
-        fabs = os.path.join(abspath, f)
+    existing_files = index_elements(elements)
 
-        if os.path.isdir(fabs):
-            if frel+'\\' not in existing_files:
-                result.extend(find_new_files(frel, existing_files))
+    # rows below a directory which is kept or deleted as a whole are
+    # redundant, they were added when such directories were walked into
+    kept = []
+    for e in elements:
+        if e.action == 'u' and existing_files.covering(e.filename, lambda action: action in ('k', 'K', 'd')) is not None:
+            existing_files.discard(e.filename)
         else:
-            if frel not in existing_files:
-                path = Path(filename=frel,
-                            timestamp=datetime.datetime.fromtimestamp(os.path.getmtime(fabs)),
-                            is_directory=os.path.isdir(fabs),
-                            action='u',
-                            category='')
-                result.append(path)
-
-    return result
-
-new_files = find_new_files('', existing_files)
-elements.extend(new_files)
+            kept.append(e)
+    elements = kept
+
+    source.reset()
+    elements.extend(find_new_files('', existing_files))
+
+    if args.find_duplicates:
+        mark_duplicates(elements)
+
+    return elements
+
+def mark_duplicates(elements):
+    """Sets the action of uncategorized files with the same content as
+    another file to d, keeping the file which is already kept or else the
+    oldest one which isn't deleted"""
+    files = dict((e.filename, e) for e in elements
+                 if not e.is_directory and e.entry is not None)
+    groups = duplicates.find_duplicates(
+        [(e.filename, e.entry.size, e.entry.key()) for e in files.values()],
+        props['sourcedir'])
+
+    marked = 0
+    saved = 0
+    for group in groups:
+        members = [files[f] for f in group]
+        print "duplicates: %s" % ", ".join(group)
+        # a file which is deleted anyway doesn't keep the content
+        candidates = [e for e in members if e.action != 'd']
+        if not candidates:
+            continue
+        keep = [e for e in candidates if e.action in ('k', 'K')]
+        if not keep:
+            keep = [min(candidates, key=lambda e: (e.timestamp, e.filename))]
+        for e in members:
+            if e not in keep and e.action == 'u' and e.category == '':
+                e.action = 'd'
+                marked += 1
+                saved += e.entry.size
+
+    if groups:
+        print "%d groups of duplicates, marked %d files (%d bytes) as d" % (len(groups), marked, saved)
 
 
 # sort the list
@@ -262,72 +318,189 @@ elements.extend(new_files)
 def make_sortkey(e):
   return (e.action=='d', e.group, e.subgroup, e.folder, e.is_directory, e.timestamp, e.filename)
 
-elements.sort(key=make_sortkey)
-
-filetable.content = [ e.row() for e in elements ]
-
-
-# Build the category tree of all files with action k or K
-groups = {}
-# even simpler with defaultdict 
-for e in elements:
-    if e.action in ['k', 'K']:
-        group = groups.setdefault(e.group, {})
-        subgroup = group.setdefault(e.subgroup, {})
-        subgroup.setdefault(e.folder, [0, e.timestamp])    
-        subgroup[e.folder][0]+=1
-        subgroup[e.folder][1]=min(subgroup[e.folder][1], e.timestamp)
-
-nodes=find_elements(doc.root, PyOrgMode.OrgNode.Element)
-
-# clear the category tree and build a fresh one
-# also compose the list of copy operations
-doc.root.content[-1].content=[]
-
-text=[]
-
 def dt(t):
     if t == "":
         return "(uncategorized)"
     return t
 
-gid = subgroups_per_group
-categories=dict() # maps categories to target directories
-for group in sorted(groups.keys()):
-    sgid = gid - 1
+def update_document(doc, filetable, elements):
+    """Writes the sorted elements to the file table, rebuilds the category
+    tree and saves the org file. Returns the map from categories to target
+    directories."""
+    elements.sort(key=make_sortkey)
 
-    subgroups=len(groups[group].keys())
+    filetable.content = [ e.row() for e in elements ]
 
-    if (subgroups_per_group-subgroups) < args.minimum_groupspace:
-      warn(("Group '%s' has %d subgroups, but that means that there is less than %d spare places for future additions.\n"+
-           "Fix this by reorganizing the groups, increasing the subgroups-per-group setting in %s or by decreasing the --minimum-groupspace option.") %
-           (group, subgroups, args.minimum_groupspace, args.file))
-    
-    groupname = "%d-%d %s" % (gid, gid+subgroups_per_group-1, dt(group))
-    doc.root.append_clean(" * %s\n" % groupname)
-    for subgroup in sorted(groups[group].keys()):
-        sgid += 1
-        fid = 0
-        subgroupname = "%d %s" % (sgid, dt(subgroup))
-        doc.root.append_clean("   * %s\n" % subgroupname)
-
-        for folder in sorted(groups[group][subgroup].keys(), key=lambda f: groups[group][subgroup][f][1]):
-            fid += 1
-            foldername =  "%d.%02d %s" % (sgid, fid, dt(folder))
-            doc.root.append_clean("     * %s (%d)\n" % (foldername, groups[group][subgroup][folder][0]))
-            
-            category = '%s/%s/%s' % (group, subgroup, folder)
-            targetdir = os.sep.join([groupname, subgroupname, foldername])
-            categories[category]=targetdir
-
-    gid += subgroups_per_group
-
-            
-tmpfile=args.file+'.tmp'
-doc.save_to_file(tmpfile)
-shutil.move(tmpfile, args.file)
 
-if args.copy:
+    # Build the category tree of all files with action k or K
+    groups = {}
+    # even simpler with defaultdict 
+    for e in elements:
+        if e.action in ['k', 'K']:
+            group = groups.setdefault(e.group, {})
+            subgroup = group.setdefault(e.subgroup, {})
+            subgroup.setdefault(e.folder, [0, e.timestamp])    
+            subgroup[e.folder][0]+=1
+            subgroup[e.folder][1]=min(subgroup[e.folder][1], e.timestamp)
+
+    # clear the category tree and build a fresh one
+    # also compose the list of copy operations
+    # its lines belong to the last node, so that it is found again on the
+    # next update
+    tree = doc.root.content[-1]
+    tree.content=[]
+
+    gid = subgroups_per_group
+    categories=dict() # maps categories to target directories
+    for group in sorted(groups.keys()):
+        sgid = gid - 1
+
+        subgroups=len(groups[group].keys())
+
+        if (subgroups_per_group-subgroups) < args.minimum_groupspace:
+          warn(("Group '%s' has %d subgroups, but that means that there is less than %d spare places for future additions.\n"+
+               "Fix this by reorganizing the groups, increasing the subgroups-per-group setting in %s or by decreasing the --minimum-groupspace option.") %
+               (group, subgroups, args.minimum_groupspace, args.file))
+        
+        groupname = "%d-%d %s" % (gid, gid+subgroups_per_group-1, dt(group))
+        tree.append(" * %s\n" % groupname)
+        for subgroup in sorted(groups[group].keys()):
+            sgid += 1
+            fid = 0
+            subgroupname = "%d %s" % (sgid, dt(subgroup))
+            tree.append("   * %s\n" % subgroupname)
+
+            for folder in sorted(groups[group][subgroup].keys(), key=lambda f: groups[group][subgroup][f][1]):
+                fid += 1
+                foldername =  "%d.%02d %s" % (sgid, fid, dt(folder))
+                tree.append("     * %s (%d)\n" % (foldername, groups[group][subgroup][folder][0]))
+                
+                category = '%s/%s/%s' % (group, subgroup, folder)
+                targetdir = os.sep.join([groupname, subgroupname, foldername])
+                categories[category]=targetdir
+
+        gid += subgroups_per_group
+
+                
+    tmpfile=args.file+'.tmp'
+    doc.save_to_file(tmpfile)
+    shutil.move(tmpfile, args.file)
+
+    return categories
+
+
+def refresh_directory(elements, existing_files, relpath):
+    """Brings elements up to date with the directory relpath, which has
+    changed on disk. Returns True if anything changed."""
+    old = dict((e.name, e) for e in source.listing(relpath))
+    source.invalidate(relpath)
+    try:
+        new = dict((e.name, e) for e in source.list_dir(relpath))
+    except OSError:
+        new = {}  # the directory itself is gone
+
+    by_filename = dict((e.filename.rstrip(os.sep), e) for e in elements)
+    removed = set()
+    added = []
+
+    for name, entry in old.items():
+        if name not in new:
+            # gone, together with everything below it
+            frel = entry.relpath
+            source.forget(frel)
+            removed.update(f for f in by_filename
+                           if f == frel or f.startswith(frel + os.sep))
+        elif entry.is_directory and entry.key() != new[name].key():
+            # removed and created again, walk it from scratch
+            source.forget(entry.relpath)
+
+    for name, entry in new.items():
+        e = by_filename.get(entry.relpath)
+        if e is not None:
+            if name not in old or (entry.mtime, entry.size) != (old[name].mtime, old[name].size):
+                # update the stat data but keep what the user has entered
+                removed.add(entry.relpath)
+                added.append(path_from_entry(entry, action=e.action, category=e.row()[0], filename=e.filename))
+        elif (name not in old or entry.key() != old[name].key()) and existing_files.covering(entry.relpath) is None:
+            if entry.is_directory:
+                if source.enter(entry):
+                    added.extend(find_new_files(entry.relpath, existing_files))
+            else:
+                added.append(path_from_entry(entry, action='u', category=''))
+
+    if not removed and not added:
+        return False
+
+    elements[:] = [e for e in elements if e.filename.rstrip(os.sep) not in removed]
+    elements.extend(added)
+    for f in removed:
+        existing_files.discard(f)
+    for e in added:
+        existing_files[e.filename] = e.action
+    return True
+
+def watch_source(doc, filetable, elements):
+    """Keeps the org file up to date with the source directory until
+    interrupted. Changes to the org file itself are picked up as well."""
+    global warnings
+
+    w = watcher.make_watcher(source)
+    existing_files = index_elements(elements)
+    written = os.stat(args.file).st_mtime
+    print "watching %s for changes, press Ctrl-C to stop" % props['sourcedir']
+
+    try:
+        while True:
+            try:
+                w.sync()
+            except OSError as e:
+                print "falling back to polling: %s" % e
+                w.close()
+                w = watcher.PollingWatcher(source)
+                w.sync()
+
+            dirty = w.wait(timeout=1.0)
+            changed = False
+
+            for relpath in sorted(dirty):
+                if source.listing(relpath) is not None:
+                    changed = refresh_directory(elements, existing_files, relpath) or changed
+
+            if os.stat(args.file).st_mtime != written:
+                # edited by the user, start over from the table
+                warnings = 0
+                doc = PyOrgMode.OrgDataStructure()
+                doc.load_from_file(args.file)
+                filetable=find_elements(doc.root, PyOrgMode.OrgTable.Element)[0]
+                elements = read_elements(filetable)
+                existing_files = index_elements(elements)
+                changed = True
+
+            if changed:
+                update_document(doc, filetable, elements)
+                written = os.stat(args.file).st_mtime
+                print "%s updated, %d entries" % (args.file, len(elements))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        w.close()
+        source.close()
+        scan_index.save()
+
+
+elements = read_elements(filetable)
+if not args.watch:
+    source.close()
+scan_index.save()
+
+categories = update_document(doc, filetable, elements)
+
+if args.watch:
+    watch_source(doc, filetable, elements)
+    sys.exit(0)
+
+def plan_copy(elements, categories):
+    """Checks the elements and returns the copier.Plan for copying them"""
     # check input
     for e in elements:
         warning = e.check()
@@ -339,6 +512,8 @@ if args.copy:
         print "ERROR: Refusing to copy files because there were warnings. Fix or use --force."
         sys.exit(1)
 
+    plan = copier.Plan(source, mode=args.mode)
+
     for e in [el for el in elements if el.action in ['k', 'K'] ]:
         if not e.category_complete():
             print "SKIPPING %s because a complete target has not been set" % e.filename
@@ -364,15 +539,68 @@ if args.copy:
                     raise Exception("Internal error - unknown action: %s" % e.action)
                 print "%s -> %s" % (src, dst)
 
-                if args.no_dry_run:
-                    copytree(src, dst)
+                plan.add_tree(e.filename, dst, e.entry, folder=categories[e.category])
             else:
                 dst = os.path.join(props['targetdir'], categories[e.category], os.path.basename(e.filename))
                 
                 print "%s -> %s" % (src, dst)
 
-                if args.no_dry_run:
-                    dir = os.path.dirname(dst)
-                    if not os.path.exists(dir):
-                        os.makedirs(dir)
-                    shutil.copy2(src, dst)
+                plan.add_file(e.filename, dst, e.entry, overwrite=True, folder=categories[e.category])
+
+    return plan
+
+def print_plan(plan, estimate):
+    print "plan: %d files, %d bytes in %d operations" % (plan.files, plan.bytes, len(plan.operations))
+    for folder, (files, size) in sorted(plan.folders.items()):
+        print "  %s: %d files, %d bytes" % (folder, files, size)
+    for dst, count in plan.conflicts():
+        print "NOTE: %d files have the same target %s, they are copied one after another" % (count, dst)
+    if estimate is None:
+        print "estimated duration: unknown until a run has been measured"
+    else:
+        print "estimated duration: %s" % datetime.timedelta(seconds=int(round(estimate)))
+
+if args.copy:
+    journal = copier.Journal(args.file+'.journal')
+    throughput = copier.Throughput(args.file+'.throughput')
+    throughput.load()
+
+    if journal.exists() and args.no_dry_run:
+        print "Resuming the interrupted run recorded in %s. Delete it to start over." % journal.filename
+        plan = journal.resume()
+        print "%d operations left to do" % len(plan.operations)
+    else:
+        if journal.exists():
+            print "NOTE: %s records an interrupted run, --no-dry-run resumes it." % journal.filename
+        try:
+            plan = plan_copy(elements, categories)
+        finally:
+            # add_tree() lists directories again, which restarts the pool
+            source.close()
+        if args.no_dry_run:
+            journal.create(plan)
+
+    estimate = throughput.estimate(plan)
+    print_plan(plan, estimate)
+    if args.plan_file:
+        plan.export(args.plan_file, estimate)
+
+    if args.no_dry_run:
+        manifest = None
+        if args.verify:
+            manifest = copier.Manifest(args.file+'.manifest')
+        executor = copier.CopyExecutor(workers=args.copy_workers, journal=journal, manifest=manifest, preserve=args.preserve, order=args.order)
+        try:
+            executor.run(plan)
+        finally:
+            throughput.record(executor.cost, executor.elapsed)
+            if args.plan_file:
+                # again, with the method each operation was done by
+                plan.export(args.plan_file, estimate)
+        journal.finish()
+        verb = {'copy': 'copied', 'link': 'linked', 'move': 'moved'}[plan.mode]
+        print "%s %d entries, %d bytes in %.1f s" % (verb, executor.copied, executor.copied_bytes, executor.elapsed)
+        for method, count in sorted(executor.methods.items()):
+            print "  %s: %d files" % (method, count)
+        if args.verify:
+            print "verified %d copies, %d were copied again after a mismatch, checksums in %s" % (executor.verified, executor.mismatches, manifest.filename)
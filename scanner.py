@@ -0,0 +1,516 @@
+"""
+Directory scanning for johnny_bootstrap.
+
+The scanner lists directories with scandir so that the type and stat data
+of every entry is taken from a single system call (or, on Windows, straight
+from the directory listing) instead of separate os.path.isdir and
+os.path.getmtime calls for each file.
+"""
+
+import os
+import stat
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        # neither python 3.5+ nor the scandir backport, fall back to
+        # os.listdir followed by one os.stat per entry
+        scandir = None
+
+
+class Entry(object):
+    """A directory entry together with the stat data johnny_bootstrap needs"""
+
+    __slots__ = ('name', 'relpath', 'is_directory', 'is_symlink',
+                 'size', 'atime', 'mtime', 'mode', 'inode', 'device')
+
+    def __init__(self, name, relpath, is_directory, is_symlink,
+                 size, atime, mtime, mode, inode, device):
+        self.name = name
+        self.relpath = relpath
+        self.is_directory = is_directory
+        self.is_symlink = is_symlink
+        self.size = size
+        self.atime = atime
+        self.mtime = mtime
+        self.mode = mode  # permission bits
+        self.inode = inode
+        self.device = device
+
+    def key(self):
+        """The (device, inode) pair identifying the entry on disk"""
+        return (self.device, self.inode)
+
+    def __repr__(self):
+        return "Entry(%r, dir=%r, size=%r, mtime=%r)" % (
+            self.relpath, self.is_directory, self.size, self.mtime)
+
+
+def _make_entry(name, relpath, st, is_symlink):
+    return Entry(name=name,
+                 relpath=relpath,
+                 is_directory=stat.S_ISDIR(st.st_mode),
+                 is_symlink=is_symlink,
+                 size=st.st_size,
+                 atime=st.st_atime,
+                 mtime=st.st_mtime,
+                 mode=stat.S_IMODE(st.st_mode),
+                 inode=st.st_ino,
+                 device=st.st_dev)
+
+
+def _stat(abspath):
+    """stat() following symlinks, falling back to the link itself if it is
+    dangling. Returns (stat_result, is_symlink) or (None, False) if the path
+    does not exist."""
+    try:
+        st = os.lstat(abspath)
+    except OSError:
+        return None, False
+    if not stat.S_ISLNK(st.st_mode):
+        return st, False
+    try:
+        return os.stat(abspath), True
+    except OSError:
+        return st, True
+
+
+def stat_path(root, relpath):
+    """Returns the Entry for root/relpath or None if it does not exist"""
+    abspath = os.path.join(root, relpath)
+    st, is_symlink = _stat(abspath)
+    if st is None:
+        return None
+    name = os.path.basename(relpath.rstrip(os.sep))
+    return _make_entry(name, relpath, st, is_symlink)
+
+
+def _scandir_entries(abspath, relpath):
+    for d in scandir(abspath):
+        frel = os.path.join(relpath, d.name)
+        is_symlink = d.is_symlink()
+        try:
+            st = d.stat()
+        except OSError:
+            # dangling symlink
+            st = d.stat(follow_symlinks=False)
+        if stat.S_ISDIR(st.st_mode) and st.st_ino == 0:
+            # scandir on Windows does not fill in st_ino/st_dev from the
+            # directory listing, but loop detection needs them for
+            # directories
+            st = os.stat(d.path)
+        yield _make_entry(d.name, frel, st, is_symlink)
+
+
+def _listdir_entries(abspath, relpath):
+    for name in os.listdir(abspath):
+        frel = os.path.join(relpath, name)
+        st, is_symlink = _stat(os.path.join(abspath, name))
+        if st is not None:
+            yield _make_entry(name, frel, st, is_symlink)
+
+
+def split_path(relpath):
+    """Splits relpath into its components, ignoring a trailing separator"""
+    if os.altsep:
+        relpath = relpath.replace(os.altsep, os.sep)
+    return [part for part in relpath.split(os.sep) if part]
+
+
+class PathIndex(object):
+    """
+    Maps relative paths to values, organised as a tree of path components.
+
+    Besides exact lookups it answers whether a path lies below one of the
+    stored paths in time proportional to the depth of the path, independent
+    of how many paths are stored. A path with and without a trailing
+    separator is the same path.
+    """
+
+    def __init__(self, items=()):
+        self.root = {}  # component -> [value, children]
+        self.size = 0
+        for relpath, value in items:
+            self[relpath] = value
+
+    _MISSING = object()
+
+    def _node(self, relpath):
+        children = self.root
+        node = None
+        for part in split_path(relpath):
+            node = children.get(part)
+            if node is None:
+                return None
+            children = node[1]
+        return node
+
+    def __setitem__(self, relpath, value):
+        parts = split_path(relpath)
+        if not parts:
+            raise KeyError(relpath)
+        children = self.root
+        for part in parts:
+            node = children.get(part)
+            if node is None:
+                node = children[part] = [self._MISSING, {}]
+            children = node[1]
+        if node[0] is self._MISSING:
+            self.size += 1
+        node[0] = value
+
+    def __getitem__(self, relpath):
+        node = self._node(relpath)
+        if node is None or node[0] is self._MISSING:
+            raise KeyError(relpath)
+        return node[0]
+
+    def get(self, relpath, default=None):
+        node = self._node(relpath)
+        if node is None or node[0] is self._MISSING:
+            return default
+        return node[0]
+
+    def __contains__(self, relpath):
+        node = self._node(relpath)
+        return node is not None and node[0] is not self._MISSING
+
+    def __len__(self):
+        return self.size
+
+    def __delitem__(self, relpath):
+        parts = split_path(relpath)
+        path = []
+        children = self.root
+        for part in parts:
+            node = children.get(part)
+            if node is None:
+                raise KeyError(relpath)
+            path.append((children, part, node))
+            children = node[1]
+        if not path or path[-1][2][0] is self._MISSING:
+            raise KeyError(relpath)
+        path[-1][2][0] = self._MISSING
+        self.size -= 1
+        # drop the nodes that no longer lead anywhere
+        for children, part, node in reversed(path):
+            if node[0] is not self._MISSING or node[1]:
+                break
+            del children[part]
+
+    def discard(self, relpath):
+        try:
+            del self[relpath]
+        except KeyError:
+            pass
+
+    def covering(self, relpath, match=None):
+        """Returns (path, value) of the nearest stored path which relpath
+        lies below, or None. relpath itself doesn't count. If match is given,
+        only paths with a value for which match(value) is true count."""
+        parts = split_path(relpath)
+        children = self.root
+        found = None
+        for i, part in enumerate(parts[:-1]):
+            node = children.get(part)
+            if node is None:
+                break
+            value = node[0]
+            if value is not self._MISSING and (match is None or match(value)):
+                found = i, value
+            children = node[1]
+        if found is None:
+            return None
+        return os.sep.join(parts[:found[0] + 1]), found[1]
+
+
+class ScanIndex(object):
+    """
+    The directory listings of a previous scan, stored in a file next to the
+    org file.
+
+    A listing is reused as long as the mtime of its directory is unchanged.
+    Adding, removing or renaming an entry changes the mtime of the directory
+    it is in, but modifying a file in place does not, so the stat data of
+    such a file stays stale until the next full rescan.
+
+    The whole index is thrown away if it was written by a different version
+    of the index format, for a different source directory or cannot be read.
+    The entries are stored as plain tuples, which pickle much faster than
+    objects. Only the directories listed during a run are kept, and the file
+    is only written again if they changed.
+    """
+
+    VERSION = 3
+
+    # directories modified this close to the start of the scan are not
+    # stored, a change within the same mtime tick would go unnoticed
+    RACY_SECONDS = 2
+
+    def __init__(self, filename, root):
+        self.filename = filename
+        self.root = root
+        self.started = time.time()
+        # relpath -> (mtime, [row, ...]) as read from the file, see _row()
+        self.directories = {}
+        self._listed = {}  # the same for the directories listed in this run
+        self._changed = False
+
+    def load(self):
+        """Reads the index file. Returns False if there is no usable index, in
+        which case everything is scanned again."""
+        try:
+            with open(self.filename, 'rb') as f:
+                data = pickle.load(f)
+        except Exception:
+            return False
+        if (not isinstance(data, dict) or
+                data.get('version') != self.VERSION or
+                data.get('root') != self.root):
+            return False
+        self.directories = data['directories']
+        return True
+
+    def save(self):
+        """Writes the listings of the directories listed in this run, unless
+        the file already holds exactly these"""
+        if not self._changed and len(self._listed) == len(self.directories):
+            return
+        tmpfile = self.filename + '.tmp'
+        with open(tmpfile, 'wb') as f:
+            pickle.dump({'version': self.VERSION,
+                         'root': self.root,
+                         'directories': self._listed},
+                        f, pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(self.filename):
+            os.remove(self.filename)  # os.rename won't replace on Windows
+        os.rename(tmpfile, self.filename)
+        self.directories = dict(self._listed)
+        self._changed = False
+
+    @staticmethod
+    def _row(entry):
+        return (entry.name, entry.is_directory, entry.is_symlink, entry.size,
+                entry.atime, entry.mtime, entry.mode, entry.inode,
+                entry.device)
+
+    def get(self, relpath, mtime):
+        """Returns the stored listing of relpath if its mtime is unchanged"""
+        cached = self.directories.get(relpath)
+        if cached is None or cached[0] != mtime:
+            return None
+        self._listed[relpath] = cached
+        join = os.path.join
+        return [Entry(name, join(relpath, name), is_directory, is_symlink,
+                      size, atime, entry_mtime, mode, inode, device)
+                for (name, is_directory, is_symlink, size, atime, entry_mtime,
+                     mode, inode, device) in cached[1]]
+
+    def put(self, relpath, mtime, entries):
+        """Stores the listing of relpath, made when its mtime was mtime"""
+        self._changed = True
+        if mtime >= self.started - self.RACY_SECONDS:
+            self._listed.pop(relpath, None)
+        else:
+            self._listed[relpath] = (mtime, [self._row(e) for e in entries])
+
+    def discard(self, relpath):
+        """Forgets the listing of relpath"""
+        self._changed = True
+        self._listed.pop(relpath, None)
+        self.directories.pop(relpath, None)
+
+
+class Scanner(object):
+    """
+    Lists directories below a root directory.
+
+    The scanner remembers the (device, inode) pair of every directory it has
+    walked into so that symlink loops and directories reachable through more
+    than one link are only visited once.
+
+    With workers > 1 the directories of each level of the tree are listed
+    concurrently on a thread pool, which hides the round trip time of network
+    shares. The results are always returned in the same order as a
+    sequential scan would return them.
+
+    If a ScanIndex is given, directories whose mtime has not changed since
+    the index was written are not listed again.
+    """
+
+    def __init__(self, root, workers=1, index=None):
+        self.root = root
+        self.workers = workers
+        self.index = index
+        self.visited = set()
+        self.skipped = []  # relpaths of directories left out by walk()
+        self._pool = None
+        self._listings = {}  # relpath -> entries, listed during this run
+        self._mtimes = {}  # relpath -> mtime of the directory when listed
+        self._entered = {}  # relpath -> key of directories walked into
+
+    def _map(self, func, items):
+        """map() on the thread pool, preserving the order of items"""
+        if self.workers <= 1 or len(items) < 2:
+            return [func(item) for item in items]
+        if self._pool is None:
+            self._pool = ThreadPool(self.workers)
+        return self._pool.map(func, items)
+
+    def close(self):
+        """Stops the worker threads, if any were started. They are started
+        again if the scanner is used after that."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def list_dir(self, relpath=''):
+        """Returns the entries of the directory relpath (relative to root),
+        sorted by name"""
+        if self.index is None:
+            return self._list_dir(relpath)
+
+        relpath = relpath.rstrip(os.sep)
+        entries = self._listings.get(relpath)
+        if entries is not None:
+            return entries
+
+        # stat the directory before listing it, a change made while it is
+        # being listed then makes the stored mtime outdated
+        top = stat_path(self.root, relpath)
+        if top is None:
+            return self._list_dir(relpath)  # raises the appropriate error
+        entries = self.index.get(relpath, top.mtime)
+        if entries is None:
+            entries = self._list_dir(relpath)
+            self.index.put(relpath, top.mtime, entries)
+        self._listings[relpath] = entries
+        self._mtimes[relpath] = top.mtime
+        return entries
+
+    def listing(self, relpath):
+        """Returns the entries of relpath listed during this run, or None"""
+        return self._listings.get(relpath)
+
+    def directories(self):
+        """Returns the relpaths of the directories listed during this run"""
+        return list(self._listings.keys())
+
+    def invalidate(self, relpath):
+        """Makes the next list_dir() of relpath list the directory again"""
+        self._listings.pop(relpath, None)
+        self._mtimes.pop(relpath, None)
+        if self.index is not None:
+            self.index.discard(relpath)
+
+    def forget(self, relpath):
+        """Invalidates relpath and everything below it, for when it has been
+        removed from disk"""
+        prefix = relpath + os.sep
+        for r in self.directories():
+            if r == relpath or r.startswith(prefix):
+                self.invalidate(r)
+        for r in list(self._entered.keys()):
+            if r == relpath or r.startswith(prefix):
+                self.visited.discard(self._entered.pop(r))
+
+    def changed_directories(self):
+        """Returns the relpaths of the listed directories whose mtime has
+        changed since they were listed, or which no longer exist"""
+        relpaths = self.directories()
+        current = self._map(lambda relpath: stat_path(self.root, relpath),
+                            relpaths)
+        return [relpath for relpath, entry in zip(relpaths, current)
+                if entry is None or entry.mtime != self._mtimes.get(relpath)]
+
+    def _list_dir(self, relpath):
+        abspath = os.path.join(self.root, relpath)
+        if scandir is not None:
+            entries = list(_scandir_entries(abspath, relpath))
+        else:
+            entries = list(_listdir_entries(abspath, relpath))
+        entries.sort(key=lambda e: e.name)
+        return entries
+
+    def stat_paths(self, relpaths):
+        """Returns stat_path() for each of relpaths, in the same order"""
+        if self.index is None:
+            return self._map(lambda relpath: stat_path(self.root, relpath),
+                             relpaths)
+
+        # look the paths up in the listings of their parent directories, so
+        # only the directories need to be checked against the index
+        split = [os.path.split(relpath.rstrip(os.sep)) for relpath in relpaths]
+        parents = sorted(set(parent for parent, name in split))
+        listings = dict(zip(parents, self._map(self._try_list_dir, parents)))
+
+        result = []
+        for parent, name in split:
+            result.append(listings[parent].get(name))
+        return result
+
+    def _try_list_dir(self, relpath):
+        """Returns the entries of relpath by name, empty if it can't be listed"""
+        try:
+            return dict((e.name, e) for e in self.list_dir(relpath))
+        except OSError:
+            return {}
+
+    def enter(self, entry):
+        """Marks the directory entry as visited. Returns False if it has been
+        visited before, which means that walking into it would loop."""
+        key = entry.key()
+        if key in self.visited:
+            self.skipped.append(entry.relpath)
+            return False
+        self.visited.add(key)
+        self._entered[entry.relpath] = key
+        return True
+
+    def reset(self):
+        """Forgets the directories walked into, before walking the tree again"""
+        self.visited = set()
+        self.skipped = []
+        self._entered = {}
+
+    def walk(self, relpath='', descend=None):
+        """
+        Yields the entries below relpath, one level of the tree at a time.
+
+        Directories are yielded too. If descend is given it is called with
+        each directory entry and the directory is only walked into if it
+        returns True.
+        """
+        top = stat_path(self.root, relpath)
+        if top is not None:
+            self.visited.add(top.key())
+
+        level = [relpath]
+        while level:
+            listings = self._map(self.list_dir, level)
+            level = []
+            for entries in listings:
+                for entry in entries:
+                    yield entry
+                    if entry.is_directory:
+                        if descend is not None and not descend(entry):
+                            continue
+                        if self.enter(entry):
+                            level.append(entry.relpath)
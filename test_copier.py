@@ -0,0 +1,557 @@
+"""Tests for the copying of the files selected in the org file"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+
+import copier
+import scanner
+from test_scanner import TreeTestCase
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class CopyTestCase(TreeTestCase):
+    def setUp(self):
+        TreeTestCase.setUp(self)
+        self.src = os.path.join(self.root, "src")
+        self.dst = os.path.join(self.root, "dst")
+        os.mkdir(self.src)
+
+    def plan(self, mode="copy"):
+        return copier.Plan(scanner.Scanner(self.src), mode=mode)
+
+    def add_file(self, plan, relpath, target, overwrite=True):
+        entry = scanner.stat_path(self.src, relpath)
+        plan.add_file(relpath, os.path.join(self.dst, target), entry,
+                      overwrite=overwrite)
+
+    def add_tree(self, plan, relpath, target):
+        entry = scanner.stat_path(self.src, relpath)
+        plan.add_tree(relpath, os.path.join(self.dst, target), entry)
+
+    def read(self, relpath):
+        with open(os.path.join(self.dst, relpath), "rb") as f:
+            return f.read()
+
+    def target_files(self):
+        """The relpaths of all files below the target directory"""
+        result = []
+        for dirpath, dirnames, filenames in os.walk(self.dst):
+            result.extend(os.path.relpath(os.path.join(dirpath, name),
+                                          self.dst)
+                          for name in filenames)
+        return sorted(result)
+
+
+class TestCopyExecutor(CopyTestCase):
+    def test_copy(self):
+        self.write(os.path.join("src", "t", "a"), b"a")
+        self.write(os.path.join("src", "t", "sub", "b"), b"b")
+        self.write(os.path.join("src", "f"), b"f")
+        plan = self.plan()
+        self.add_tree(plan, "t", "T")
+        self.add_file(plan, "f", os.path.join("F", "f"))
+        executor = copier.CopyExecutor(workers=4)
+        executor.run(plan)
+        join = os.path.join
+        self.assertEqual(self.target_files(),
+                         [join("F", "f"), join("T", "a"), join("T", "sub", "b")])
+        self.assertEqual(self.read(join("T", "sub", "b")), b"b")
+        self.assertEqual(executor.copied, 3)
+
+    def test_existing_file_is_refused(self):
+        self.write(os.path.join("src", "t", "a"), b"new")
+        self.write(os.path.join("dst", "T", "a"), b"old")
+        plan = self.plan()
+        self.add_tree(plan, "t", "T")
+        self.assertRaises(Exception, copier.CopyExecutor().run, plan)
+        self.assertEqual(self.read(os.path.join("T", "a")), b"old")
+        self.assertEqual(self.target_files(), [os.path.join("T", "a")])
+
+    def test_same_target(self):
+        for i in range(8):
+            self.write(os.path.join("src", str(i), "x"), b"%d" % i * 100000)
+        plan = self.plan()
+        for i in range(8):
+            self.add_file(plan, os.path.join(str(i), "x"), "x")
+        self.assertEqual(plan.conflicts(), [(os.path.join(self.dst, "x"), 8)])
+        copier.CopyExecutor(workers=4).run(plan)
+        # the last one wins, like copying one after another did
+        self.assertEqual(self.read("x"), b"7" * 100000)
+        self.assertEqual(self.target_files(), ["x"])
+
+
+def unsupported(fsrc, fdst):
+    fdst.write(b"partial")
+    raise OSError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+
+
+def at_end(fdin, fdout, count):
+    """A kernel copy function reporting the end of the file right away"""
+    return 0
+
+
+class TestPlan(CopyTestCase):
+    def setUp(self):
+        CopyTestCase.setUp(self)
+        self.write(os.path.join("src", "t", "a"), b"aaa")
+        self.write(os.path.join("src", "t", "b"), b"b")
+        self.write(os.path.join("src", "f"), b"ff")
+
+    def make_plan(self):
+        plan = self.plan()
+        join = os.path.join
+        plan.add_tree("t", join(self.dst, "T"),
+                      scanner.stat_path(self.src, "t"), folder="10 T")
+        plan.add_file("f", join(self.dst, "F", "f"),
+                      scanner.stat_path(self.src, "f"), folder="20 F")
+        plan.add_file("f", join(self.dst, "T", "f"),
+                      scanner.stat_path(self.src, "f"), folder="10 T")
+        return plan
+
+    def test_folder_totals(self):
+        plan = self.make_plan()
+        self.assertEqual(plan.files, 4)
+        self.assertEqual(plan.bytes, 8)
+        self.assertEqual(plan.folders, {"10 T": [3, 6], "20 F": [1, 2]})
+
+    def test_export(self):
+        plan = self.make_plan()
+        filename = os.path.join(self.root, "plan.json")
+        plan.export(filename, 12.5)
+        with open(filename) as f:
+            exported = json.load(f)
+        self.assertEqual(exported["mode"], "copy")
+        self.assertEqual(exported["files"], 4)
+        self.assertEqual(exported["bytes"], 8)
+        self.assertEqual(exported["estimated_seconds"], 12.5)
+        self.assertEqual(exported["folders"],
+                         [{"folder": "10 T", "files": 3, "bytes": 6},
+                          {"folder": "20 F", "files": 1, "bytes": 2}])
+        self.assertEqual(exported["directories"], plan.directories)
+        self.assertEqual(sorted((op["src"], op["dst"], op["bytes"])
+                                for op in exported["operations"]),
+                         sorted((op.src, op.dst, op.size)
+                                for op in plan.operations))
+
+    def test_estimate(self):
+        plan = self.make_plan()
+        filename = os.path.join(self.root, "throughput")
+        throughput = copier.Throughput(filename)
+        throughput.load()
+        self.assertIsNone(throughput.estimate(plan))
+        # too short to be measured
+        throughput.record(plan.cost(), 0.1)
+        self.assertIsNone(throughput.estimate(plan))
+        throughput.record(plan.cost(), 4.0)
+        throughput = copier.Throughput(filename)
+        throughput.load()
+        self.assertAlmostEqual(throughput.estimate(plan), 4.0)
+        self.assertEqual(plan.cost(), 4 * copier.FILE_COST + 8)
+
+    def test_relative_target(self):
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.root)
+        plan = self.plan()
+        self.assertEqual(plan.target_device(os.path.join("new", "dir", "x")),
+                         os.stat(self.root).st_dev)
+
+
+class TestCopyMethods(CopyTestCase):
+    def setUp(self):
+        CopyTestCase.setUp(self)
+        self.source = self.write(os.path.join("src", "a"), b"a" * 100000)
+        os.mkdir(self.dst)
+
+    def use(self, methods):
+        self.addCleanup(setattr, copier, "COPY_METHODS", copier.COPY_METHODS)
+        copier.COPY_METHODS = methods
+
+    def copy(self):
+        with open(self.source, "rb") as fsrc:
+            return copier.copy_file(fsrc, os.path.join(self.dst, "a"))
+
+    def test_fallback_chain(self):
+        names = ["reflink", "copy_file_range", "sendfile", "userspace"]
+        for i, name in enumerate(names):
+            # the methods before name fail
+            self.use([(other, unsupported if j < i else copier._userspace_copy)
+                      for j, other in enumerate(names)])
+            self.assertEqual(self.copy(), name)
+            self.assertEqual(self.read("a"), b"a" * 100000)
+
+    def test_kernel_copy_at_end_of_file(self):
+        self.use([("copy_file_range", copier._kernel_copy(at_end)),
+                  ("userspace", copier._userspace_copy)])
+        self.assertEqual(self.copy(), "userspace")
+        self.assertEqual(self.read("a"), b"a" * 100000)
+
+    def test_failed_copy(self):
+        def failing(fsrc, fdst):
+            raise OSError(errno.EIO, os.strerror(errno.EIO))
+        self.use([("reflink", failing), ("userspace", copier._userspace_copy)])
+        self.assertRaises(OSError, self.copy)
+
+    def test_method_is_exported(self):
+        self.use([("copy_file_range", copier._kernel_copy(at_end)),
+                  ("userspace", copier._userspace_copy)])
+        plan = self.plan()
+        self.add_file(plan, "a", "a")
+        copier.CopyExecutor().run(plan)
+        filename = os.path.join(self.root, "plan.json")
+        plan.export(filename)
+        with open(filename) as f:
+            operations = json.load(f)["operations"]
+        self.assertEqual([op["method"] for op in operations], ["userspace"])
+
+
+class TestVerify(CopyTestCase):
+    def setUp(self):
+        CopyTestCase.setUp(self)
+        self.write(os.path.join("src", "t", "a"), b"a" * 100000)
+        self.write(os.path.join("src", "t", "b"), b"b")
+        self.manifest = copier.Manifest(os.path.join(self.root, "manifest"))
+        self.hashed = []
+
+    def corrupt(self, times):
+        """Makes the first times copies read back differently"""
+        hash_file = copier._hash_file
+
+        def corrupted_hash_file(path):
+            self.hashed.append(path)
+            if len(self.hashed) <= times:
+                return "0" * 64
+            return hash_file(path)
+        copier._hash_file = corrupted_hash_file
+        self.addCleanup(setattr, copier, "_hash_file", hash_file)
+
+    def run_copy(self):
+        plan = self.plan()
+        self.add_file(plan, os.path.join("t", "a"), "a")
+        self.executor = copier.CopyExecutor(workers=1, manifest=self.manifest)
+        self.executor.run(plan)
+
+    def manifest_lines(self):
+        """The (digest, path) pairs of the manifest"""
+        with open(self.manifest.filename) as f:
+            return [tuple(line.rstrip("\n").split("  ", 1)) for line in f]
+
+    def test_manifest(self):
+        plan = self.plan()
+        self.add_tree(plan, "t", "T")
+        executor = copier.CopyExecutor(manifest=self.manifest)
+        executor.run(plan)
+        self.assertEqual(executor.verified, 2)
+        self.assertEqual(executor.mismatches, 0)
+        self.assertEqual(sorted(self.manifest_lines()),
+                         sorted([(hashlib.sha256(b"a" * 100000).hexdigest(),
+                                  os.path.join(self.dst, "T", "a")),
+                                 (hashlib.sha256(b"b").hexdigest(),
+                                  os.path.join(self.dst, "T", "b"))]))
+
+    def test_mismatch_is_copied_again(self):
+        self.corrupt(1)
+        self.run_copy()
+        self.assertEqual(len(self.hashed), 2)
+        self.assertEqual(self.executor.mismatches, 1)
+        self.assertEqual(self.executor.verified, 1)
+        self.assertEqual(self.read("a"), b"a" * 100000)
+        self.assertEqual(self.manifest_lines(),
+                         [(hashlib.sha256(b"a" * 100000).hexdigest(),
+                           os.path.join(self.dst, "a"))])
+
+    def test_mismatch_is_reported(self):
+        self.corrupt(copier.CopyExecutor.VERIFY_ATTEMPTS)
+        self.assertRaises(Exception, self.run_copy)
+        self.assertEqual(len(self.hashed), copier.CopyExecutor.VERIFY_ATTEMPTS)
+        self.assertEqual(self.executor.mismatches,
+                         copier.CopyExecutor.VERIFY_ATTEMPTS)
+        self.assertEqual(self.executor.verified, 0)
+        self.assertEqual(self.target_files(), [])
+        self.assertFalse(os.path.exists(self.manifest.filename))
+
+
+class TestOrder(CopyTestCase):
+    def setUp(self):
+        CopyTestCase.setUp(self)
+        # the later files are larger, so the orders differ
+        self.names = ["f%d" % i for i in range(8)]
+        for i, name in enumerate(self.names):
+            self.write(os.path.join("src", name), b"x" * (4096 * (i + 1)))
+        self.inodes = dict((name, os.stat(os.path.join(self.src, name)).st_ino)
+                           for name in self.names)
+
+    def run_copy(self, order):
+        """The names of the files in the order they were copied"""
+        plan = self.plan()
+        for name in self.names:
+            self.add_file(plan, name, name)
+        executor = copier.CopyExecutor(workers=1, order=order)
+        executed = []
+        execute = executor.execute
+
+        def recording_execute(op):
+            executed.append(os.path.basename(op.src))
+            execute(op)
+        executor.execute = recording_execute
+        executor.run(plan)
+        self.assertEqual(self.target_files(), self.names)
+        return executed
+
+    def test_size(self):
+        self.assertEqual(self.run_copy("size"), self.names[::-1])
+
+    def test_inode(self):
+        self.assertEqual(self.run_copy("inode"),
+                         sorted(self.names, key=self.inodes.get))
+
+    def test_extent(self):
+        def key(name):
+            try:
+                offset = copier.physical_offset(os.path.join(self.src, name))
+            except (IOError, OSError):
+                offset = None
+            if offset is None:
+                return (1, self.inodes[name])
+            return (0, offset)
+        self.assertEqual(self.run_copy("extent"), sorted(self.names, key=key))
+
+    def test_extent_without_fiemap(self):
+        calls = []
+
+        def unavailable(path):
+            calls.append(path)
+            raise IOError(errno.ENOTTY, os.strerror(errno.ENOTTY))
+        self.addCleanup(setattr, copier, "physical_offset",
+                        copier.physical_offset)
+        copier.physical_offset = unavailable
+        self.addCleanup(copier._no_fiemap.clear)
+        self.assertEqual(self.run_copy("extent"),
+                         sorted(self.names, key=self.inodes.get))
+        # the device isn't asked again for the other files
+        self.assertEqual(len(calls), 1)
+
+
+class TestModes(CopyTestCase):
+    def setUp(self):
+        CopyTestCase.setUp(self)
+        self.write_sources()
+
+    def write_sources(self):
+        for relpath in "a", os.path.join("t", "b"), os.path.join("t", "u", "c"):
+            self.write(os.path.join("src", relpath), relpath.encode())
+
+    def source_files(self):
+        return sorted(os.path.relpath(os.path.join(dirpath, name), self.src)
+                      for dirpath, dirnames, filenames in os.walk(self.src)
+                      for name in filenames)
+
+    def test_link(self):
+        plan = self.plan(mode="link")
+        self.add_tree(plan, "t", "T")
+        self.add_file(plan, "a", "a")
+        copier.CopyExecutor().run(plan)
+        for src, dst in ("a", "a"), (os.path.join("t", "b"), os.path.join("T", "b")):
+            self.assertEqual(os.stat(os.path.join(self.src, src)).st_ino,
+                             os.stat(os.path.join(self.dst, dst)).st_ino)
+        self.assertEqual(set(op.method for op in plan.operations),
+                         set(["link"]))
+
+    def test_move_directory(self):
+        plan = self.plan(mode="move")
+        self.add_tree(plan, "t", "T")
+        [op] = plan.operations
+        self.assertTrue(op.is_directory)
+        self.assertEqual((op.files, op.size), (2, 8))
+        copier.CopyExecutor().run(plan)
+        self.assertEqual(self.source_files(), ["a"])
+        self.assertEqual(self.target_files(), [os.path.join("T", "b"),
+                                               os.path.join("T", "u", "c")])
+
+    def test_move_above_a_moved_directory(self):
+        plan = self.plan(mode="move")
+        self.add_tree(plan, os.path.join("t", "u"), os.path.join("F", "d1"))
+        self.add_tree(plan, "t", "F")
+        copier.CopyExecutor().run(plan)
+        # c is copied to both of its targets
+        self.assertEqual(self.source_files(), ["a", os.path.join("t", "u", "c")])
+        self.assertEqual(self.target_files(),
+                         [os.path.join("F", "b"), os.path.join("F", "d1", "c"),
+                          os.path.join("F", "u", "c")])
+
+    def test_move_of_a_file_in_a_moved_directory(self):
+        for first in range(2):
+            self.write_sources()
+            plan = self.plan(mode="move")
+            adds = [lambda: self.add_tree(plan, "t", "T"),
+                    lambda: self.add_file(plan, os.path.join("t", "b"), "b")]
+            adds[first]()
+            adds[1 - first]()
+            self.assertFalse(any(op.is_directory for op in plan.operations))
+            copier.CopyExecutor().run(plan)
+            self.assertEqual(self.target_files(),
+                             [os.path.join("T", "b"),
+                              os.path.join("T", "u", "c"), "b"])
+            shutil.rmtree(self.dst)
+
+
+class TestMetadata(CopyTestCase):
+    def setUp(self):
+        CopyTestCase.setUp(self)
+        self.write(os.path.join("src", "t", "a"), b"a")
+        os.chmod(os.path.join(self.src, "t", "a"), 0o640)
+        os.utime(os.path.join(self.src, "t", "a"), (1000000000, 1000000000))
+        os.utime(os.path.join(self.src, "t"), (1100000000, 1100000000))
+
+    def test_times_and_mode(self):
+        plan = self.plan()
+        self.add_tree(plan, "t", "T")
+        copier.CopyExecutor().run(plan)
+        st = os.stat(os.path.join(self.dst, "T", "a"))
+        self.assertEqual((st.st_mtime, st.st_mode & 0o777),
+                         (1000000000, 0o640))
+        self.assertEqual(os.stat(os.path.join(self.dst, "T")).st_mtime,
+                         1100000000)
+
+    def test_source_changed_after_the_scan(self):
+        plan = self.plan()
+        self.add_tree(plan, "t", "T")
+        # modified in place, the scan (or its index) doesn't know
+        os.chmod(os.path.join(self.src, "t", "a"), 0o600)
+        os.utime(os.path.join(self.src, "t", "a"), (1200000000, 1200000000))
+        copier.CopyExecutor().run(plan)
+        st = os.stat(os.path.join(self.dst, "T", "a"))
+        self.assertEqual((st.st_mtime, st.st_mode & 0o777),
+                         (1200000000, 0o600))
+
+    def test_nothing_preserved(self):
+        plan = self.plan()
+        self.add_tree(plan, "t", "T")
+        copier.CopyExecutor(preserve=()).run(plan)
+        st = os.stat(os.path.join(self.dst, "T", "a"))
+        self.assertNotEqual(st.st_mtime, 1000000000)
+        self.assertEqual(st.st_mode & 0o777, copier.DEFAULT_MODE)
+
+
+class TestResume(CopyTestCase):
+    def setUp(self):
+        CopyTestCase.setUp(self)
+        for name in "abc":
+            path = self.write(os.path.join("src", "t", name),
+                              name.encode() * 10)
+            # older than the copies
+            os.utime(path, (1000000000, 1000000000))
+        self.journal = copier.Journal(os.path.join(self.root, "journal"))
+
+    def interrupt(self, preserve=copier.METADATA):
+        """Plans the copy of the tree, carries out its first operation and
+        stops without recording that, like an interrupted run"""
+        plan = self.plan()
+        self.add_tree(plan, "t", "T")
+        self.journal.create(plan)
+        executor = copier.CopyExecutor(preserve=preserve, journal=self.journal)
+        executor.execute(plan.operations[0])
+        # a partial file of the copy which was going on
+        copier.partial_file(plan.operations[1].dst)
+        return plan
+
+    def resume(self, preserve=copier.METADATA):
+        plan = copier.Journal(self.journal.filename).resume()
+        copier.CopyExecutor(preserve=preserve).run(plan)
+        return plan
+
+    def test_resume(self):
+        self.interrupt()
+        plan = self.resume()
+        self.assertEqual(len(plan.completed), 1)
+        self.assertEqual(len(plan.operations), 2)
+        self.assertEqual(self.target_files(),
+                         [os.path.join("T", name) for name in "abc"])
+        self.assertEqual(self.read(os.path.join("T", "c")), b"c" * 10)
+
+    def test_resume_without_preserved_times(self):
+        self.interrupt(preserve=())
+        plan = self.resume(preserve=())
+        self.assertEqual(len(plan.completed), 1)
+
+    def test_changed_copy_is_refused(self):
+        plan = self.interrupt()
+        with open(plan.operations[0].dst, "ab") as f:
+            f.write(b"changed")
+        self.assertRaises(Exception, self.resume)
+
+    def test_move_interrupted_after_the_copy(self):
+        plan = self.plan(mode="move")
+        self.add_file(plan, os.path.join("t", "a"), "a")
+        self.journal.create(plan)
+        op = plan.operations[0]
+        # a move across mounts, copied and renamed into place
+        self.journal.copied(op)
+        os.mkdir(self.dst)
+        shutil.copy2(op.src, op.dst)
+        plan = self.resume()
+        self.assertEqual(len(plan.completed), 1)
+        self.assertFalse(os.path.exists(op.src))
+        self.assertEqual(self.read("a"), b"a" * 10)
+
+    def test_move_interrupted_before_the_rename(self):
+        plan = self.plan(mode="move")
+        self.add_file(plan, os.path.join("t", "a"), "a")
+        self.journal.create(plan)
+        self.journal.copied(plan.operations[0])
+        plan = self.resume()
+        self.assertEqual(plan.completed, [])
+        self.assertFalse(os.path.exists(os.path.join(self.src, "t", "a")))
+        self.assertEqual(self.read("a"), b"a" * 10)
+
+    def test_move_across_mounts(self):
+        src = os.path.join(self.src, "t", "a")
+        rename = os.rename
+
+        def cross_mount_rename(a, b):
+            if a == src:
+                raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+            rename(a, b)
+        os.rename = cross_mount_rename
+        self.addCleanup(setattr, os, "rename", rename)
+        plan = self.plan(mode="move")
+        self.add_file(plan, os.path.join("t", "a"), "a")
+        self.journal.create(plan)
+        copier.CopyExecutor(journal=self.journal).run(plan)
+        self.assertFalse(os.path.exists(src))
+        self.assertEqual(self.read("a"), b"a" * 10)
+        with open(self.journal.filename) as f:
+            self.assertIn('{"copied": 0}\n', f.readlines())
+
+    def test_target_the_run_did_not_write(self):
+        plan = self.plan()
+        self.add_tree(plan, "t", "T")
+        self.journal.create(plan)
+        # there before, but just like a copy
+        shutil.copytree(os.path.join(self.src, "t"), os.path.join(self.dst, "T"))
+        plan = copier.Journal(self.journal.filename).resume()
+        self.assertEqual(plan.completed, [])
+        self.assertRaises(Exception, copier.CopyExecutor().run, plan)
+
+    def test_failed_run_is_not_resumed(self):
+        self.write(os.path.join("dst", "T", "b"), b"other")
+        plan = self.plan()
+        self.add_tree(plan, "t", "T")
+        self.journal.create(plan)
+        executor = copier.CopyExecutor(journal=self.journal)
+        self.assertRaises(Exception, executor.run, plan)
+        self.assertFalse(self.journal.exists())
+
+    def test_incompatible_journal(self):
+        with open(self.journal.filename, "w") as f:
+            f.write('{"journal": 1, "mode": "copy"}\n')
+        self.assertRaises(Exception, self.journal.resume)
+
+
+if __name__ == '__main__':
+    unittest.main()
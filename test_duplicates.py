@@ -0,0 +1,68 @@
+"""Tests for the detection of files with identical content"""
+
+import os
+
+import duplicates
+from test_scanner import TreeTestCase
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class TestFindDuplicates(TreeTestCase):
+    def files(self, *relpaths):
+        result = []
+        for relpath in relpaths:
+            st = os.stat(os.path.join(self.root, relpath))
+            result.append((relpath, st.st_size, (st.st_dev, st.st_ino)))
+        return result
+
+    def find(self, *relpaths):
+        return duplicates.find_duplicates(self.files(*relpaths), self.root,
+                                          workers=2)
+
+    def test_same_content(self):
+        self.write("a", b"same")
+        self.write("b", b"same")
+        self.write("c", b"same")
+        self.write("d", b"diff")
+        self.assertEqual(self.find("d", "c", "b", "a"), [["a", "b", "c"]])
+
+    def test_same_size_different_content(self):
+        self.write("a", b"one")
+        self.write("b", b"two")
+        self.assertEqual(self.find("a", "b"), [])
+
+    def test_different_in_the_middle(self):
+        # the first and last blocks are the same, only the full hash differs
+        block = duplicates.BLOCK_SIZE
+        self.write("a", b"x" * block + b"1" * block + b"y" * block)
+        self.write("b", b"x" * block + b"2" * block + b"y" * block)
+        self.write("c", b"x" * block + b"1" * block + b"y" * block)
+        self.assertEqual(self.find("a", "b", "c"), [["a", "c"]])
+
+    def test_hard_links(self):
+        self.write("a", b"linked")
+        os.link(os.path.join(self.root, "a"), os.path.join(self.root, "b"))
+        self.write("c", b"unique")
+        self.assertEqual(self.find("a", "b", "c"), [["a", "b"]])
+
+    def test_hard_links_and_copies(self):
+        self.write("a", b"content")
+        os.link(os.path.join(self.root, "a"), os.path.join(self.root, "b"))
+        self.write("c", b"content")
+        self.assertEqual(self.find("a", "b", "c"), [["a", "b", "c"]])
+
+    def test_empty_and_missing_files(self):
+        self.write("a", b"")
+        self.write("b", b"")
+        self.write("c", b"gone")
+        self.write("d", b"gone")
+        files = self.files("a", "b", "c", "d")
+        os.remove(os.path.join(self.root, "d"))
+        self.assertEqual(duplicates.find_duplicates(files, self.root), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
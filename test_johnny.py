@@ -0,0 +1,84 @@
+"""Tests running johnny_bootstrap.py on a temporary tree"""
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from test_scanner import TreeTestCase
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "johnny_bootstrap.py")
+
+ORG = u"""* Organize files
+:PROPERTIES:
+:sourcedir: %(root)s/src
+:targetdir: %(root)s/dst
+:subgroups-per-group: 30
+:END:
+
+|g/s/f|k|kept.txt|
+|g/s/h|K|d/|
+
+* Category tree
+"""
+
+
+@unittest.skipIf(sys.version_info[0] > 2, "johnny_bootstrap.py is Python 2")
+class TestWatch(TreeTestCase):
+    def setUp(self):
+        TreeTestCase.setUp(self)
+        self.write(os.path.join("src", "kept.txt"))
+        self.write(os.path.join("src", "d", "x.txt"))
+        self.org = self.write("t.org", (ORG % {"root": self.root}).encode())
+        self.log = open(os.path.join(self.root, "log"), "w+")
+        self.addCleanup(self.log.close)
+
+    def start(self, *args):
+        process = subprocess.Popen([sys.executable, "-u", SCRIPT] +
+                                   list(args) + [self.org],
+                                   stdout=self.log, stderr=subprocess.STDOUT)
+        self.addCleanup(self.stop, process)
+        return process
+
+    def stop(self, process):
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)
+            process.wait()
+
+    def output(self):
+        self.log.seek(0)
+        return self.log.read()
+
+    def wait_for(self, process, text):
+        """Waits until the org file has text in it"""
+        deadline = time.time() + 20
+        while time.time() < deadline:
+            self.assertIsNone(process.poll(), self.output())
+            with open(self.org) as f:
+                if text in f.read():
+                    return
+            time.sleep(0.1)
+        self.fail("%r not written:\n%s" % (text, self.output()))
+
+    def test_two_refreshes(self):
+        process = self.start("--watch")
+        self.wait_for(process, "30-59 g")
+        # the category tree is rebuilt on each update
+        for name in "new1.txt", "new2.txt":
+            self.write(os.path.join("src", name))
+            self.wait_for(process, name)
+        self.stop(process)
+        with open(self.org) as f:
+            text = f.read()
+        self.assertEqual(text.count("30-59 g"), 1, text)
+        self.assertNotIn("Traceback", self.output())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+"""Tests for the directory scanner"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import scanner
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class TreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, relpath, data=b"data"):
+        abspath = os.path.join(self.root, relpath)
+        if not os.path.isdir(os.path.dirname(abspath)):
+            os.makedirs(os.path.dirname(abspath))
+        with open(abspath, "wb") as f:
+            f.write(data)
+        return abspath
+
+
+class TestScanner(TreeTestCase):
+    def setUp(self):
+        TreeTestCase.setUp(self)
+        self.write(os.path.join("a", "x.txt"), b"x" * 10)
+        self.write(os.path.join("a", "b", "y.txt"))
+        self.write("c.txt")
+        # back to the root, a loop
+        os.symlink(self.root, os.path.join(self.root, "a", "loop"))
+
+    def walk(self, **kwargs):
+        source = scanner.Scanner(self.root, **kwargs)
+        self.addCleanup(source.close)
+        return source, [e.relpath for e in source.walk()]
+
+    def test_walk_one_level_at_a_time(self):
+        source, relpaths = self.walk()
+        join = os.path.join
+        self.assertEqual(relpaths, ["a", "c.txt",
+                                    join("a", "b"), join("a", "loop"),
+                                    join("a", "x.txt"),
+                                    join("a", "b", "y.txt")])
+        self.assertEqual(source.skipped, [join("a", "loop")])
+
+    def test_workers_keep_the_order(self):
+        self.assertEqual(self.walk(workers=4)[1], self.walk()[1])
+
+    def test_pool_is_closed(self):
+        # two directories on a level, which are listed on the pool
+        self.write(os.path.join("d", "z.txt"))
+        with scanner.Scanner(self.root, workers=4) as source:
+            list(source.walk())
+            self.assertIsNotNone(source._pool)
+        self.assertIsNone(source._pool)
+        # used again after close(), like plan_copy() does
+        with source:
+            source.reset()
+            list(source.walk())
+            self.assertIsNotNone(source._pool)
+        self.assertIsNone(source._pool)
+
+    def test_stat_data(self):
+        source = scanner.Scanner(self.root)
+        entries = dict((e.relpath, e) for e in source.walk())
+        x = entries[os.path.join("a", "x.txt")]
+        st = os.stat(os.path.join(self.root, "a", "x.txt"))
+        self.assertEqual((x.size, x.mtime, x.inode, x.is_directory),
+                         (10, st.st_mtime, st.st_ino, False))
+        loop = entries[os.path.join("a", "loop")]
+        self.assertTrue(loop.is_symlink and loop.is_directory)
+
+    def test_descend(self):
+        source = scanner.Scanner(self.root)
+        relpaths = [e.relpath for e in
+                    source.walk(descend=lambda e: e.name != "b")]
+        self.assertNotIn(os.path.join("a", "b", "y.txt"), relpaths)
+        self.assertIn(os.path.join("a", "b"), relpaths)
+
+    def test_stat_paths(self):
+        source = scanner.Scanner(self.root)
+        found, missing = source.stat_paths(["c.txt", "missing"])
+        self.assertEqual(found.relpath, "c.txt")
+        self.assertIsNone(missing)
+
+
+class TestPathIndex(unittest.TestCase):
+    def setUp(self):
+        join = os.path.join
+        self.index = scanner.PathIndex([(join("a", ""), "u"),
+                                        (join("a", "b", ""), "k"),
+                                        (join("a", "b", "c", "d"), "u"),
+                                        ("e", "d")])
+
+    def test_lookups(self):
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index["a"], "u")
+        self.assertIn(os.path.join("a", "b"), self.index)
+        self.assertNotIn(os.path.join("a", "b", "c"), self.index)
+        del self.index[os.path.join("a", "b", "c", "d")]
+        self.assertNotIn(os.path.join("a", "b", "c", "d"), self.index)
+        self.assertEqual(len(self.index), 3)
+
+    def test_nearest_covering_path(self):
+        join = os.path.join
+        self.assertEqual(self.index.covering(join("a", "b", "c", "d")),
+                         (join("a", "b"), "k"))
+        self.assertEqual(self.index.covering(join("a", "x")), ("a", "u"))
+        self.assertEqual(self.index.covering(join("e", "f", "g")), ("e", "d"))
+        self.assertIsNone(self.index.covering("a"))
+        self.assertIsNone(self.index.covering(join("x", "y")))
+
+    def test_matching_covering_path(self):
+        join = os.path.join
+        self.assertEqual(self.index.covering(join("a", "b", "c", "d"),
+                                             lambda action: action == "u"),
+                         ("a", "u"))
+        self.assertIsNone(self.index.covering(join("a", "x"),
+                                              lambda action: action == "k"))
+
+
+class TestScanIndex(TreeTestCase):
+    def setUp(self):
+        TreeTestCase.setUp(self)
+        self.write(os.path.join("a", "x.txt"))
+        handle, self.filename = tempfile.mkstemp(suffix=".scanindex")
+        os.close(handle)
+        self.addCleanup(os.remove, self.filename)
+        self.age(3600)
+
+    def age(self, seconds):
+        # directories modified during the scan are not stored, and whole
+        # seconds survive the round trip through a float
+        past = int(time.time()) - seconds
+        for relpath in "", "a":
+            os.utime(os.path.join(self.root, relpath), (past, past))
+
+    def scan(self, rescan=False):
+        """The entries by relpath, scanned with the index unless rescan"""
+        index = scanner.ScanIndex(self.filename, self.root)
+        if not rescan:
+            index.load()
+        source = scanner.Scanner(self.root, index=index)
+        entries = dict((e.relpath, e) for e in source.walk())
+        index.save()
+        return entries
+
+    def test_unchanged_directories_are_reused(self):
+        x = os.path.join("a", "x.txt")
+        self.scan()
+        # modified in place, which doesn't change the mtime of "a"
+        self.write(x, b"longer data")
+        self.age(3600)
+        self.assertEqual(self.scan()[x].size, 4)
+        self.assertEqual(self.scan(rescan=True)[x].size, 11)
+        self.assertEqual(self.scan()[x].size, 11)
+
+    def test_changed_directories_are_listed_again(self):
+        self.scan()
+        self.write(os.path.join("a", "new.txt"))
+        self.age(7200)
+        self.assertIn(os.path.join("a", "new.txt"), self.scan())
+
+    def test_recently_changed_directories_are_not_stored(self):
+        self.write(os.path.join("a", "new.txt"))
+        self.scan()
+        index = scanner.ScanIndex(self.filename, self.root)
+        self.assertTrue(index.load())
+        self.assertNotIn("a", index.directories)
+
+    def test_unchanged_index_is_not_written_again(self):
+        self.scan()
+        written = os.stat(self.filename)
+        self.scan()
+        self.assertEqual(os.stat(self.filename).st_ino, written.st_ino)
+
+    def test_directories_not_listed_are_dropped(self):
+        self.scan()
+        shutil.rmtree(os.path.join(self.root, "a"))
+        past = int(time.time()) - 7200
+        os.utime(self.root, (past, past))
+        self.scan()
+        index = scanner.ScanIndex(self.filename, self.root)
+        self.assertTrue(index.load())
+        self.assertEqual(list(index.directories), [""])
+
+    def test_other_root(self):
+        self.scan()
+        self.assertFalse(scanner.ScanIndex(self.filename, "/elsewhere").load())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Tests for the change notification of the --watch mode"""
+
+import os
+import sys
+import time
+
+import scanner
+import watcher
+from test_scanner import TreeTestCase
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class WatcherTestCase(TreeTestCase):
+    def setUp(self):
+        TreeTestCase.setUp(self)
+        self.write(os.path.join("d", "x.txt"))
+        os.symlink(os.path.join(self.root, "d"),
+                   os.path.join(self.root, "link"))
+        # the scanner only remembers its listings with an index
+        index = scanner.ScanIndex(os.path.join(self.root, "index"), self.root)
+        self.source = scanner.Scanner(self.root, index=index)
+        for relpath in "", "d", "link":
+            self.source.list_dir(relpath)
+
+    def wait(self, w, expected):
+        """Waits until w reports all of expected, returns what it reported"""
+        changed = set()
+        deadline = time.time() + 10
+        while not expected <= changed and time.time() < deadline:
+            changed.update(w.wait(timeout=0.1))
+        return changed
+
+
+class TestPollingWatcher(WatcherTestCase):
+    def test_changed_directory(self):
+        w = watcher.PollingWatcher(self.source, interval=0.0)
+        self.assertEqual(w.wait(timeout=0.1), set())
+        self.write(os.path.join("d", "new.txt"))
+        os.utime(os.path.join(self.root, "d"), (0, 0))
+        self.assertEqual(self.wait(w, set(["d", "link"])), set(["d", "link"]))
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), "needs inotify")
+class TestInotifyWatcher(WatcherTestCase):
+    def setUp(self):
+        WatcherTestCase.setUp(self)
+        self.watcher = watcher.InotifyWatcher(self.source)
+        self.addCleanup(self.watcher.close)
+        self.watcher.sync()
+
+    def test_changed_directory(self):
+        self.write(os.path.join("d", "new.txt"))
+        self.assertEqual(self.wait(self.watcher, set(["d", "link"])),
+                         set(["d", "link"]))
+
+    def test_symlinked_directory_shares_the_watch(self):
+        self.assertEqual(self.watcher.watched["d"],
+                         self.watcher.watched["link"])
+        # forgetting one path keeps the watch of the other
+        self.source.forget("link")
+        self.watcher.sync()
+        self.assertEqual(set(self.watcher.watched), set(["", "d"]))
+        self.write(os.path.join("d", "new.txt"))
+        self.assertIn("d", self.wait(self.watcher, set(["d"])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+"""
+Change notification for the --watch mode of johnny_bootstrap.
+
+A watcher reports which of the directories listed by a scanner.Scanner have
+changed on disk. InotifyWatcher gets the changes from the Linux kernel as
+they happen, PollingWatcher works everywhere by comparing the mtimes of the
+directories at a fixed interval.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+
+class PollingWatcher(object):
+    """
+    Stats every listed directory once per interval.
+
+    Like the scan index this only notices entries being added, removed or
+    renamed, files modified in place don't change the mtime of their
+    directory.
+    """
+
+    def __init__(self, source, interval=5.0):
+        self.source = source
+        self.interval = interval
+        self.last_poll = time.time()
+
+    def sync(self):
+        """Picks up directories listed since the last call, nothing to do"""
+        pass
+
+    def wait(self, timeout):
+        """Waits at most timeout seconds. Returns the set of relpaths of the
+        directories that have changed."""
+        remaining = self.last_poll + self.interval - time.time()
+        if remaining > timeout:
+            time.sleep(timeout)
+            return set()
+        if remaining > 0:
+            time.sleep(remaining)
+        self.last_poll = time.time()
+        return set(self.source.changed_directories())
+
+    def close(self):
+        pass
+
+
+# from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_event = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+class InotifyWatcher(object):
+    """
+    Gets change events for every listed directory from inotify.
+
+    Each directory needs its own watch, so a large tree may run into the
+    fs.inotify.max_user_watches limit. sync() raises OSError in that case and
+    the caller can fall back to a PollingWatcher.
+    """
+
+    MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+            IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF |
+            IN_ONLYDIR)
+
+    def __init__(self, source):
+        self.source = source
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+        # watch descriptor -> relpaths, the same directory reached through a
+        # symlink has the same watch descriptor
+        self.wds = {}
+        self.watched = {}  # relpath -> watch descriptor
+        self.overflowed = False
+
+    def _raise(self, path=None):
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+
+    def sync(self):
+        """Adds watches for directories listed since the last call and
+        removes the watches of directories the scanner has forgotten"""
+        directories = set(self.source.directories())
+        for relpath in list(self.watched):
+            if relpath not in directories:
+                wd = self.watched.pop(relpath)
+                relpaths = self.wds.get(wd)
+                if relpaths is None:
+                    continue  # the watch is gone already
+                relpaths.discard(relpath)
+                if not relpaths:
+                    del self.wds[wd]
+                    self.libc.inotify_rm_watch(self.fd, wd)
+        for relpath in directories:
+            if relpath in self.watched:
+                continue
+            abspath = os.path.join(self.source.root, relpath)
+            if not isinstance(abspath, bytes):
+                abspath = abspath.encode(sys.getfilesystemencoding())
+            wd = self.libc.inotify_add_watch(self.fd, abspath, self.MASK)
+            if wd < 0:
+                if ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+                    continue  # already gone again, the parent will report it
+                self._raise(abspath)
+            self.wds.setdefault(wd, set()).add(relpath)
+            self.watched[relpath] = wd
+
+    def wait(self, timeout):
+        """Waits at most timeout seconds. Returns the set of relpaths of the
+        directories that have changed."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, length = _event.unpack_from(data, pos)
+                pos += _event.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # events were lost, check everything
+                    self.overflowed = True
+                    continue
+                relpaths = self.wds.get(wd)
+                if relpaths is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self.wds[wd]
+                    for relpath in relpaths:
+                        self.watched.pop(relpath, None)
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    changed.update(os.path.dirname(relpath)
+                                   for relpath in relpaths)
+                else:
+                    changed.update(relpaths)
+
+        if self.overflowed:
+            self.overflowed = False
+            changed.update(self.source.directories())
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def make_watcher(source):
+    """Returns an InotifyWatcher where inotify is available, otherwise a
+    PollingWatcher"""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(source)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(source)